@@ -0,0 +1,352 @@
+"""
+Minimal in-process client for the adb server smart-socket protocol.
+
+Talks to the adb server on TCP 5037 directly so common commands do not
+need to spawn a shell and an adb client process each time.
+"""
+import asyncio
+import codecs
+import os
+import socket
+from contextlib import contextmanager
+from time import perf_counter
+
+from commands import split_args
+from jobs import track, untrack
+from metrics import note_output, note_spawn
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5037
+
+
+class AdbError(Exception):
+    """Raised when the adb server rejects a request."""
+
+
+class AdbConnectionError(AdbError):
+    """Raised when the adb server cannot be reached at all."""
+
+
+class ShellSessionError(AdbError):
+    """Raised when a device cannot open a persistent shell-v2 session."""
+
+
+class AdbClient:
+    """Speaks the adb server protocol (host:* and transport services)."""
+
+    def __init__(self, host=DEFAULT_HOST, port=None, timeout=5.0):
+        if port is None:
+            port = int(os.environ.get("ANDROID_ADB_SERVER_PORT", DEFAULT_PORT))
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def _open(self):
+        """Open a new socket to the adb server."""
+        try:
+            return socket.create_connection((self.host, self.port),
+                                            timeout=self.timeout)
+        except OSError as e:
+            raise AdbConnectionError(f"cannot reach adb server on "
+                                     f"{self.host}:{self.port}: {e}") from e
+
+    @staticmethod
+    def _recv_exact(sock, size):
+        """Read exactly size bytes from the socket."""
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise AdbError("adb server closed the connection")
+            data += chunk
+        return data
+
+    @staticmethod
+    def _send_request(sock, request):
+        """Send a length-prefixed request to the adb server."""
+        payload = request.encode("utf-8")
+        sock.sendall(f"{len(payload):04x}".encode("ascii") + payload)
+
+    def _read_string(self, sock):
+        """Read a hex length-prefixed string from the adb server."""
+        length = int(self._recv_exact(sock, 4), 16)
+        return self._recv_exact(sock, length).decode("utf-8", errors="replace")
+
+    def _read_status(self, sock):
+        """Read an OKAY/FAIL status, raising AdbError on FAIL."""
+        status = self._recv_exact(sock, 4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            raise AdbError(self._read_string(sock))
+        raise AdbError(f"unexpected response from adb server: {status!r}")
+
+    def request(self, sock, request):
+        """Send a request on an open socket and check its status."""
+        self._send_request(sock, request)
+        self._read_status(sock)
+
+    def query(self, request):
+        """Run a host request that answers with a single string."""
+        with self._open() as sock:
+            self.request(sock, request)
+            return self._read_string(sock)
+
+    def version(self):
+        """Return the adb server protocol version number."""
+        return int(self.query("host:version"), 16)
+
+    def devices(self):
+        """Return a list of (serial, state) tuples for attached devices."""
+        return parse_devices(self.query("host:devices"))
+
+    def connect(self, address):
+        """Connect the adb server to a device over TCP/IP."""
+        return self.query(f"host:connect:{address}")
+
+    def disconnect(self, address=""):
+        """Disconnect one TCP/IP device, or all of them if no address is given."""
+        if address:
+            return self.query(f"host:disconnect:{address}")
+        return self.query("host:disconnect:")
+
+    def track_devices(self):
+        """Yield the full device list each time the adb server reports a change."""
+        with self._open() as sock:
+            self.request(sock, "host:track-devices")
+            sock.settimeout(None)
+            while True:
+                yield parse_devices(self._read_string(sock))
+
+    async def watch_devices(self):
+        """Like track_devices, but as an async generator for the event loop."""
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise AdbConnectionError(f"cannot reach adb server on "
+                                     f"{self.host}:{self.port}: {e}") from e
+        try:
+            payload = b"host:track-devices"
+            writer.write(f"{len(payload):04x}".encode("ascii") + payload)
+            await writer.drain()
+            status = await reader.readexactly(4)
+            if status == b"FAIL":
+                length = int(await reader.readexactly(4), 16)
+                raise AdbError((await reader.readexactly(length)).decode("utf-8", errors="replace"))
+            if status != b"OKAY":
+                raise AdbError(f"unexpected response from adb server: {status!r}")
+            while True:
+                length = int(await reader.readexactly(4), 16)
+                listing = await reader.readexactly(length)
+                yield parse_devices(listing.decode("utf-8", errors="replace"))
+        except asyncio.IncompleteReadError as e:
+            raise AdbError("adb server closed the connection") from e
+        finally:
+            writer.close()
+
+    def transport(self, serial=None):
+        """
+        Open a socket switched to the transport of a device. Without a serial
+        the device is ANDROID_SERIAL if set, else any device, like adb picks it.
+        """
+        serial = serial or os.environ.get("ANDROID_SERIAL")
+        sock = self._open()
+        try:
+            if serial:
+                self.request(sock, f"host:transport:{serial}")
+            else:
+                self.request(sock, "host:transport-any")
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def shell(self, command, serial=None, chunk_size=65536):
+        """Run a shell command on a device and yield its output as bytes."""
+        yield from self._stream(f"shell:{command}", serial, chunk_size)
+
+    def exec_out(self, command, serial=None, chunk_size=65536):
+        """Run a command on a device without a shell in between, yielding raw bytes."""
+        yield from self._stream(f"exec:{command}", serial, chunk_size)
+
+    def exec_out_into(self, command, buffer, serial=None):
+        """
+        Run a command without a shell and read all of its output into buffer.
+
+        The bytearray is reused across calls and grown when the output does
+        not fit, so repeated binary captures do not allocate per chunk.
+
+        Returns:
+            int: Number of bytes read into the start of buffer.
+        """
+        with self._service(f"exec:{command}", serial) as sock:
+            size = 0
+            while True:
+                if size == len(buffer):
+                    buffer.extend(bytes(max(len(buffer), 1 << 20)))
+                with memoryview(buffer) as view:
+                    count = sock.recv_into(view[size:])
+                if not count:
+                    return size
+                note_output(count)
+                size += count
+
+    def exec_out_chunks(self, command, buffer, serial=None):
+        """
+        Run a command without a shell, yielding its output as memoryviews of buffer.
+
+        Each view is only valid until the next one is requested; this is for
+        binary streams that are written straight on, e.g. to a file.
+        """
+        with self._service(f"exec:{command}", serial) as sock, memoryview(buffer) as view:
+            while True:
+                count = sock.recv_into(view)
+                if not count:
+                    break
+                note_output(count)
+                yield view[:count]
+
+    @contextmanager
+    def _service(self, service, serial):
+        """Open a device service, yielding its socket with the timeout lifted."""
+        started = perf_counter()
+        sock = self.transport(serial)
+        track(sock)
+        try:
+            with sock:
+                self.request(sock, service)
+                note_spawn(perf_counter() - started)
+                sock.settimeout(None)
+                yield sock
+        finally:
+            untrack(sock)
+
+    def _stream(self, service, serial, chunk_size):
+        """Open a device service and yield what it sends until it closes."""
+        with self._service(service, serial) as sock:
+            while True:
+                chunk = sock.recv(chunk_size)
+                if not chunk:
+                    break
+                note_output(len(chunk))
+                yield chunk
+
+
+def parse_devices(listing):
+    """Parse a host:devices listing into (serial, state) tuples."""
+    devices = []
+    for line in listing.splitlines():
+        parts = line.split("\t")
+        if len(parts) >= 2 and parts[0]:
+            devices.append((parts[0], parts[1].strip()))
+    return devices
+
+
+def connect_succeeded(reply):
+    """Check whether a host:connect reply reports success."""
+    return "cannot" not in reply.lower() and "failed" not in reply.lower()
+
+
+def run_native_command(client, args, prefix="", sessions=None):
+    """
+    Runs an adb command through the in-process adb client, printing its output.
+
+    Args:
+        client (AdbClient): The client to run the command with.
+        args (str): The adb arguments, without the adb executable prefix.
+        prefix (str): Text printed in front of every output line.
+        sessions (ShellSessions): Persistent shell sessions for shell commands.
+
+    Returns:
+        True/False for success, or None if the command is not supported
+        natively and must be run by the adb executable instead.
+    """
+    try:
+        parts = split_args(args)  # Backslashes reach the device, as with adb.exe
+    except ValueError:
+        return None
+    serial = None
+    if len(parts) >= 3 and parts[0] == "-s":
+        serial = parts[1]
+        parts = parts[2:]
+    if not parts:
+        return None
+    name = parts[0].lower()
+    if name == "devices" and len(parts) == 1:
+        # Query first, so nothing is printed before a fallback to the adb executable
+        devices = client.devices()
+        print(f"{prefix}List of devices attached\n", end='')
+        for device_serial, state in devices:
+            print(f"{prefix}{device_serial}\t{state}\n", end='')
+        print()
+        return True
+    if name == "version" and len(parts) == 1:
+        print(f"{prefix}Android Debug Bridge version 1.0.{client.version()}\n", end='')
+        return True
+    if name == "connect" and len(parts) == 2:
+        reply = client.connect(parts[1])
+        print(f"{prefix}{reply}\n", end='')
+        return connect_succeeded(reply)
+    if name == "disconnect" and len(parts) <= 2:
+        reply = client.disconnect(parts[1] if len(parts) == 2 else "")
+        print(f"{prefix}{reply}\n", end='')
+        return "cannot" not in reply.lower() and "no such device" not in reply.lower()
+    if name == "shell" and len(parts) >= 2 and not parts[1].startswith("-"):
+        return stream_shell(client, " ".join(parts[1:]), serial, prefix, sessions)
+    return None
+
+
+class LinePrinter:
+    """Decodes streamed output and prints it, prefixing whole lines if asked."""
+
+    def __init__(self, prefix="", encoding="utf-8"):
+        self.prefix = prefix
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self.pending = ""
+
+    def write(self, chunk):
+        """Print a chunk of output and return the text printed."""
+        text = self.pending + self.decoder.decode(chunk)
+        if self.prefix:
+            # Only print whole lines so every line gets the prefix
+            lines = text.split("\n")
+            self.pending = lines.pop()
+            text = "".join(f"{self.prefix}{line}\n" for line in lines)
+        print(text, end='', flush=True)
+        return text
+
+    def flush(self):
+        """Print whatever is left of an unterminated last line and return it."""
+        text = self.pending + self.decoder.decode(b"", final=True)
+        self.pending = ""
+        if text:
+            print(f"{self.prefix}{text}\n" if self.prefix else text, end='')
+        return text
+
+
+def stream_shell(client, command, serial=None, prefix="", sessions=None):
+    """
+    Runs a shell command on a device and prints its output as it arrives.
+
+    Args:
+        client (AdbClient): The client to run the command with.
+        command (str): The shell command to run on the device.
+        serial (str): The device to run on, or None for the only device.
+        prefix (str): Text printed in front of every output line.
+        sessions (ShellSessions): Persistent shell sessions to run the
+            command through. Optional, a one-off shell is used without it
+            or if the device does not support shell v2.
+    """
+    if sessions is not None:
+        try:
+            return sessions.stream(command, serial, prefix)
+        except ShellSessionError:
+            pass  # Old device without shell v2, use a one-off shell
+    success = True
+    printer = LinePrinter(prefix)
+    for chunk in client.shell(command, serial):
+        if "cannot" in printer.write(chunk).lower():
+            success = False
+    printer.flush()
+    return success
@@ -0,0 +1,119 @@
+"""
+Reads the package name and versionCode out of an APK's binary manifest.
+"""
+import struct
+import zipfile
+
+
+RES_STRING_POOL_TYPE = 0x0001
+RES_XML_START_ELEMENT_TYPE = 0x0102
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+ATTR_VERSION_CODE = 0x0101021b
+UTF8_FLAG = 0x100
+TYPE_INT_DEC = 0x10
+TYPE_INT_HEX = 0x11
+
+
+def _read_length(data, offset, utf8):
+    """Read a string pool length prefix, returning (length, new offset)."""
+    if utf8:
+        length = data[offset]
+        offset += 1
+        if length & 0x80:
+            length = ((length & 0x7f) << 8) | data[offset]
+            offset += 1
+        return length, offset
+    length = struct.unpack_from("<H", data, offset)[0]
+    offset += 2
+    if length & 0x8000:
+        length = ((length & 0x7fff) << 16) | struct.unpack_from("<H", data, offset)[0]
+        offset += 2
+    return length, offset
+
+
+def _read_string_pool(data, start):
+    """Decode every string of a binary XML string pool chunk."""
+    count, _, flags, strings_start = struct.unpack_from("<IIII", data, start + 8)
+    utf8 = bool(flags & UTF8_FLAG)
+    offsets = struct.unpack_from(f"<{count}I", data, start + 28)
+    strings = []
+    for string_offset in offsets:
+        offset = start + strings_start + string_offset
+        if utf8:
+            _, offset = _read_length(data, offset, True)  # length in UTF-16 units
+            length, offset = _read_length(data, offset, True)
+            strings.append(data[offset:offset + length].decode("utf-8", errors="replace"))
+        else:
+            length, offset = _read_length(data, offset, False)
+            raw = data[offset:offset + length * 2]
+            strings.append(raw.decode("utf-16-le", errors="replace"))
+    return strings
+
+
+def parse_manifest(data):
+    """
+    Parse a binary AndroidManifest.xml.
+
+    Args:
+        data (bytes): The compiled manifest from inside an APK.
+
+    Returns:
+        (package, version_code); either may be None if not found.
+    """
+    strings = []
+    resource_ids = []
+    offset = struct.unpack_from("<H", data, 2)[0]
+    while offset + 8 <= len(data):
+        chunk_type, header_size, chunk_size = struct.unpack_from("<HHI", data, offset)
+        if chunk_size == 0:
+            break
+        if chunk_type == RES_STRING_POOL_TYPE:
+            strings = _read_string_pool(data, offset)
+        elif chunk_type == RES_XML_RESOURCE_MAP_TYPE:
+            resource_ids = struct.unpack_from(f"<{(chunk_size - header_size) // 4}I",
+                                              data, offset + header_size)
+        elif chunk_type == RES_XML_START_ELEMENT_TYPE:
+            name_index = struct.unpack_from("<I", data, offset + 20)[0]
+            if 0 <= name_index < len(strings) and strings[name_index] == "manifest":
+                return _manifest_attributes(data, offset, header_size, strings,
+                                            resource_ids)
+        offset += chunk_size
+    return None, None
+
+
+def _manifest_attributes(data, offset, header_size, strings, resource_ids):
+    """Read package and versionCode from the <manifest> start element."""
+    attr_start, attr_size, attr_count = struct.unpack_from("<HHH", data,
+                                                           offset + header_size + 8)
+    package = None
+    version_code = None
+    attr_offset = offset + header_size + attr_start
+    for _ in range(attr_count):
+        _, name, raw_value, _, _, data_type, value = struct.unpack_from(
+            "<IIIHBBI", data, attr_offset)
+        attr_name = strings[name] if name < len(strings) else ""
+        # Attribute names can be stripped, so also match by resource id
+        resource_id = resource_ids[name] if name < len(resource_ids) else None
+        if attr_name == "package" and raw_value < len(strings):
+            package = strings[raw_value]
+        elif attr_name == "versionCode" or resource_id == ATTR_VERSION_CODE:
+            if data_type in (TYPE_INT_DEC, TYPE_INT_HEX):
+                version_code = value
+            elif raw_value < len(strings) and strings[raw_value].isdigit():
+                version_code = int(strings[raw_value])
+        attr_offset += attr_size
+    return package, version_code
+
+
+def read_apk_info(apk_path):
+    """
+    Return (package, version_code) of an APK, or (None, None) if unreadable.
+
+    Args:
+        apk_path (str): Path to the APK file.
+    """
+    try:
+        with zipfile.ZipFile(apk_path) as apk:
+            return parse_manifest(apk.read("AndroidManifest.xml"))
+    except (OSError, KeyError, zipfile.BadZipFile, struct.error, IndexError):
+        return None, None
@@ -0,0 +1,61 @@
+"""
+Parallel autoconnect of saved network devices with a per-device deadline.
+"""
+from time import perf_counter
+
+from adb_client import AdbClient, AdbError, AdbConnectionError, connect_succeeded
+from fanout import fan_out, print_line
+
+
+AUTOCONNECT_TIMEOUT = 5.0
+MAX_PARALLEL_CONNECTS = 16
+
+
+def autoconnect_devices(saved_devices, on_server_missing=None,
+                        timeout=AUTOCONNECT_TIMEOUT, max_workers=MAX_PARALLEL_CONNECTS):
+    """
+    Connect to every saved device with autoconnect enabled, all at once.
+
+    Results are printed as each device finishes, so one unreachable device
+    only costs its own deadline instead of holding up the rest.
+
+    Args:
+        saved_devices (list): Saved device dicts from load_saved_devices.
+        on_server_missing (callable): Called once if the adb server is not
+            running yet, e.g. to start it. Optional.
+        timeout (float): Seconds to wait for each device before giving up.
+        max_workers (int): Maximum number of connects in flight at once.
+
+    Returns:
+        A dict of ip:port -> (success, elapsed seconds).
+    """
+    targets = {device['ip_port']: device for device in saved_devices
+               if device.get('autoconnect', False)}
+    if not targets:
+        return {}
+    print(f"Auto-connecting to {len(targets)} saved device(s)...")
+    client = AdbClient(timeout=timeout)
+    try:
+        client.version()
+    except AdbConnectionError:
+        if on_server_missing:
+            on_server_missing()
+
+    def connect(ip_port, prefix):  # pylint: disable=unused-argument
+        name = targets[ip_port]['name']
+        start = perf_counter()
+        try:
+            reply = client.connect(ip_port)
+        except (AdbError, OSError) as e:
+            reply = str(e) or "timed out"
+            success = False
+        else:
+            success = connect_succeeded(reply)
+        elapsed = perf_counter() - start
+        if success:
+            print_line(f"Successfully auto-connected to {name} ({elapsed:.2f}s)")
+        else:
+            print_line(f"Failed to auto-connect to {name}: {reply} ({elapsed:.2f}s)")
+        return success
+
+    return fan_out(list(targets), connect, max_workers)
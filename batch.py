@@ -0,0 +1,125 @@
+"""
+Non-interactive script mode for OpenADB Shell.
+
+`openadbshell.py --script commands.oas` runs a file of shell commands, one
+per line, through the same dispatcher as the prompt; `--script -` or piping
+commands into the shell reads them from stdin. The banner, the startup adb
+calls and mods are skipped. Lines between `parallel {` and `}` run at the
+same time. Every command still runs when one fails unless --fail-fast is
+given, and the exit status is 1 if any command failed.
+"""
+import argparse
+import contextvars
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+
+_PARALLEL_START = re.compile(r"parallel\s*\{", re.IGNORECASE)
+
+
+def parse_arguments(argv):
+    """Parse the command line; piped stdin selects script mode on its own."""
+    parser = argparse.ArgumentParser(prog="openadbshell",
+                                     description="A command-line interface for ADB.")
+    parser.add_argument("--script", metavar="FILE",
+                        help="run the commands in FILE (- for stdin) and exit")
+    parser.add_argument("--fail-fast", action="store_true",
+                        help="stop a script at the first command that fails")
+    parser.add_argument("--timings", action="store_true",
+                        help="print how long each startup phase took")
+    options = parser.parse_args(argv)
+    if options.script is None and sys.stdin is not None and not sys.stdin.isatty():
+        options.script = "-"
+    return options
+
+
+def read_script(path):
+    """Yield the lines of a script file, or of stdin as they arrive for '-'."""
+    if path == "-":
+        yield from sys.stdin
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        yield from f
+
+
+def parse_script(lines):
+    """
+    Group script lines into steps.
+
+    Args:
+        lines (iterable): Script lines. Blank lines and lines starting with #
+            are skipped, and `exit` ends the script.
+
+    Yields:
+        A list of (line number, command) per step: one command, or every
+        command of a parallel block.
+
+    Raises:
+        ValueError: If the parallel blocks are not balanced.
+    """
+    block = None  # Commands of the open parallel block
+    block_line = 0
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if _PARALLEL_START.fullmatch(line):
+            if block is not None:
+                raise ValueError(f"line {number}: parallel blocks cannot be nested")
+            block, block_line = [], number
+        elif line == "}":
+            if block is None:
+                raise ValueError(f"line {number}: '}}' without 'parallel {{'")
+            if block:
+                yield block
+            block = None
+        elif line.lower() == "exit":
+            if block is not None:
+                raise ValueError(f"line {number}: exit inside a parallel block")
+            return
+        elif block is not None:
+            block.append((number, line))
+        else:
+            yield [(number, line)]
+    if block is not None:
+        raise ValueError(f"line {block_line}: 'parallel {{' is never closed")
+
+
+def _succeeded(execute, command):
+    """Run one command, counting only an explicit False or an exception as failure."""
+    try:
+        return execute(command) is not False
+    except Exception as e:
+        print(f"Error: {e}")
+        return False
+
+
+def run_script(lines, execute, fail_fast=False):
+    """
+    Run a script's commands with execute(command).
+
+    Returns:
+        The number of commands that failed; a malformed script counts as one.
+    """
+    failed = 0
+    try:
+        for step in parse_script(lines):
+            if len(step) == 1:
+                results = [_succeeded(execute, step[0][1])]
+            else:
+                with ThreadPoolExecutor(max_workers=len(step)) as pool:
+                    # Each command gets its own copy of the context, like fan-out
+                    futures = [pool.submit(contextvars.copy_context().run, _succeeded,
+                                           execute, command) for _, command in step]
+                    results = [future.result() for future in futures]
+            for (number, command), ok in zip(step, results):
+                if not ok:
+                    failed += 1
+                    print(f"Error: line {number} failed: {command}", file=sys.stderr)
+            if failed and fail_fast:
+                break
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        failed += 1
+    return failed
@@ -0,0 +1,195 @@
+"""
+A fake adb server for the benchmarks, so no device is needed.
+
+It speaks enough of the adb smart-socket protocol for OpenADB Shell:
+host:version, host:devices, host:track-devices, host:connect/disconnect,
+host:transport and one-off shell:/exec: services. Every simulated device
+answers shell commands itself after an optional delay: `echo <text>`
+prints the text, `stream <MB>` sends that many megabytes, `screencap`
+sends a raw RGBA frame that changes every second call (`screencap -p`
+a small PNG), `screenrecord` a few megabytes of video, and anything
+else is echoed back.
+
+Run it on its own to try the shell against simulated devices:
+    python benchmarks/fake_adb_server.py --port 5037 --devices 8
+"""
+import argparse
+import socket
+import struct
+import zlib
+from threading import Thread, Event, Lock
+from time import sleep
+
+
+STREAM_BLOCK = (b"0123456789abcdef" * 4 + b"\n") * 1000  # About 64 KB of text lines
+SCREEN_SIZE = (1080, 2400)
+RECORDING_MB = 4
+
+
+def _png(width, height):
+    """Return a gray PNG, as screencap -p would."""
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data)))
+    rows = (b"\x00" + b"\x80" * width * 3) * height
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+
+def _recv_exact(sock, size):
+    """Read exactly size bytes, or return None if the client went away."""
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def _okay(text):
+    """Return an OKAY reply carrying a length-prefixed string."""
+    data = text.encode("utf-8")
+    return b"OKAY" + f"{len(data):04x}".encode("ascii") + data
+
+
+def _fail(text):
+    """Return a FAIL reply."""
+    data = text.encode("utf-8")
+    return b"FAIL" + f"{len(data):04x}".encode("ascii") + data
+
+
+class FakeAdbServer:
+    """Simulates an adb server with a number of attached devices."""
+
+    def __init__(self, device_count=8, latency=0.0, host="127.0.0.1", port=0):
+        """
+        Args:
+            device_count (int): Number of simulated devices.
+            latency (float): Seconds every shell command takes on a device.
+            host (str): Address to listen on.
+            port (int): Port to listen on, 0 picks a free one.
+        """
+        self.serials = [f"emulator-{5554 + 2 * i}" for i in range(device_count)]
+        self.latency = latency
+        self._listener = socket.create_server((host, port))
+        self.port = self._listener.getsockname()[1]
+        self._stopped = Event()
+        self._frames = {}  # serial -> screencaps taken
+        self._frames_lock = Lock()
+
+    def start(self):
+        """Start accepting clients in a background thread."""
+        Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop accepting clients."""
+        self._stopped.set()
+        self._listener.close()
+
+    def listing(self):
+        """Return the host:devices listing."""
+        return "".join(f"{serial}\tdevice\n" for serial in self.serials)
+
+    def _accept(self):
+        """Hand every client to its own thread."""
+        while not self._stopped.is_set():
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client):
+        """Answer the requests of one client connection."""
+        serial = None  # Device picked by a host:transport request
+        with client:
+            try:
+                while True:
+                    length = _recv_exact(client, 4)
+                    if length is None:
+                        return
+                    request = _recv_exact(client, int(length, 16)).decode("utf-8")
+                    if request == "host:transport-any" or (
+                            request.startswith("host:transport:")
+                            and request[15:] in self.serials):
+                        client.sendall(b"OKAY")
+                        serial = request[15:] or self.serials[0]
+                        continue
+                    self._handle(client, request, serial)
+                    return
+            except (OSError, ValueError, AttributeError):
+                return
+
+    def frame(self, serial):
+        """Return a raw screencap frame; its color changes every second frame."""
+        with self._frames_lock:
+            count = self._frames[serial] = self._frames.get(serial, -1) + 1
+        width, height = SCREEN_SIZE
+        return (struct.pack("<IIII", width, height, 1, 0)
+                + bytes([count // 2 % 256]) * (width * height * 4))
+
+    def _handle(self, client, request, serial):
+        """Answer one request, run on serial if it is a device service."""
+        if request == "host:version":
+            client.sendall(_okay("0029"))
+        elif request in ("host:devices", "host:devices-l"):
+            client.sendall(_okay(self.listing()))
+        elif request == "host:track-devices":
+            client.sendall(_okay(self.listing()))
+            while client.recv(4096):
+                pass
+        elif request.startswith("host:connect:"):
+            client.sendall(_okay(f"already connected to {request[13:]}"))
+        elif request.startswith("host:disconnect:"):
+            client.sendall(_okay(f"disconnected {request[16:]}"))
+        elif request.startswith(("shell:", "exec:")):
+            client.sendall(b"OKAY")
+            self._run(client, request.partition(":")[2], serial)
+        else:
+            client.sendall(_fail(f"unknown request {request}"))
+
+    def _run(self, client, command, serial):
+        """Send the output of a shell command run on a simulated device."""
+        if self.latency:
+            sleep(self.latency)
+        name, _, rest = command.partition(" ")
+        if command == "screencap":
+            client.sendall(self.frame(serial))
+        elif command == "screencap -p":
+            client.sendall(_png(*SCREEN_SIZE))
+        elif name == "screenrecord":
+            client.sendall(STREAM_BLOCK * (RECORDING_MB * 16))
+        elif name == "stream":
+            remaining = int(float(rest) * (1 << 20))
+            while remaining > 0:
+                block = STREAM_BLOCK[:remaining]
+                client.sendall(block)
+                remaining -= len(block)
+        elif name == "echo":
+            client.sendall(rest.encode("utf-8") + b"\n")
+        else:
+            client.sendall(command.encode("utf-8") + b"\n")
+
+
+def main():
+    """Run a fake adb server until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=5037)
+    parser.add_argument("--devices", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds every shell command takes")
+    options = parser.parse_args()
+    server = FakeAdbServer(options.devices, options.latency, port=options.port).start()
+    print(f"Fake adb server with {options.devices} device(s) on port {server.port}")
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
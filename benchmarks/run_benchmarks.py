@@ -0,0 +1,335 @@
+"""
+Benchmarks for OpenADB Shell, run against a fake adb server and a stub adb
+executable so no device is needed.
+
+    python benchmarks/run_benchmarks.py                  print results as JSON
+    python benchmarks/run_benchmarks.py --output r.json  write them to a file
+    python benchmarks/run_benchmarks.py --update-baseline
+
+Results are compared with benchmarks/baseline.json when it exists; a metric
+that is worse than the baseline by more than the threshold (25% by default)
+is a regression and makes the exit status 1. Metrics ending in _mb_s are
+better when higher, all others when lower. Baselines are only comparable on
+the machine that recorded them, and with results of the same mode: a
+--quick run is not compared with a full baseline, or the other way round.
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import platform
+import select
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+from fake_adb_server import FakeAdbServer
+
+try:
+    import pty
+except ImportError:  # Windows
+    pty = None
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+BASELINE_FILE = os.path.join(HERE, "baseline.json")
+DEFAULT_THRESHOLD = 0.25
+FANOUT_SIZES = (1, 2, 4, 8, 16, 32, 64)
+DEVICE_LATENCY = 0.02  # Seconds a simulated device takes per shell command
+SAVED_DEVICES = 1000
+PROMPT = b"openadbshell:"
+
+
+def repo(name):
+    """Import a module of the shell itself."""
+    return importlib.import_module(name)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Send everything printed to the void while benchmarking output paths."""
+    with open(os.devnull, "w", encoding="utf-8") as sink, contextlib.redirect_stdout(sink):
+        yield
+
+
+def median_time(func, runs):
+    """Return the median seconds func() takes over several runs."""
+    return statistics.median(_times(func, runs))
+
+
+def best_time(func, runs):
+    """Return the fastest of several runs; steadier than the median for small timings."""
+    return min(_times(func, runs))
+
+
+def _times(func, runs):
+    """Return the seconds every run of func() took."""
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+    return times
+
+
+def make_stub(directory):
+    """Write an executable wrapper around stub_adb.py and return its path."""
+    stub = os.path.join(HERE, "stub_adb.py")
+    if os.name == "nt":
+        path = os.path.join(directory, "adb.bat")
+        content = f'@"{sys.executable}" "{stub}" %*\n'
+    else:
+        path = os.path.join(directory, "adb")
+        content = f'#!/bin/sh\nexec {shlex.quote(sys.executable)} {shlex.quote(stub)} "$@"\n'
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.chmod(path, 0o755)
+    return path
+
+
+def _command_line(args):
+    """Join arguments into a command line for shell=True."""
+    return subprocess.list2cmdline(args) if os.name == "nt" else shlex.join(args)
+
+
+def _time_to_prompt(workspace, env, timeout=30.0):
+    """Start the shell on a pseudo-terminal and return the seconds until its prompt."""
+    master, slave = pty.openpty()
+    start = perf_counter()
+    with subprocess.Popen([sys.executable, os.path.join(ROOT, "openadbshell.py")],
+                          cwd=workspace, env=env, stdin=slave, stdout=slave,
+                          stderr=slave) as process:
+        os.close(slave)
+        output = b""
+        try:
+            while PROMPT not in output[-4096:]:
+                ready, _, _ = select.select([master], [], [], timeout)
+                if not ready:
+                    raise TimeoutError("the shell did not show its prompt")
+                output += os.read(master, 65536)
+            return perf_counter() - start
+        finally:
+            process.kill()
+            os.close(master)
+
+
+def bench_cold_start(workspace, env, runs):
+    """Time a fresh shell process: to its prompt, and through an empty script."""
+    script = os.path.join(workspace, "empty.oas")
+    with open(script, "w", encoding="utf-8"):
+        pass
+    command = [sys.executable, os.path.join(ROOT, "openadbshell.py"), "--script", script]
+    metrics = {"cold_start_script_ms": 1000 * median_time(
+        lambda: subprocess.run(command, cwd=workspace, env=env, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               check=False), runs)}
+    if pty is not None:
+        metrics["cold_start_prompt_ms"] = 1000 * statistics.median(
+            _time_to_prompt(workspace, env) for _ in range(runs))
+    return metrics
+
+
+def bench_dispatch(iterations):
+    """Time the command registry for a registered and an unknown command."""
+    registry = repo("commands").CommandRegistry()
+    for i in range(60):
+        registry.register(f"command{i}", lambda parsed: True, max_args=None)
+    split = repo("fanout").split_device_selector
+
+    def dispatch(line):
+        for _ in range(iterations):
+            registry.dispatch(split(line)[0], True)
+    return {
+        "dispatch_us": 1e6 * best_time(lambda: dispatch("command30 some args"), 5)
+        / iterations,
+        "dispatch_unknown_us": 1e6 * best_time(lambda: dispatch("shell ls -l /sdcard"), 5)
+        / iterations,
+    }
+
+
+def bench_streaming(stub, megabytes):
+    """Measure how fast process output is streamed to the console."""
+    stream_process = repo("process_stream").stream_process
+    command = _command_line([stub, "stream", str(megabytes)])
+    with quiet():
+        plain = median_time(lambda: stream_process(command), 3)
+        prefixed = median_time(lambda: stream_process(command, prefix="[emulator-5554] "), 3)
+    return {"stream_mb_s": megabytes / plain, "stream_prefixed_mb_s": megabytes / prefixed}
+
+
+def bench_device_poll(server, iterations):
+    """Time a device listing from the server and applying one to the tracker."""
+    client = repo("adb_client").AdbClient(port=server.port)
+    tracker = repo("device_tracker").DeviceTracker(client)
+    listings = [[(serial, "device") for serial in server.serials],
+                [(serial, "offline" if i == 0 else "device")
+                 for i, serial in enumerate(server.serials)]]
+
+    def apply(count=1000):
+        for i in range(count):
+            tracker.update(listings[i % 2])
+    return {
+        "device_poll_ms": 1000 * best_time(client.devices, iterations),
+        "tracker_update_us": 1e6 * best_time(apply, 5) / 1000,
+    }
+
+
+def bench_config(directory, count=SAVED_DEVICES):
+    """Time config reads and writes with many saved devices."""
+    config_store = repo("config_store")
+    path = os.path.join(directory, "bench_config.json")
+    store = config_store.ConfigStore(path, legacy_path=os.path.join(directory, "none.dat"))
+    store.set_devices([{"name": f"device{i}", "ip_port": f"10.0.{i // 250}.{i % 250}:5555",
+                        "autoconnect": i % 10 == 0} for i in range(count)])
+
+    def write():
+        store.add_device("bench", "10.1.0.1:5555")
+        store.remove_device("bench")
+    return {
+        "config_read_ms": 1000 * best_time(
+            lambda: config_store.ConfigStore(path, legacy_path=store.legacy_path), 30),
+        # Two saves per run
+        "config_write_ms": 1000 * best_time(write, 10) / 2,
+        "config_lookup_us": 1e6 * best_time(
+            lambda: [store.find_device(f"device{i}") for i in range(count)], 5) / count,
+    }
+
+
+def bench_fanout(server, sizes=FANOUT_SIZES):
+    """Time a shell command fanned out to more and more simulated devices."""
+    adb_client = repo("adb_client")
+    run_on_devices = repo("fanout").run_on_devices
+    client = adb_client.AdbClient(port=server.port)
+
+    def run(serial, prefix):
+        return adb_client.stream_shell(client, "echo hello", serial, prefix)
+    metrics = {}
+    with quiet():
+        for size in sizes:
+            metrics[f"fanout_{size}_ms"] = 1000 * median_time(
+                lambda size=size: run_on_devices(server.serials[:size], run), 3)
+    return metrics
+
+
+def bench_screencap(server, frames):
+    """Time raw frame capture from a simulated device and PNG encoding of a frame."""
+    capture = repo("capture")
+    client = repo("adb_client").AdbClient(port=server.port)
+    buffer = bytearray()
+
+    def grab():
+        for _ in range(frames):
+            capture.capture_frame(client, server.serials[0], buffer)[2].release()
+    width, height, pixels = capture.capture_frame(client, server.serials[0], buffer)
+    with pixels:
+        encode = best_time(lambda: capture.encode_png(width, height, pixels), 3)
+    return {"screencap_frame_ms": 1000 * best_time(grab, 3) / frames,
+            "png_encode_ms": 1000 * encode}
+
+
+def run_all(quick=False):
+    """Run every benchmark and return the results."""
+    runs = 3 if quick else 10
+    server = FakeAdbServer(max(FANOUT_SIZES), DEVICE_LATENCY).start()
+    metrics = {}
+    try:
+        with tempfile.TemporaryDirectory() as workspace:
+            stub = make_stub(workspace)
+            config_store = repo("config_store")
+            config_store.ConfigStore(os.path.join(workspace, config_store.CONFIG_FILE),
+                                     legacy_path=os.path.join(workspace, "none.dat")
+                                     ).set("adb_path", stub)
+            env = dict(os.environ, ANDROID_ADB_SERVER_PORT=str(server.port))
+            metrics.update(bench_cold_start(workspace, env, runs))
+            metrics.update(bench_dispatch(2000 if quick else 20000))
+            metrics.update(bench_streaming(stub, 16 if quick else 64))
+            metrics.update(bench_device_poll(server, runs * 10))
+            metrics.update(bench_config(workspace))
+            metrics.update(bench_fanout(server))
+            metrics.update(bench_screencap(server, 3 if quick else 10))
+    finally:
+        server.stop()
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "mode": "quick" if quick else "full",
+            "metrics": {name: round(value, 3) for name, value in metrics.items()}}
+
+
+def mode_mismatch(results, baseline):
+    """Return why results cannot be compared with a baseline of another mode, else None."""
+    # Older baselines have a quick flag instead of the mode
+    mode = baseline.get("mode") or {True: "quick", False: "full"}.get(baseline.get("quick"))
+    if mode == results["mode"]:
+        return None
+    return (f"The baseline was recorded by a {mode or 'unknown'} run and these results by a "
+            f"{results['mode']} run. Compare with a {results['mode']} baseline (--baseline) "
+            f"or record one with --update-baseline.")
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with a baseline.
+
+    Returns:
+        (name, baseline value, value, relative change, regressed) per metric
+        found in both, where a positive change is always an improvement.
+    """
+    rows = []
+    for name, value in results["metrics"].items():
+        base = baseline.get("metrics", {}).get(name)
+        if not base:
+            continue
+        change = (value - base) / base if name.endswith("_mb_s") else (base - value) / base
+        rows.append((name, base, value, change, change < -threshold))
+    return rows
+
+
+def main():
+    """Run the benchmarks, write or print the results and check for regressions."""
+    parser = argparse.ArgumentParser(description="OpenADB Shell benchmarks")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline to compare with")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown before a metric counts as a regression")
+    parser.add_argument("--quick", action="store_true", help="fewer runs and less data")
+    options = parser.parse_args()
+    results = run_all(options.quick)
+    text = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if options.update_baseline:
+        with open(options.baseline, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Baseline written to {options.baseline}", file=sys.stderr)
+        return 0
+    try:
+        with open(options.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        print("No baseline to compare with.", file=sys.stderr)
+        return 0
+    mismatch = mode_mismatch(results, baseline)
+    if mismatch:
+        print(f"Error: {mismatch}", file=sys.stderr)
+        return 2
+    regressions = 0
+    for name, base, value, change, regressed in compare(results, baseline,
+                                                        options.threshold):
+        regressions += regressed
+        print(f"{name:<24} {base:>12.3f} -> {value:>12.3f}  {change:+7.1%}"
+              + ("  REGRESSION" if regressed else ""), file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+"""
+A stand-in for the adb executable, used by the benchmarks.
+
+    stub_adb.py version          print a version banner
+    stub_adb.py devices          print an empty device list
+    stub_adb.py stream <MB>      write that many megabytes of text lines
+    stub_adb.py start-server     do nothing, like a server that is running
+
+Anything else is echoed back.
+"""
+import sys
+
+from fake_adb_server import STREAM_BLOCK
+
+
+def main(args):
+    """Behave like adb for the given arguments."""
+    out = sys.stdout.buffer
+    if args[:1] == ["version"]:
+        out.write(b"Android Debug Bridge version 1.0.41\nVersion 35.0.0-stub\n")
+    elif args[:1] == ["devices"]:
+        out.write(b"List of devices attached\n\n")
+    elif args[:1] == ["stream"] and len(args) == 2:
+        remaining = int(float(args[1]) * (1 << 20))
+        while remaining > 0:
+            block = STREAM_BLOCK[:remaining]
+            out.write(block)
+            remaining -= len(block)
+    elif args[:1] not in (["start-server"], ["kill-server"]):
+        out.write(("stub adb " + " ".join(args) + "\n").encode("utf-8"))
+    out.flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,378 @@
+"""
+Binary-safe screen capture for the screencap and screenrecord commands.
+
+Frames are read from `exec-out screencap` as raw pixels straight into
+reusable buffers instead of going through a text pipe, and encoded to PNG
+on this machine by a shared pool of worker threads (zlib releases the GIL,
+so encoding really runs in parallel). That is much faster than having the
+device encode PNGs. With --fps, frames are captured continuously at a target
+rate and frames identical to the previous one are not saved. Recordings are
+streamed from `exec-out screenrecord` to a file through a single buffer.
+Every selected device captures at the same time.
+"""
+import os
+import queue
+import re
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import perf_counter, sleep, strftime
+
+from adb_client import AdbError
+from commands import split_args
+from fanout import print_line
+from jobs import killed
+
+
+SCREENSHOT_DIR = "screenshots"
+RECORDING_DIR = "recordings"
+MAX_CAPTURE_DEVICES = 64  # Every selected device captures at once
+ENCODE_WORKERS = os.cpu_count() or 4
+# Raw screencap pixel formats that are written as RGBA (RGBX has an opaque X byte)
+RGBA_FORMATS = {1: "RGBA_8888", 2: "RGBX_8888"}
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+SCREENCAP_USAGE = ("screencap [--out <dir>] [--fps <n>] [--duration <seconds>] "
+                   "[--frames <n>] [--level <0-9>]")
+SCREENRECORD_USAGE = ("screenrecord [--out <dir>] [--time-limit <seconds>] "
+                      "[--bit-rate <Mbps>] [--size <WxH>]")
+_SCREENCAP_OPTIONS = {"out", "fps", "duration", "frames", "level"}
+_SCREENRECORD_OPTIONS = {"out", "time-limit", "bit-rate", "size"}
+
+_encoder = None
+_encoder_lock = Lock()
+
+
+def parse_capture_args(args, allowed, usage):
+    """
+    Parse --name value options.
+
+    Args:
+        args (list): Tokens after the command.
+        allowed (set): Option names the command takes.
+        usage (str): Usage text for errors.
+
+    Returns:
+        dict: Option name (dashes as underscores) -> value as given.
+
+    Raises:
+        ValueError: If an option is unknown or has no value.
+    """
+    options = {}
+    for i in range(0, len(args), 2):
+        name = args[i][2:].lower() if args[i].startswith("--") else None
+        if name not in allowed or i + 1 >= len(args):
+            raise ValueError(f"Usage: {usage}")
+        options[name.replace("-", "_")] = args[i + 1]
+    return options
+
+
+def _number(options, name, kind=float, low=0, high=None):
+    """Convert an option to a number within [low, high], or None if it was not given."""
+    if name not in options:
+        return None
+    try:
+        value = kind(options[name])
+    except ValueError:
+        value = None
+    if value is None or value < low or (high is not None and value > high):
+        limit = f" and at most {high}" if high is not None else ""
+        raise ValueError(f"--{name.replace('_', '-')} must be a number of at least {low}{limit}.")
+    return value
+
+
+def encoder():
+    """Return the shared PNG encoding pool, starting it on first use."""
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            _encoder = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="png")
+        return _encoder
+
+
+def parse_raw_header(data, size):
+    """
+    Read the header of raw screencap output.
+
+    Android 9 and later add a color space field, so the header is 16 bytes
+    instead of 12; the one that leaves exactly the pixels is used.
+
+    Returns:
+        (width, height, pixel format, header size)
+
+    Raises:
+        ValueError: If the output is not raw RGBA pixels.
+    """
+    if size < 12:
+        raise ValueError("screencap returned no image")
+    width, height, pixel_format = struct.unpack_from("<III", data)
+    for header in (16, 12):
+        if size - header == width * height * 4:
+            if pixel_format not in RGBA_FORMATS:
+                raise ValueError(f"unsupported pixel format {pixel_format}")
+            return width, height, pixel_format, header
+    raise ValueError(f"unexpected screencap size {size} for {width}x{height}")
+
+
+def _png_chunk(kind, data):
+    """Return a PNG chunk with its length and CRC."""
+    return (struct.pack(">I", len(data)) + kind + data
+            + struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+
+def encode_png(width, height, pixels, level=1):
+    """
+    Encode RGBA pixels as a PNG.
+
+    Args:
+        width (int): Image width.
+        height (int): Image height.
+        pixels (memoryview): width * height * 4 bytes of RGBA.
+        level (int): zlib compression level; 1 is fast and still small for screens.
+
+    Returns:
+        bytes: The PNG file.
+    """
+    stride = width * 4
+    # Every row starts with filter type 0 (none)
+    rows = b"".join(b"\x00" + pixels[y * stride:(y + 1) * stride] for y in range(height))
+    return (PNG_SIGNATURE
+            + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+            + _png_chunk(b"IDAT", zlib.compress(rows, level))
+            + _png_chunk(b"IEND", b""))
+
+
+def save_png(path, width, height, pixels, level):
+    """Encode pixels and write them to path."""
+    data = encode_png(width, height, pixels, level)
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data)
+
+
+class BufferPool:
+    """A bounded set of reusable frame buffers; acquire() waits when all are in use."""
+
+    def __init__(self, size):
+        self._free = queue.Queue()
+        self._left = size  # Buffers that may still be created
+
+    def acquire(self):
+        """Return a free buffer, creating one while under the limit."""
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+        if self._left > 0:
+            self._left -= 1
+            return bytearray()
+        return self._free.get()
+
+    def release(self, buffer):
+        """Hand a buffer back for reuse."""
+        self._free.put(buffer)
+
+
+def device_name(serial):
+    """Return a serial with characters unsafe in file names replaced."""
+    return re.sub(r"[^\w.-]", "_", serial)
+
+
+def capture_frame(client, serial, buffer):
+    """
+    Capture one raw frame into buffer.
+
+    Returns:
+        (width, height, memoryview of the pixels)
+    """
+    size = client.exec_out_into("screencap", buffer, serial)
+    width, height, _, header = parse_raw_header(buffer, size)
+    return width, height, memoryview(buffer)[header:size]
+
+
+def screenshot(client, serial, directory, level=1, prefix=""):
+    """
+    Save one screenshot of a device as a PNG.
+
+    Raw pixels are encoded here; devices with another pixel format are asked
+    for a PNG instead.
+
+    Returns:
+        str: Path of the saved file.
+    """
+    path = os.path.join(directory, f"{device_name(serial)}_{strftime('%Y%m%d-%H%M%S')}.png")
+    started = perf_counter()
+    buffer = bytearray()
+    try:
+        width, height, pixels = capture_frame(client, serial, buffer)
+    except ValueError:
+        size = client.exec_out_into("screencap -p", buffer, serial)
+        if not buffer.startswith(PNG_SIGNATURE):
+            raise
+        with open(path, "wb") as f:
+            f.write(memoryview(buffer)[:size])
+    else:
+        with pixels:
+            encoder().submit(save_png, path, width, height, pixels, level).result()
+    print_line(f"{prefix}Saved {path} in {perf_counter() - started:.2f}s")
+    return path
+
+
+def capture_frames(client, serial, directory, fps, duration=None, frames=None, level=1,
+                   prefix=""):
+    """
+    Capture frames continuously at a target rate, saving only the ones that changed.
+
+    Frames are compared by CRC with the previous one. Capturing continues
+    until duration seconds passed, frames frames were captured or the job
+    is killed; when the device is slower than fps, frames are captured back
+    to back.
+
+    Returns:
+        (frames captured, frames saved)
+    """
+    folder = os.path.join(directory, f"{device_name(serial)}_{strftime('%Y%m%d-%H%M%S')}")
+    os.makedirs(folder, exist_ok=True)
+    # Enough buffers to keep every encoder busy while the next frame comes in
+    buffers = BufferPool(ENCODE_WORKERS + 2)
+    pending = []
+    interval = 1 / fps
+    started = perf_counter()
+    captured = saved = 0
+    previous = None
+    try:
+        while not killed() and (frames is None or captured < frames):
+            due = started + captured * interval
+            now = perf_counter()
+            if duration is not None and now - started >= duration:
+                break
+            if due > now:
+                sleep(due - now)
+            buffer = buffers.acquire()
+            width, height, pixels = capture_frame(client, serial, buffer)
+            captured += 1
+            checksum = (width, height, zlib.crc32(pixels))
+            if checksum == previous:
+                pixels.release()
+                buffers.release(buffer)
+                continue
+            previous = checksum
+            saved += 1
+            path = os.path.join(folder, f"{captured:06d}.png")
+            future = encoder().submit(save_png, path, width, height, pixels, level)
+
+            def reuse(_, pixels=pixels, buffer=buffer):
+                pixels.release()
+                buffers.release(buffer)
+            future.add_done_callback(reuse)
+            pending.append(future)
+            pending = [f for f in pending if not f.done() or f.exception()]
+    finally:
+        for future in pending:
+            future.result()
+    elapsed = perf_counter() - started
+    print_line(f"{prefix}{captured} frame(s) captured in {elapsed:.1f}s "
+               f"({captured / max(elapsed, 1e-6):.1f} fps), {saved} saved to {folder}, "
+               f"{captured - saved} unchanged skipped")
+    return captured, saved
+
+
+def screenrecord_command(options):
+    """Build the screenrecord command run on the device, writing H.264 to stdout."""
+    command = ["screenrecord", "--output-format=h264"]
+    if options.get("time_limit") is not None:
+        command += ["--time-limit", str(options["time_limit"])]
+    if options.get("bit_rate") is not None:
+        command += ["--bit-rate", str(int(options["bit_rate"] * 1_000_000))]
+    if options.get("size"):
+        command += ["--size", options["size"]]
+    return " ".join(command + ["-"])
+
+
+def record(client, serial, directory, options, prefix=""):
+    """
+    Stream a screen recording from a device to an .h264 file.
+
+    Returns:
+        str: Path of the recording.
+    """
+    path = os.path.join(directory, f"{device_name(serial)}_{strftime('%Y%m%d-%H%M%S')}.h264")
+    started = perf_counter()
+    written = 0
+    buffer = bytearray(1 << 20)
+    with open(path, "wb") as f:
+        for chunk in client.exec_out_chunks(screenrecord_command(options), buffer, serial):
+            f.write(chunk)
+            written += len(chunk)
+    print_line(f"{prefix}Saved {path}: {written / (1 << 20):.1f} MB in "
+               f"{perf_counter() - started:.1f}s")
+    return path
+
+
+def register_capture_commands(registry, services):
+    """
+    Register the screencap and screenrecord commands.
+
+    Args:
+        registry (CommandRegistry): The shell's command registry.
+        services (dict): Shell services: client and run_on_selected.
+    """
+    def screencap(parsed):
+        try:
+            options = parse_capture_args(split_args(parsed.raw), _SCREENCAP_OPTIONS,
+                                         SCREENCAP_USAGE)
+            fps = _number(options, "fps", low=0.01)
+            duration = _number(options, "duration", low=0)
+            frames = _number(options, "frames", int, low=1)
+            level = _number(options, "level", int, high=9)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return False
+        level = 1 if level is None else level
+        directory = options.get("out", SCREENSHOT_DIR)
+
+        def capture(serial, prefix):
+            try:
+                os.makedirs(directory, exist_ok=True)
+                if fps is None:
+                    screenshot(services["client"], serial, directory, level, prefix)
+                else:
+                    capture_frames(services["client"], serial, directory, fps, duration,
+                                   frames, level, prefix)
+                return True
+            except (AdbError, OSError, ValueError) as e:
+                print_line(f"{prefix}Error: {e}")
+                return False
+        return services["run_on_selected"](capture, max_workers=MAX_CAPTURE_DEVICES)
+
+    def screenrecord(parsed):
+        try:
+            options = parse_capture_args(split_args(parsed.raw), _SCREENRECORD_OPTIONS,
+                                         SCREENRECORD_USAGE)
+            options["time_limit"] = _number(options, "time_limit", int, low=1, high=180)
+            options["bit_rate"] = _number(options, "bit_rate", low=0.1)
+            if options.get("size") and not re.fullmatch(r"\d+x\d+", options["size"]):
+                raise ValueError("--size must look like 1280x720.")
+        except ValueError as e:
+            print(f"Error: {e}")
+            return False
+        directory = options.get("out", RECORDING_DIR)
+
+        def capture(serial, prefix):
+            try:
+                os.makedirs(directory, exist_ok=True)
+                record(services["client"], serial, directory, options, prefix)
+                return True
+            except (AdbError, OSError) as e:
+                print_line(f"{prefix}Error: {e}")
+                return False
+        return services["run_on_selected"](capture, max_workers=MAX_CAPTURE_DEVICES)
+
+    registry.register("screencap", screencap, SCREENCAP_USAGE,
+                      "Save a PNG screenshot of every selected device, or with --fps keep "
+                      "capturing frames at that rate and save the ones that changed. Run it "
+                      "with & and stop it with kill", max_args=None)
+    registry.register("screenrecord", screenrecord, SCREENRECORD_USAGE,
+                      "Record the screen of every selected device to an .h264 file until the "
+                      "time limit (180 seconds at most) or until the job is killed",
+                      max_args=None)
@@ -0,0 +1,149 @@
+"""
+Command registry and parser for the OpenADB Shell prompt.
+
+Each line is tokenized and lowercased once, then dispatched with a single
+dict lookup on its first token. Commands declare how many arguments they
+take, and the help text is generated from the registry.
+"""
+import shlex
+
+
+def split_args(text):
+    """
+    Split arguments like a Windows command line: quotes group words and are
+    removed, backslashes are kept, so C:\\logs\\x.txt stays a path.
+
+    Raises:
+        ValueError: If a quote is not closed.
+    """
+    lexer = shlex.shlex(text, posix=True)
+    lexer.whitespace_split = True
+    lexer.escape = ""
+    lexer.commenters = ""
+    return list(lexer)
+
+
+class ParsedCommand:  # pylint: disable=too-few-public-methods
+    """A tokenized command line."""
+
+    def __init__(self, line):
+        self.line = line.strip()
+        name, _, raw = self.line.partition(" ")
+        self.name = name.lower()
+        self.raw = raw.strip()  # Everything after the command name, as typed
+        self.args = self.raw.split()
+        self.normalized = " ".join([self.name] + [arg.lower() for arg in self.args])
+
+
+class Command:  # pylint: disable=too-few-public-methods
+    """A registered command."""
+
+    def __init__(self, name, handler, usage, help_text, min_args, max_args,
+                 custom, error):
+        self.name = name
+        self.handler = handler
+        self.usage = usage or name
+        self.help_text = help_text
+        self.min_args = min_args
+        self.max_args = max_args
+        self.custom = custom
+        self.error = error
+
+    def check_args(self, parsed):
+        """Return an error message if the arguments do not fit, else None."""
+        if len(parsed.args) < self.min_args or (
+                self.max_args is not None and len(parsed.args) > self.max_args):
+            return self.error or f"Usage: {self.usage}"
+        return None
+
+
+class CommandRegistry:
+    """Maps command names and aliases to their handlers."""
+
+    def __init__(self):
+        self.commands = {}
+        self.aliases = {}
+        self._help_order = []  # Command names and help-only (usage, text) entries
+
+    def register(self, name, handler, usage="", help_text="", min_args=0, max_args=0,
+                 custom=True, error=None, replace=True):
+        """
+        Register a command.
+
+        Args:
+            name (str): The first word of the command.
+            handler (callable): Called as handler(parsed) with a ParsedCommand.
+            usage (str): How to call the command, shown in help.
+            help_text (str): What the command does, shown in help. Commands
+                without help text are left out of help.
+            min_args (int): Fewest arguments the command accepts.
+            max_args (int): Most arguments the command accepts, None for no limit.
+            custom (bool): Whether the command is part of the custom command set
+                that can be disabled with do_cust_command.
+            error (str): Message shown when the arguments do not fit, instead of
+                the usage.
+            replace (bool): Whether to replace an existing command of that name.
+
+        Returns:
+            True if the command was registered.
+        """
+        name = name.lower()
+        if not replace and name in self.commands:
+            return False
+        if name not in self.commands:
+            self._help_order.append(name)
+        self.commands[name] = Command(name, handler, usage, help_text, min_args,
+                                      max_args, custom, error)
+        return True
+
+    def alias(self, line, target):
+        """Make a whole command line, e.g. "connect wsa", run another command line."""
+        self.aliases[ParsedCommand(line).normalized] = target
+
+    def add_help(self, usage, help_text, custom=True):
+        """Add a help entry that is not tied to a registered command."""
+        self._help_order.append((usage, help_text, custom))
+
+    def lookup(self, line, custom_enabled=True):
+        """
+        Find the command for a line.
+
+        Returns:
+            (command, parsed); command is None if nothing matches.
+        """
+        parsed = ParsedCommand(line)
+        target = self.aliases.get(parsed.normalized)
+        if target is not None:
+            parsed = ParsedCommand(target)
+        command = self.commands.get(parsed.name)
+        if command is not None and command.custom and not custom_enabled:
+            command = None
+        return command, parsed
+
+    def dispatch(self, line, custom_enabled=True):
+        """
+        Run the command for a line.
+
+        Returns:
+            (handled, result); handled is False if no command matches the line.
+        """
+        command, parsed = self.lookup(line, custom_enabled)
+        if command is None:
+            return False, None
+        error = command.check_args(parsed)
+        if error:
+            print(f"Error: {error}")
+            return True, False
+        return True, command.handler(parsed)
+
+    def help_lines(self, custom_enabled=True):
+        """Return the help text for every command, generated from the registry."""
+        lines = []
+        for entry in self._help_order:
+            if isinstance(entry, str):
+                command = self.commands[entry]
+                entry = (command.usage, command.help_text, command.custom)
+            usage, help_text, custom = entry
+            if help_text and (custom_enabled or not custom):
+                lines.append(f"  {usage} - {help_text}")
+        return lines
@@ -0,0 +1,214 @@
+"""
+Tab completion and persistent history for the interactive prompt.
+
+Completion uses readline and covers built-in and adb commands, device
+selectors, serials after -s, saved device names and addresses, config
+settings, pipeline stages after `|`, and package names for package
+commands such as `apppath`, `uninstall` and `shell pm ...`. Package names
+come from the cached package index, so pressing tab never queries a device.
+
+Every source is kept as a sorted list and searched by prefix with bisect.
+That is a flattened prefix trie: a lookup costs O(log n) plus the matches,
+without a node per character, so completing across 10k cached packages
+stays far below a millisecond.
+
+History is appended to history.txt after every command (rewritten with
+pyreadline3, which cannot append) and trimmed to HISTORY_LENGTH lines when
+the shell starts. Without a readline module
+(on Windows, install pyreadline3) the prompt works as before.
+"""
+import bisect
+import os
+
+from config_store import DEFAULT_SETTINGS
+from pipeline import STAGES
+
+try:
+    import readline
+except ImportError:
+    readline = None
+
+
+HISTORY_FILE = "history.txt"
+HISTORY_LENGTH = 1000
+# adb commands offered next to the shell's own commands
+ADB_COMMANDS = (
+    "bugreport", "connect", "devices", "disconnect", "emu", "exec-out", "forward",
+    "get-serialno", "get-state", "install", "install-multiple", "kill-server", "logcat",
+    "pair", "pull", "push", "reboot", "remount", "reverse", "root", "shell", "sideload",
+    "start-server", "tcpip", "uninstall", "unroot", "usb", "version", "wait-for-device",
+)
+# Commands whose arguments are package names
+PACKAGE_COMMANDS = {"apppath", "installedapps", "uninstall"}
+# Commands run on the device (after `shell` or `shpm`) whose arguments are package names
+DEVICE_PACKAGE_COMMANDS = {"am", "cmd", "dumpsys", "monkey", "pm"}
+SAVED_NAME_COMMANDS = {"connectsaved", "disconnectsaved", "removesaved"}
+SUBCOMMANDS = {
+    "config": sorted(DEFAULT_SETTINGS),
+    "timing": ["devices", "log", "off", "on"],
+}
+SETTING_VALUES = ["delete", "disable", "enable", "off"]
+PIPELINE_STAGES = sorted(STAGES)
+
+
+def prefix_matches(names, prefix):
+    """Return the names in a sorted list that start with prefix."""
+    start = bisect.bisect_left(names, prefix)
+    end = bisect.bisect_left(names, prefix + "\uffff")
+    return names[start:end]
+
+
+class Completer:
+    """Works out the completions of the word under the cursor."""
+
+    def __init__(self, registry, saved_names, saved_devices, serials, packages):
+        """
+        Args:
+            registry (CommandRegistry): The shell's commands.
+            saved_names (callable): Returns the sorted saved device names.
+            saved_devices (callable): Returns the saved device dicts.
+            serials (callable): Returns the serials of the known devices.
+            packages (callable): Called as packages(serial, prefix) with a
+                serial or None for every device; returns sorted names.
+        """
+        self.registry = registry
+        self.saved_names = saved_names
+        self.saved_devices = saved_devices
+        self.serials = serials
+        self.packages = packages
+        self._commands = []
+        self._command_count = None
+        self._matches = []
+
+    def commands(self):
+        """Return every command name, sorted; rebuilt when commands are registered."""
+        count = len(self.registry.commands) + len(self.registry.aliases)
+        if count != self._command_count:
+            names = set(self.registry.commands) | set(ADB_COMMANDS)
+            names.update(line.split()[0] for line in self.registry.aliases)
+            self._commands = sorted(names)
+            self._command_count = count
+        return self._commands
+
+    def candidates(self, line, begidx):
+        """
+        Return the completions of the word starting at begidx.
+
+        Args:
+            line (str): The whole input line so far.
+            begidx (int): Where the word being completed starts.
+        """
+        text = line[begidx:].split(" ")[0]
+        if "|" in line[:begidx]:
+            # After a pipe only the stage name is completed
+            stage = line[:begidx].rpartition("|")[2]
+            return [] if stage.split() else prefix_matches(PIPELINE_STAGES, text.lower())
+        words = line[:begidx].split()
+        serial = None
+        if words and words[0].startswith("@"):
+            selector = words.pop(0)[1:]
+            serial = selector if selector != "all" and "," not in selector else None
+        if not words:
+            if text.startswith("@"):
+                return self._selectors(text)
+            return prefix_matches(self.commands(), text.lower())
+        command = words[0].lower()
+        if "-s" in words[:-1]:
+            serial = words[words.index("-s") + 1]
+        if words[-1] == "-s":
+            return prefix_matches(sorted(self.serials()), text)
+        if command in SAVED_NAME_COMMANDS:
+            return prefix_matches(self.saved_names(), text)
+        if command in ("connect", "disconnect"):
+            addresses = {d["ip_port"] for d in self.saved_devices()} | {"wsa"}
+            return prefix_matches(sorted(addresses), text)
+        if command in SUBCOMMANDS:
+            options = SUBCOMMANDS[command] if len(words) == 1 else SETTING_VALUES
+            return prefix_matches(options, text.lower())
+        if self._wants_package(words):
+            return self.packages(serial, text)
+        return []
+
+    @staticmethod
+    def _wants_package(words):
+        """Check whether the next argument of a command line is a package name."""
+        command = words[0].lower()
+        if command in PACKAGE_COMMANDS:
+            return True
+        if command == "shpm":
+            return len(words) >= 2
+        # e.g. shell pm clear <package>, shell am force-stop <package>
+        return (command == "shell" and len(words) >= 3
+                and words[1].lower() in DEVICE_PACKAGE_COMMANDS)
+
+    def _selectors(self, text):
+        """Complete @all or the last serial of an @serial1,serial2 selector."""
+        head, _, last = text[1:].rpartition(",")
+        names = sorted(self.serials()) + ([] if head else ["all"])
+        start = "@" + (head + "," if head else "")
+        return [start + name for name in prefix_matches(sorted(names), last)]
+
+    def complete(self, text, state):  # pylint: disable=unused-argument
+        """readline completer: return the state-th completion of the current word."""
+        if state == 0:
+            try:
+                self._matches = self.candidates(readline.get_line_buffer(),
+                                                readline.get_begidx())
+            except Exception:  # readline swallows errors, and a broken tab must not crash
+                self._matches = []
+        return self._matches[state] if state < len(self._matches) else None
+
+
+class History:
+    """Command history kept in a file across sessions."""
+
+    def __init__(self, path=HISTORY_FILE, length=HISTORY_LENGTH):
+        self.path = path
+        self.length = length
+
+    def load(self):
+        """Read the history file, trimming it to the newest length lines."""
+        readline.set_history_length(self.length)
+        try:
+            if os.path.exists(self.path):
+                readline.read_history_file(self.path)
+            # Also creates the file, which appending needs
+            if (readline.get_current_history_length() > self.length
+                    or not os.path.exists(self.path)):
+                readline.write_history_file(self.path)
+        except OSError:
+            pass
+
+    def add(self, line):
+        """Append a command to the history file; readline has already remembered it."""
+        if not line.strip():
+            return
+        try:
+            if hasattr(readline, "append_history_file"):
+                readline.append_history_file(1, self.path)
+            else:
+                # pyreadline3 on Windows can only write the whole history
+                readline.write_history_file(self.path)
+        except OSError:
+            pass
+
+
+def setup_readline(completer, history=None):
+    """
+    Turn on tab completion and load the history.
+
+    Returns:
+        The History, or None if there is no readline module.
+    """
+    if readline is None:
+        return None
+    readline.set_completer(completer.complete)
+    # Only spaces separate words, so @serial, -s and package names complete whole
+    readline.set_completer_delims(" \t\n")
+    if "libedit" in (readline.__doc__ or ""):
+        readline.parse_and_bind("bind ^I rl_complete")
+    else:
+        readline.parse_and_bind("tab: complete")
+    history = history or History()
+    history.load()
+    return history
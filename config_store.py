@@ -0,0 +1,242 @@
+"""
+Structured configuration store for OpenADB Shell.
+
+Settings and saved devices are loaded once into memory, looked up through
+a name -> device index and written back atomically as JSON, only when
+something actually changed. A legacy config.dat is migrated on first load.
+"""
+import json
+import os
+import tempfile
+from threading import Lock
+from time import perf_counter
+
+from metrics import observe
+
+
+CONFIG_FILE = "config.json"
+LEGACY_CONFIG_FILE = "config.dat"
+DEFAULT_SETTINGS = {
+    "do_cust_command": True,
+    "rich_presence": True,
+    "do_mods": False,
+    "background_autoconnect": False,
+    "adb_path": os.path.join("adb", "adb.exe"),
+    "metrics_port": 0,  # Port of the /metrics endpoint on localhost, 0 to turn it off
+}
+
+
+def parse_legacy_config(lines):
+    """
+    Parse the legacy key=value config.dat format.
+
+    Args:
+        lines (iterable): Lines of a config.dat file.
+
+    Returns:
+        (settings, saved_devices) where saved_devices is a list of dicts.
+    """
+    settings = dict(DEFAULT_SETTINGS)
+    saved_devices = []
+    for line in lines:
+        line = line.strip()
+        if "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        if key == "saved_device":
+            parts = value.split("/!/")
+            if len(parts) >= 2:
+                saved_devices.append({
+                    "name": parts[0],
+                    "ip_port": parts[1],
+                    # Older files have no autoconnect flag
+                    "autoconnect": len(parts) >= 3 and parts[2].lower() == "true",
+                })
+        elif key == "adb_path":
+            settings[key] = value
+        elif key in DEFAULT_SETTINGS:
+            settings[key] = value.lower() == "true"
+    return settings, saved_devices
+
+
+class ConfigStore:
+    """In-memory settings and saved devices backed by an atomically written file."""
+
+    def __init__(self, path=CONFIG_FILE, legacy_path=LEGACY_CONFIG_FILE):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.settings = dict(DEFAULT_SETTINGS)
+        self._devices = []
+        self._index = {}
+        self._sorted_names = None  # Built by device_names()
+        self._dirty = False
+        self._lock = Lock()
+        self._listeners = []
+        self.load()
+
+    def load(self):
+        """Load the config, migrating config.dat or writing defaults if needed."""
+        started = perf_counter()
+        with self._lock:
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    self.settings = {**DEFAULT_SETTINGS, **data.get("settings", {})}
+                    self._set_devices(data.get("saved_devices", []))
+                    self._dirty = False
+                    observe("config_load", perf_counter() - started,
+                            devices=len(self._devices))
+                    return
+                except (OSError, ValueError) as e:
+                    print(f"Error loading config: {e}")
+            if os.path.exists(self.legacy_path):
+                with open(self.legacy_path, "r", encoding="utf-8") as f:
+                    self.settings, devices = parse_legacy_config(f)
+                self._set_devices(devices)
+                print(f"Migrated {self.legacy_path} to {self.path}.")
+            self._dirty = True
+        if self.save() and os.path.exists(self.legacy_path):
+            os.replace(self.legacy_path, self.legacy_path + ".bak")
+
+    def save(self):
+        """
+        Write the config atomically if anything changed since the last save.
+
+        Returns:
+            True if the file was written.
+        """
+        with self._lock:
+            if not self._dirty:
+                return False
+            started = perf_counter()
+            data = {"settings": self.settings, "saved_devices": self._devices}
+            directory = os.path.dirname(os.path.abspath(self.path))
+            try:
+                with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory,
+                                                 suffix=".tmp", delete=False) as f:
+                    json.dump(data, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(f.name, self.path)
+            except OSError as e:
+                print(f"Error saving config: {e}")
+                return False
+            self._dirty = False
+        observe("config_save", perf_counter() - started, devices=len(data["saved_devices"]))
+        return True
+
+    def add_listener(self, callback):
+        """Register callback(key, value), called whenever a setting changes."""
+        self._listeners.append(callback)
+
+    def _notify(self, changed):
+        """Tell every listener about changed settings."""
+        for key, value in changed.items():
+            for callback in list(self._listeners):
+                callback(key, value)
+
+    def get(self, key):
+        """Return a setting."""
+        return self.settings.get(key, DEFAULT_SETTINGS.get(key))
+
+    def set(self, key, value):
+        """Change a setting and save it if the value is different."""
+        self.update({key: value})
+
+    def update(self, values):
+        """Change several settings at once, saving once if any of them changed."""
+        with self._lock:
+            changed = {key: value for key, value in values.items()
+                       if self.settings.get(key) != value}
+            if not changed:
+                return
+            self.settings.update(changed)
+            self._dirty = True
+        self.save()
+        self._notify(changed)
+
+    def reset(self):
+        """Reset all settings to default and forget every saved device."""
+        with self._lock:
+            changed = {key: value for key, value in DEFAULT_SETTINGS.items()
+                       if self.settings.get(key) != value}
+            self.settings = dict(DEFAULT_SETTINGS)
+            self._set_devices([])
+            self._dirty = True
+        self.save()
+        self._notify(changed)
+
+    def devices(self):
+        """Return a copy of the saved devices list."""
+        with self._lock:
+            return [dict(device) for device in self._devices]
+
+    def device_names(self):
+        """Return the sorted names of the saved devices."""
+        with self._lock:
+            if self._sorted_names is None:
+                self._sorted_names = sorted(self._index)
+            return self._sorted_names
+
+    def find_device(self, name):
+        """Return the saved device with the given name, or None."""
+        with self._lock:
+            device = self._index.get(name)
+            return dict(device) if device else None
+
+    def set_devices(self, devices):
+        """Replace every saved device."""
+        with self._lock:
+            new_devices = [self._normalize(device) for device in devices]
+            if new_devices == self._devices:
+                return
+            self._set_devices(new_devices)
+            self._dirty = True
+        self.save()
+
+    def add_device(self, name, ip_port, autoconnect=False):
+        """Save a device under a name."""
+        with self._lock:
+            device = {"name": name, "ip_port": ip_port, "autoconnect": autoconnect}
+            self._devices.append(device)
+            self._index.setdefault(name, device)
+            self._sorted_names = None
+            self._dirty = True
+        self.save()
+
+    def remove_device(self, name):
+        """
+        Remove every saved device with the given name.
+
+        Returns:
+            True if a device was removed.
+        """
+        with self._lock:
+            if name not in self._index:
+                return False
+            self._set_devices([d for d in self._devices if d["name"] != name])
+            self._dirty = True
+        self.save()
+        return True
+
+    def clear_devices(self):
+        """Remove all saved devices."""
+        self.set_devices([])
+
+    @staticmethod
+    def _normalize(device):
+        """Return a saved device dict with only the known fields."""
+        return {
+            "name": device["name"],
+            "ip_port": device["ip_port"],
+            "autoconnect": bool(device.get("autoconnect", False)),
+        }
+
+    def _set_devices(self, devices):
+        """Replace the device list and rebuild the name index. Caller holds the lock."""
+        self._devices = [self._normalize(device) for device in devices]
+        self._index = {}
+        self._sorted_names = None
+        for device in self._devices:
+            self._index.setdefault(device["name"], device)
@@ -0,0 +1,302 @@
+"""
+The OpenADB Shell configuration window.
+
+Kept out of openadbshell.py so that tkinter is only imported when the
+window is opened; script mode and systems without Tk never need it.
+"""
+import os
+import tkinter as tk
+from tkinter import BooleanVar, messagebox, filedialog, ttk
+
+from config_store import DEFAULT_SETTINGS
+
+
+def _clear_devices(config_store):
+    """Clear all saved devices immediately."""
+    try:
+        config_store.clear_devices()
+        return True
+    except Exception as e:
+        print(f"Error clearing saved devices: {e}")
+        return False
+
+
+def open_config_window(config_store, on_saved=None):  # pylint: disable=too-many-statements
+    """
+    Opens a configuration window to manage settings and saved devices.
+
+    Args:
+        config_store (ConfigStore): Where the settings and devices are kept.
+        on_saved (callable): Called after the window saved or reset settings.
+    """
+
+    def save_and_close():
+        if not os.path.exists(adb_path_var.get()):
+            messagebox.showerror("Error", "Selected ADB executable not "
+                                          "found. Resetting to default.")
+            adb_path_var.set(DEFAULT_SETTINGS["adb_path"])
+        config_store.update({
+            "do_cust_command": cust_command_var.get(),
+            "rich_presence": rich_presence_var.get(),
+            "do_mods": do_mods_var.get(),
+            "background_autoconnect": background_autoconnect_var.get(),
+            "adb_path": adb_path_var.get(),
+        })
+
+        # Save devices from the table
+        devices = []
+        for item in device_tree.get_children():
+            values = device_tree.item(item, 'values')
+            if len(values) >= 2 and values[0] and values[1]:
+                autoconnect = False
+                if len(values) >= 3:
+                    autoconnect = values[2].upper() == 'Y'
+                devices.append({
+                    "name": values[0],
+                    "ip_port": values[1],
+                    "autoconnect": autoconnect
+                })
+        config_store.set_devices(devices)
+        if on_saved:
+            on_saved()
+
+        config_win.destroy()
+
+    def clear_all_devices():
+        """Clear all saved devices immediately."""
+        result = messagebox.askyesno("Confirm Clear",
+                                     "Are you sure you want to clear all saved "
+                                     "devices? This action cannot be undone.")
+        if result:
+            if _clear_devices(config_store):
+                # Clear the tree view
+                for item in device_tree.get_children():
+                    device_tree.delete(item)
+                messagebox.showinfo("Success",
+                                    "All saved devices have been cleared.")
+            else:
+                messagebox.showerror("Error", "Failed to clear saved devices.")
+
+    def add_device():
+        """Add a new empty row to the device table."""
+        device_tree.insert('', 'end', values=('EXAMPLE_NAME', 'IP:PORT', 'N'))
+
+    def delete_selected_device():
+        """Delete the selected device from the table."""
+        selected_items = device_tree.selection()
+        for item in selected_items:
+            device_tree.delete(item)
+
+    config_win = tk.Tk()
+    config_win.title("OpenADB Config")
+    config_win.geometry("1000x500")
+    config_win.resizable(True, True)
+
+    # Custom commands section
+    cmd_frame = tk.Frame(config_win)
+    cmd_frame.pack(fill=tk.X, padx=10, pady=5)
+
+    cust_command_var = BooleanVar(value=config_store.get("do_cust_command"))
+    chk = tk.Checkbutton(cmd_frame, text="Enable custom command set", variable=cust_command_var)
+    chk.pack(anchor=tk.W)
+
+    rich_presence_var = BooleanVar(value=config_store.get("rich_presence"))
+    rich_presence_chk = tk.Checkbutton(cmd_frame, text="Enable Rich Presence",
+                                       variable=rich_presence_var)
+    rich_presence_chk.pack(anchor=tk.W)
+
+    do_mods_var = BooleanVar(value=config_store.get("do_mods"))
+    do_mods_chk = tk.Checkbutton(cmd_frame, text="Enable mods (unsecure)",
+                                 variable=do_mods_var)
+    do_mods_chk.pack(anchor=tk.W)
+
+    background_autoconnect_var = BooleanVar(value=config_store.get("background_autoconnect"))
+    tk.Checkbutton(cmd_frame, text="Autoconnect saved devices in the background",
+                   variable=background_autoconnect_var).pack(anchor=tk.W)
+
+    # --- ADB Path Section ---
+    adb_frame = tk.LabelFrame(config_win, text="ADB Executable Path", padx=5, pady=5)
+    adb_frame.pack(fill=tk.X, padx=10, pady=5)
+
+    adb_path_var = tk.StringVar(value=config_store.get("adb_path"))
+    adb_entry = tk.Entry(adb_frame, textvariable=adb_path_var, width=60)
+    adb_entry.pack(side=tk.LEFT, padx=5)
+
+    def browse_adb():
+        """Open a file dialog to select adb.exe."""
+        file_path = filedialog.askopenfilename(
+            title="Select adb.exe",
+            filetypes=[("ADB Executable", "adb.exe"), ("All Files", "*")]
+        )
+        if file_path:
+            adb_path_var.set(file_path)
+
+    def reset_adb():
+        """Reset the ADB path to the default relative path."""
+        adb_path_var.set(DEFAULT_SETTINGS["adb_path"])
+
+    def set_to_path():
+        """Set the ADB path to just 'adb' to use the system PATH."""
+        adb_path_var.set("adb")
+
+    browse_btn = tk.Button(adb_frame, text="Browse", command=browse_adb)
+    browse_btn.pack(side=tk.LEFT, padx=5)
+    reset_btn = tk.Button(adb_frame, text="Reset to Default", command=reset_adb)
+    reset_btn.pack(side=tk.LEFT, padx=5)
+    path_btn = tk.Button(adb_frame, text="Call ADB from Path", command=set_to_path)
+    path_btn.pack(side=tk.LEFT, padx=5)
+
+    # Saved devices section
+    devices_frame = tk.LabelFrame(config_win, text="Saved Devices", padx=5, pady=5)
+    devices_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+
+    # Device table
+    columns = ('Name', 'IP:Port', 'Autoconnect')
+    device_tree = ttk.Treeview(devices_frame, columns=columns, show='headings',
+                               height=10)
+
+    # Configure columns
+    device_tree.heading('Name', text='Device Name')
+    device_tree.heading('IP:Port', text='IP Address:Port')
+    device_tree.heading('Autoconnect', text='Autoconnect')
+    device_tree.column('Name', width=150)
+    device_tree.column('IP:Port', width=150)
+    device_tree.column('Autoconnect', width=100)
+
+    # Scrollbar for the tree
+    scrollbar = ttk.Scrollbar(devices_frame, orient=tk.VERTICAL,
+                              command=device_tree.yview)
+    device_tree.configure(yscrollcommand=scrollbar.set)
+
+    # Pack tree and scrollbar
+    device_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+    # Load existing saved devices
+    saved_devices = config_store.devices()
+    for device in saved_devices:
+        autoconnect_display = "Y" if device.get('autoconnect', False) else "N"
+        device_tree.insert('', 'end', values=(device['name'],
+                                              device['ip_port'],
+                                              autoconnect_display))
+
+    # Device management buttons
+    device_btn_frame = tk.Frame(devices_frame)
+    device_btn_frame.pack(fill=tk.X, pady=5)
+
+    add_btn = tk.Button(device_btn_frame, text="Add Device", command=add_device)
+    add_btn.pack(side=tk.LEFT, padx=5)
+
+    delete_btn = tk.Button(device_btn_frame, text="Delete Selected",
+                           command=delete_selected_device)
+    delete_btn.pack(side=tk.LEFT, padx=5)
+
+    clear_btn = tk.Button(device_btn_frame, text="Clear All (Immediate)",
+                          command=clear_all_devices, bg='#ffcccc')
+    clear_btn.pack(side=tk.LEFT, padx=5)
+
+    # Make cells editable
+    def on_double_click(event):
+        """Handle double-click to edit cells."""
+        region = device_tree.identify_region(event.x, event.y)
+        if region == "cell":
+            column = device_tree.identify_column(event.x)
+            item = device_tree.identify('row', event.x, event.y)
+
+            if item:
+                col_index = int(column.replace('#', '')) - 1
+                if col_index in [0, 1, 2]:  # Allow editing Name, IP:Port, and Autoconnect
+                    edit_cell(item, col_index)
+
+    def edit_cell(item, col_index):
+        """Create an entry widget to edit the cell."""
+        bbox = device_tree.bbox(item, column=col_index)
+        if not bbox:
+            return
+        x, y, width, height = bbox
+
+        values = device_tree.item(item, 'values')
+        if col_index >= len(values):
+            return
+        current_value = values[col_index]
+
+        # Special handling for autoconnect column (toggle Y/N)
+        if col_index == 2:  # Autoconnect column
+            new_value = 'Y' if current_value.upper() != 'Y' else 'N'
+            values = list(device_tree.item(item, 'values'))
+            values[col_index] = new_value
+            device_tree.item(item, values=values)
+            return
+
+        # Regular text entry for other columns
+        entry = tk.Entry(device_tree)
+        entry.place(x=x, y=y, width=width, height=height)
+        entry.insert(0, current_value)
+        entry.focus()
+
+        def save_edit(event=None):  # pylint: disable=unused-argument
+            new_value = entry.get()
+            values = list(device_tree.item(item, 'values'))
+            values[col_index] = new_value
+            device_tree.item(item, values=values)
+            entry.destroy()
+
+        def cancel_edit(event=None):  # pylint: disable=unused-argument
+            entry.destroy()
+
+        entry.bind('<Return>', save_edit)
+        entry.bind('<Escape>', cancel_edit)
+        entry.bind('<FocusOut>', save_edit)
+
+    device_tree.bind('<Double-1>', on_double_click)
+
+    # Bottom buttons
+
+    def reset_all():
+        """Reset all settings to default."""
+        result = messagebox.askyesno("Confirm Reset",
+                                     "Are you sure you want to reset all settings? "
+                                     "This action cannot be undone.")
+        if result:
+            cust_command_var.set(DEFAULT_SETTINGS["do_cust_command"])
+            rich_presence_var.set(DEFAULT_SETTINGS["rich_presence"])
+            do_mods_var.set(DEFAULT_SETTINGS["do_mods"])
+            background_autoconnect_var.set(DEFAULT_SETTINGS["background_autoconnect"])
+            adb_path_var.set(DEFAULT_SETTINGS["adb_path"])
+            # Clear the device table
+            for item in device_tree.get_children():
+                device_tree.delete(item)
+            config_store.reset()
+            if on_saved:
+                on_saved()
+            messagebox.showinfo("Success", "All settings have "
+                                           "been reset to default. You may have to relaunch "
+                                           "this shell for some changes to take effect.")
+
+    btn_frame = tk.Frame(config_win)
+    btn_frame.pack(fill=tk.X, padx=10, pady=10)
+
+    save_btn = tk.Button(btn_frame, text="Save", command=save_and_close)
+    save_btn.pack(side=tk.LEFT, padx=5)
+
+    exit_btn = tk.Button(btn_frame, text="Cancel", command=config_win.destroy)
+    exit_btn.pack(side=tk.LEFT, padx=5)
+
+    reset_all_btn = tk.Button(
+        btn_frame,
+        text="Reset All",
+        command=reset_all,
+    )
+    reset_all_btn.pack(side=tk.LEFT, padx=5)
+
+    # Instructions
+    instructions = tk.Label(config_win,
+                            text="Double-click cells to edit. "
+                                 "Click Autoconnect column to toggle Y/N. "
+                                 "Use 'Save' to apply table changes, "
+                                 "'Clear All' takes "
+                                 "immediate effect.",
+                            font=('Arial', 8), fg='gray')
+    instructions.pack(side=tk.BOTTOM, pady=5)
+
+    config_win.mainloop()
@@ -0,0 +1,119 @@
+"""
+Event-driven device tracking for OpenADB Shell.
+
+Holds a single host:track-devices stream open to the adb server and keeps
+an in-memory map of serial -> state, notifying listeners as soon as a
+device is added, removed or changes state. Tracking runs as a task on the
+shell's asyncio event loop; listeners are called on the loop.
+"""
+import asyncio
+from threading import Event, Lock
+from time import perf_counter
+
+from adb_client import AdbError, AdbConnectionError
+from metrics import observe
+
+
+class DeviceTracker:
+    """Tracks attached devices through the adb server's track-devices stream."""
+
+    def __init__(self, client, on_server_missing=None, max_backoff=10.0):
+        """
+        Args:
+            client (AdbClient): The client used to open the tracking stream.
+            on_server_missing (callable): Called when the adb server cannot be
+                reached, e.g. to start it. Optional.
+            max_backoff (float): Longest wait in seconds between reconnects.
+        """
+        self.client = client
+        self.on_server_missing = on_server_missing
+        self.max_backoff = max_backoff
+        self._states = {}
+        self._lock = Lock()
+        self._listeners = []
+        self._task = None
+        self.synced = Event()  # Set once the first listing (or failure) is in
+
+    def add_listener(self, callback):
+        """
+        Register a callback for device events.
+
+        The callback is called as callback(event, serial, state) where event is
+        one of "added", "removed" or "changed".
+        """
+        self._listeners.append(callback)
+
+    def states(self):
+        """Return a copy of the current serial -> state map."""
+        with self._lock:
+            return dict(self._states)
+
+    def count(self, exclude=("offline", "unauthorized")):
+        """Return the number of devices whose state is not excluded."""
+        with self._lock:
+            return sum(1 for state in self._states.values() if state not in exclude)
+
+    def start(self):
+        """Start tracking devices as a task. Must be called on the event loop."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        """Stop tracking devices. Safe to call from any thread."""
+        if self._task is not None:
+            self._task.get_loop().call_soon_threadsafe(self._task.cancel)
+
+    def update(self, device_list):
+        """
+        Apply a full device listing, firing events for anything that changed.
+
+        Args:
+            device_list (list): (serial, state) tuples from the adb server.
+        """
+        started = perf_counter()
+        new_states = dict(device_list)
+        events = []
+        with self._lock:
+            for serial, state in new_states.items():
+                old_state = self._states.get(serial)
+                if old_state is None:
+                    events.append(("added", serial, state))
+                elif old_state != state:
+                    events.append(("changed", serial, state))
+            for serial, state in self._states.items():
+                if serial not in new_states:
+                    events.append(("removed", serial, state))
+            self._states = new_states
+        for event in events:
+            self._notify(*event)
+        observe("device_update", perf_counter() - started, devices=len(new_states),
+                changes=len(events))
+        return events
+
+    def _notify(self, event, serial, state):
+        """Call every listener, keeping the tracker alive if one fails."""
+        for callback in list(self._listeners):
+            try:
+                callback(event, serial, state)
+            except Exception as e:
+                print(f"Error in device listener: {e}")
+
+    async def _run(self):
+        """Hold the tracking stream open, reconnecting with backoff."""
+        backoff = 0.5
+        while True:
+            try:
+                async for device_list in self.client.watch_devices():
+                    backoff = 0.5
+                    self.update(device_list)
+                    self.synced.set()
+            except AdbConnectionError:
+                if self.on_server_missing:
+                    await asyncio.to_thread(self.on_server_missing)
+            except (AdbError, OSError, ValueError):
+                pass
+            # The server went away, so every device is gone until it returns.
+            self.update([])
+            self.synced.set()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
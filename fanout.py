@@ -0,0 +1,133 @@
+"""
+Parallel fan-out of shell commands across several devices.
+
+Commands can be prefixed with a device selector (@all, -all or
+@serial1,serial2) to run them on every selected device at once.
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import perf_counter
+
+from metrics import note_device
+
+
+MAX_PARALLEL_DEVICES = 8
+
+
+def print_line(text):
+    """Print a line in a single write so lines from parallel devices do not mix."""
+    print(f"{text}\n", end='', flush=True)
+
+
+def split_device_selector(command):
+    """
+    Split a leading device selector off a command.
+
+    Args:
+        command (str): The command as typed, e.g. "@all installedapps".
+
+    Returns:
+        (command, selector) where selector is None when no selector was given,
+        "all" for @all/-all, or a list of serials.
+    """
+    parts = command.strip().split(None, 1)
+    if not parts:
+        return command, None
+    first = parts[0]
+    rest = parts[1] if len(parts) > 1 else ""
+    if first.lower() in ("@all", "-all"):
+        return rest, "all"
+    if first.startswith("@") and len(first) > 1:
+        serials = [s.strip() for s in first[1:].split(",") if s.strip()]
+        return rest, serials
+    return command, None
+
+
+def resolve_targets(selector, states):
+    """
+    Turn a selector into a list of serials.
+
+    Args:
+        selector: "all" or a list of serials, as returned by split_device_selector.
+        states (dict): serial -> state of the devices currently attached.
+    """
+    if selector == "all":
+        return sorted(serial for serial, state in states.items() if state == "device")
+    return list(selector)
+
+
+def run_on_devices(serials, run, max_workers=MAX_PARALLEL_DEVICES):
+    """
+    Run a command on several devices at once and print a summary.
+
+    Args:
+        serials (list): Serials of the devices to run on.
+        run (callable): Called as run(serial, prefix) and returns True on success.
+            Output should be printed with the given per-device prefix.
+        max_workers (int): Maximum number of devices handled at the same time.
+
+    Returns:
+        True if the command succeeded on every device.
+    """
+    if not serials:
+        print("Error: No devices selected.")
+        return False
+    start = perf_counter()
+    results = fan_out(serials, run, max_workers)
+    print_summary(results, perf_counter() - start)
+    return all(success for success, _ in results.values())
+
+
+def fan_out(serials, run, max_workers=MAX_PARALLEL_DEVICES):
+    """
+    Run a command on several devices at once.
+
+    Args:
+        serials (list): Serials of the devices to run on.
+        run (callable): Called as run(serial, prefix) and returns True on success.
+        max_workers (int): Maximum number of devices handled at the same time.
+
+    Returns:
+        A dict of serial -> (success, elapsed seconds).
+    """
+    width = max(len(serial) for serial in serials)
+    results = {}
+
+    def timed_run(serial):
+        device_start = perf_counter()
+        try:
+            success = run(serial, f"[{serial.ljust(width)}] ")
+        except Exception as e:
+            print_line(f"[{serial.ljust(width)}] Error: {e}")
+            success = False
+        elapsed = perf_counter() - device_start
+        note_device(serial, elapsed)
+        return success, elapsed
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(serials)))) as pool:
+        # Copy the context so each device thread still belongs to the caller's job
+        futures = {pool.submit(contextvars.copy_context().run, timed_run, serial): serial
+                   for serial in serials}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
+
+
+def print_summary(results, elapsed, notes=None):
+    """
+    Print the per-device status summary of a fan-out run.
+
+    Args:
+        results (dict): serial -> (success, elapsed seconds).
+        elapsed (float): Total wall time of the run in seconds.
+        notes (dict): Optional serial -> extra text shown for that device.
+    """
+    notes = notes or {}
+    failed = sum(1 for success, _ in results.values() if not success)
+    print("--------------------------------------------")
+    print(f"Ran on {len(results)} device(s): {len(results) - failed} succeeded, "
+          f"{failed} failed in {elapsed:.2f}s")
+    for serial in sorted(results):
+        success, device_elapsed = results[serial]
+        note = f" - {notes[serial]}" if serial in notes else ""
+        print(f"  {serial}: {'OK' if success else 'FAILED'} ({device_elapsed:.2f}s){note}")
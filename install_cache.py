@@ -0,0 +1,109 @@
+"""
+Content-hash install ledger so installapp can skip devices that already
+have exactly the same build installed.
+"""
+import hashlib
+import json
+import os
+import re
+
+from adb_client import AdbError
+
+
+LEDGER_FILE = "install_cache.json"
+VERSION_CODE_PATTERN = re.compile(r"versionCode=(\d+)")
+PACKAGE_PATH_PATTERN = re.compile(r"^package:/", re.MULTILINE)
+
+
+class InstallCache:
+    """Remembers which split APK set was installed on which device."""
+
+    def __init__(self, path=LEDGER_FILE):
+        self.path = path
+        self.files = {}  # path -> [mtime, size, sha256]
+        self.devices = {}  # serial -> {package: {"hash": ..., "version_code": ...}}
+        self.load()
+
+    def load(self):
+        """Load the ledger from disk, starting empty if it is missing or corrupt."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.devices = data.get("devices", {})
+        except (OSError, ValueError):
+            self.files = {}
+            self.devices = {}
+
+    def save(self):
+        """Write the ledger to disk."""
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"files": self.files, "devices": self.devices}, f, indent=1)
+        except OSError as e:
+            print(f"Error saving install cache: {e}")
+
+    def file_hash(self, path):
+        """Return the sha256 of a file, reusing the stored one if mtime and size match."""
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        cached = self.files.get(key)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        self.files[key] = [stat.st_mtime, stat.st_size, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def set_hash(self, apk_files):
+        """Return one hash covering every APK of a split set."""
+        digest = hashlib.sha256()
+        for path in sorted(apk_files):
+            digest.update(os.path.basename(path).encode("utf-8"))
+            digest.update(self.file_hash(path).encode("ascii"))
+        return digest.hexdigest()
+
+    def is_installed(self, serial, package, apk_hash, version_code):
+        """
+        Check whether the ledger says this exact build is on the device.
+
+        version_code is what the device has installed, None if the package is
+        missing, which is never installed even if the APK had no versionCode.
+        """
+        entry = self.devices.get(serial, {}).get(package)
+        return bool(entry) and version_code is not None and entry["hash"] == apk_hash and \
+            entry["version_code"] == version_code
+
+    def record(self, serial, package, apk_hash, version_code):
+        """Remember that a build was installed on a device."""
+        self.devices.setdefault(serial, {})[package] = {
+            "hash": apk_hash,
+            "version_code": version_code,
+        }
+
+
+def installed_version_code(client, serial, package):
+    """
+    Ask a device which versionCode of a package it has installed.
+
+    Args:
+        client (AdbClient): The client used to query the device.
+        serial (str): The device to query.
+        package (str): The package name to look up.
+
+    Returns:
+        The versionCode, or None if the package is missing or the device
+        could not be queried.
+    """
+    try:
+        output = b"".join(client.shell(f"pm path {package}; dumpsys package {package}",
+                                       serial))
+    except (AdbError, OSError):
+        return None
+    output = output.decode("utf-8", errors="replace")
+    if not PACKAGE_PATH_PATTERN.search(output):
+        return None
+    match = VERSION_CODE_PATTERN.search(output)
+    return int(match.group(1)) if match else None
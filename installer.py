@@ -0,0 +1,164 @@
+"""
+Concurrent multi-device APK deployment for the installapp command.
+"""
+import os
+from time import perf_counter
+
+from apk_info import read_apk_info
+from fanout import MAX_PARALLEL_DEVICES, fan_out, print_line, print_summary
+from install_cache import InstallCache, installed_version_code
+from jobs import killed
+from metrics import metrics
+
+
+APK_DIR = "apks"
+
+
+def find_apks(directory=APK_DIR):
+    """
+    Find the split APK set to install.
+
+    Args:
+        directory (str): Folder holding the APKs of a single app.
+
+    Returns:
+        A sorted list of APK paths, or None if the folder does not exist.
+    """
+    if not os.path.exists(directory):
+        return None
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                  if f.endswith('.apk'))
+
+
+def install_command(serial, apk_files):
+    """Build the adb arguments installing the split set on one device."""
+    paths = " ".join(f'"{apk}"' for apk in apk_files)
+    return f"-s {serial} install-multiple -r {paths}"
+
+
+def parse_install_args(args):
+    """
+    Parse the installapp options.
+
+    Args:
+        args (list): Tokens after installapp, e.g. ["--jobs", "4"].
+
+    Returns:
+        A dict with jobs, retries and force, or None if the options are invalid.
+    """
+    options = {"jobs": MAX_PARALLEL_DEVICES, "retries": 1, "force": False}
+    i = 0
+    while i < len(args):
+        name = args[i].lower().lstrip("-")
+        if name == "force":
+            options["force"] = True
+            i += 1
+            continue
+        if name not in options or i + 1 >= len(args) or not args[i + 1].isdigit():
+            return None
+        options[name] = int(args[i + 1])
+        i += 2
+    options["jobs"] = max(1, options["jobs"])
+    return options
+
+
+def deploy(serials, apk_files, run, jobs=MAX_PARALLEL_DEVICES, retries=1,
+           check=None, on_installed=None):
+    """
+    Install the split set on every device at once, retrying only failures.
+
+    Args:
+        serials (list): Serials of the devices to install on.
+        apk_files (list): The APK paths found by find_apks.
+        run (callable): Called as run(args, prefix) to run one adb command.
+        jobs (int): Maximum number of devices installed to at the same time.
+        retries (int): How many more times failed devices are retried.
+        check (callable): Optional check(serial) returning a reason to skip
+            the device, or None to install.
+        on_installed (callable): Optional on_installed(serial) called after
+            every successful install.
+
+    Returns:
+        True if the install succeeded on every device.
+    """
+    if not serials:
+        print("Error: No devices selected.")
+        return False
+    print(f"Installing {len(apk_files)} APK(s) to {len(serials)} device(s), "
+          f"up to {jobs} at a time...")
+
+    skipped = {}
+
+    def install(serial, prefix):
+        if check and serial not in skipped:
+            reason = check(serial)
+            if reason:
+                skipped[serial] = reason
+                print_line(f"{prefix}Skipped: {reason}")
+                return True
+        print_line(f"{prefix}Installing...")
+        success = run(install_command(serial, apk_files), prefix)
+        metrics.count_install(serial, success)
+        if success and on_installed:
+            on_installed(serial)
+        return success
+
+    start = perf_counter()
+    results = {}
+    attempts = {}
+    pending = list(serials)
+    for attempt in range(retries + 1):
+        if attempt:
+            print(f"Retrying {len(pending)} failed device(s)...")
+        for serial, result in fan_out(pending, install, jobs).items():
+            results[serial] = result
+            attempts[serial] = attempt + 1
+        pending = [serial for serial in pending if not results[serial][0]]
+        if not pending or killed():
+            break
+
+    notes = {serial: f"{count} attempts" for serial, count in attempts.items() if count > 1}
+    notes.update({serial: f"skipped, {reason}" for serial, reason in skipped.items()})
+    print_summary(results, perf_counter() - start, notes)
+    return not pending
+
+
+def install_app(serials, apk_files, run, client, jobs=MAX_PARALLEL_DEVICES, retries=1,
+                force=False):
+    """
+    Install the split set, skipping devices that already have this exact build.
+
+    Args:
+        serials (list): Serials of the devices to install on.
+        apk_files (list): The APK paths found by find_apks.
+        run (callable): Called as run(args, prefix) to run one adb command.
+        client (AdbClient): The client used to check installed versions.
+        jobs (int): Maximum number of devices installed to at the same time.
+        retries (int): How many more times failed devices are retried.
+        force (bool): Install even on devices that already match.
+    """
+    cache = InstallCache()
+    package, version_code = None, None
+    for apk in apk_files:
+        package, version_code = read_apk_info(apk)
+        if package:
+            break
+    if not package:
+        return deploy(serials, apk_files, run, jobs, retries)
+    apk_hash = cache.set_hash(apk_files)
+
+    def check(serial):
+        if force:
+            return None
+        if cache.is_installed(serial, package, apk_hash,
+                              installed_version_code(client, serial, package)):
+            return f"{package} ({version_code}) already installed"
+        return None
+
+    def on_installed(serial):
+        cache.record(serial, package, apk_hash, version_code)
+
+    try:
+        return deploy(serials, apk_files, run, jobs, retries, check, on_installed)
+    finally:
+        cache.save()
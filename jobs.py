@@ -0,0 +1,308 @@
+"""
+Background jobs for the OpenADB Shell prompt.
+
+Commands run in worker threads so the asyncio event loop driving the
+device tracker and the mod event server never blocks. A command ending
+in `&` becomes a background job that `jobs`, `fg` and `kill` manage.
+Processes and sockets a job opens are registered with it through
+track(), so killing the job stops them and its thread finishes.
+
+The prompt itself stays on the main thread, which is where Ctrl+C
+arrives. A command run in the foreground is a job too: Ctrl+C kills it
+and returns to the prompt. Questions a foreground command asks with
+ask() are read on the main thread as well, so Ctrl+C also works there.
+"""
+import asyncio
+import contextvars
+import os
+import queue
+import signal
+import socket
+import subprocess
+from threading import Event, Lock, Thread
+from time import perf_counter
+
+
+current_job = contextvars.ContextVar("current_job", default=None)
+POLL_INTERVAL = 0.1  # Seconds between checks for Ctrl+C while waiting, Windows needs them
+STOP_GRACE = 1.0  # Seconds a stopped foreground command gets to print its last output
+
+
+def split_background(line):
+    """Split a trailing '&' off a command line, returning (line, background)."""
+    stripped = line.rstrip()
+    if stripped.endswith("&") and not stripped.endswith("&&"):
+        return stripped[:-1].rstrip(), True
+    return line, False
+
+
+def stop_resource(resource):
+    """Stop a process (with its children) or close a socket-like object."""
+    try:
+        if isinstance(resource, subprocess.Popen):
+            if os.name == "nt":
+                # shell=True puts cmd.exe in between, so kill the whole tree
+                subprocess.run(["taskkill", "/T", "/F", "/PID", str(resource.pid)],
+                               capture_output=True, check=False)
+            elif os.getpgid(resource.pid) == resource.pid:
+                os.killpg(resource.pid, signal.SIGKILL)
+            else:
+                resource.kill()
+        elif isinstance(resource, socket.socket):
+            resource.shutdown(socket.SHUT_RDWR)
+            resource.close()
+        else:
+            resource.close()
+    except OSError:
+        pass
+
+
+def track(resource):
+    """Register a process or socket with the job running in this context, if any."""
+    job = current_job.get()
+    if job is not None:
+        job.track(resource)
+
+
+def untrack(resource):
+    """Forget a resource registered with track()."""
+    job = current_job.get()
+    if job is not None:
+        job.untrack(resource)
+
+
+def killed():
+    """Check whether the job running in this context was killed."""
+    job = current_job.get()
+    return job is not None and job.killed.is_set()
+
+
+def ask(prompt=""):
+    """
+    Read a line of input for a command, like input().
+
+    A foreground command's question is passed to the main thread and read
+    there, so Ctrl+C stops the command instead of leaving a question
+    behind that would take the next line typed at the prompt.
+
+    Raises:
+        KeyboardInterrupt: If Ctrl+C was pressed instead of answering.
+    """
+    job = current_job.get()
+    if job is None or job.questions is None:
+        return input(prompt)
+    answer = queue.SimpleQueue()
+    job.questions.put((prompt, answer))
+    line = answer.get()
+    if line is None:
+        raise KeyboardInterrupt
+    return line
+
+
+def run_foreground(command, run):
+    """
+    Run a command in a worker thread while the calling (main) thread waits.
+
+    The wait wakes up every POLL_INTERVAL, so Ctrl+C reaches the caller on
+    every platform. Ctrl+C kills the command like `kill` kills a job and
+    raises KeyboardInterrupt once the command stopped, or after STOP_GRACE
+    seconds if it is stuck in something that cannot be stopped.
+
+    Returns:
+        What run() returned; exceptions it raised, SystemExit included,
+        are raised again here.
+    """
+    job = Job(None, command)
+    job.questions = queue.SimpleQueue()
+    outcome = {}
+
+    def body():
+        current_job.set(job)
+        try:
+            outcome["result"] = run()
+        except BaseException as e:  # Raised again in the waiting thread
+            outcome["error"] = e
+        finally:
+            job.finished.set()
+
+    Thread(target=contextvars.copy_context().run, args=(body,), daemon=True).start()
+    answer = None
+    try:
+        while not job.finished.is_set():
+            try:
+                prompt, answer = job.questions.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            try:
+                line = input(prompt)
+            except EOFError:
+                line = ""
+            answer.put(line)
+            answer = None
+    except KeyboardInterrupt:
+        job.kill()
+        if answer is not None:
+            answer.put(None)
+        try:
+            job.finished.wait(STOP_GRACE)
+        finally:
+            print()  # The prompt goes below the ^C
+        raise
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome.get("result")
+
+
+class Job:
+    """A command running in a worker thread."""
+
+    def __init__(self, job_id, command):
+        self.id = job_id
+        self.command = command
+        self.started = perf_counter()
+        self.task = None
+        self.result = None
+        self.questions = None  # Set for foreground commands, see ask()
+        self.killed = Event()
+        self.finished = Event()
+        self._resources = []
+        self._lock = Lock()
+
+    def track(self, resource):
+        """Register a resource to stop when the job is killed."""
+        with self._lock:
+            self._resources.append(resource)
+        if self.killed.is_set():
+            stop_resource(resource)
+
+    def untrack(self, resource):
+        """Forget a resource that was closed normally."""
+        with self._lock:
+            if resource in self._resources:
+                self._resources.remove(resource)
+
+    def kill(self):
+        """Stop every process and socket of the job."""
+        self.killed.set()
+        with self._lock:
+            resources = list(self._resources)
+        for resource in resources:
+            stop_resource(resource)
+
+    def status(self):
+        """Return Running, Killed, Done or Failed."""
+        if not self.finished.is_set():
+            return "Running"
+        if self.killed.is_set():
+            return "Killed"
+        return "Done" if self.result is not False else "Failed"
+
+
+class JobManager:
+    """Runs commands as background jobs on the asyncio event loop."""
+
+    def __init__(self):
+        self.jobs = {}
+        self._next_id = 1
+        self._lock = Lock()
+
+    def start(self, command, run, loop):
+        """
+        Start run() as a background job on an event loop, from any thread.
+
+        Returns:
+            The new Job.
+        """
+        with self._lock:
+            job = Job(self._next_id, command)
+            self._next_id += 1
+            self.jobs[job.id] = job
+
+        async def body():
+            current_job.set(job)
+            return await asyncio.to_thread(run)
+
+        job.task = asyncio.run_coroutine_threadsafe(body(), loop)
+        job.task.add_done_callback(lambda task: self._finished(job, task))
+        return job
+
+    def _finished(self, job, task):
+        """Record a job's result and report it like a shell would."""
+        if not task.cancelled() and task.exception() is not None:
+            job.result = False
+            print(f"Error in job {job.id}: {task.exception()}")
+        elif not task.cancelled():
+            job.result = task.result()
+        job.finished.set()
+        with self._lock:
+            self.jobs.pop(job.id, None)
+        print(f"\n[{job.id}] {job.status()}  {job.command}")
+
+    def get(self, job_id=None):
+        """Return a job by id, or the most recent one if no id is given."""
+        with self._lock:
+            if job_id is None:
+                return self.jobs[max(self.jobs)] if self.jobs else None
+            return self.jobs.get(job_id)
+
+    def running(self):
+        """Return the running jobs, oldest first."""
+        with self._lock:
+            return [self.jobs[job_id] for job_id in sorted(self.jobs)]
+
+    def kill_all(self):
+        """Kill every running job."""
+        for job in self.running():
+            job.kill()
+
+
+def register_job_commands(registry, manager):
+    """Register the jobs, fg and kill commands, which are always available."""
+
+    def find_job(parsed):
+        job_id = parsed.args[0].lstrip("%") if parsed.args else None
+        if job_id is not None and not job_id.isdigit():
+            print("Error: Please provide a job number.")
+            return None
+        job = manager.get(int(job_id) if job_id else None)
+        if job is None:
+            print("Error: No such job.")
+        return job
+
+    def jobs_command(parsed):  # pylint: disable=unused-argument
+        running = manager.running()
+        if not running:
+            print("No background jobs.")
+        for job in running:
+            print(f"[{job.id}] {job.status()}  {perf_counter() - job.started:.1f}s  "
+                  f"{job.command}")
+        return True
+
+    def fg_command(parsed):
+        job = find_job(parsed)
+        if job is None:
+            return False
+        print(job.command)
+        while not job.finished.wait(POLL_INTERVAL):
+            if killed():  # Ctrl+C stops the job like it stops any foreground command
+                job.kill()
+                job.finished.wait(STOP_GRACE)
+                return False
+        return job.result
+
+    def kill_command(parsed):
+        job = find_job(parsed)
+        if job is None:
+            return False
+        job.kill()
+        print(f"Killing job {job.id}: {job.command}")
+        return True
+
+    registry.add_help("<command> &", "Run a command as a background job", custom=False)
+    registry.register("jobs", jobs_command, help_text="List background jobs", custom=False)
+    registry.register("fg", fg_command, "fg [<job>]",
+                      "Wait for a background job (the latest one by default) to finish",
+                      max_args=1, custom=False)
+    registry.register("kill", kill_command, "kill [<job>]",
+                      "Stop a background job (the latest one by default)",
+                      max_args=1, custom=False)
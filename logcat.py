@@ -0,0 +1,267 @@
+"""
+High-throughput logcat streaming for the logcat command.
+
+The threadtime stream is read from the adb server in large chunks and
+split into lines as bytes. Tag and priority filters are handed to logcat
+on the device so filtered lines never cross the wire, a --grep regex is
+matched against the raw bytes, and only the lines that pass are decoded
+for the console. Lines can also go to a size-rotated, optionally gzipped
+file per device, and the last lines of every device are kept in a bounded
+ring buffer that `logcat --last` prints.
+"""
+import gzip
+import os
+import re
+import shutil
+from collections import deque
+from threading import Lock
+
+from adb_client import AdbError
+from commands import split_args
+
+
+PRIORITIES = "VDIWEF"
+CHUNK_SIZE = 262144
+MAX_LOGCAT_DEVICES = 64  # Every selected device streams at once
+USAGE = ("logcat [--tag <tag>] [--priority <V|D|I|W|E|F>] [--grep <regex>] [--out <dir>] "
+         "[--max-size <MB>] [--keep <n>] [--gzip] [--quiet] [--ring <n>] [--dump] "
+         "or logcat --last [<n>]")
+_VALUE_OPTIONS = {"tag", "priority", "grep", "out", "max-size", "keep", "ring"}
+_FLAG_OPTIONS = {"gzip", "quiet", "dump"}
+
+_recent = {}  # serial -> deque of the last lines, as bytes
+_recent_lock = Lock()
+
+
+def parse_logcat_args(args):
+    """
+    Parse the logcat options.
+
+    Args:
+        args (list): Tokens after logcat, e.g. ["--tag", "ActivityManager"].
+
+    Returns:
+        A dict of options, or None if the arguments are not logcat command
+        options, in which case they are meant for adb logcat itself.
+
+    Raises:
+        ValueError: If an option has an invalid value.
+    """
+    options = {"tags": [], "priority": "V", "grep": None, "out": None, "max_size": 16,
+               "keep": 5, "gzip": False, "quiet": False, "ring": 1000, "dump": False,
+               "last": None}
+    i = 0
+    while i < len(args):
+        name = args[i].lower()[2:] if args[i].startswith("--") else None
+        if name == "last":
+            count = args[i + 1] if i + 1 < len(args) else "20"
+            if not count.isdigit() or i + 2 < len(args):
+                raise ValueError(f"Usage: {USAGE}")
+            options["last"] = int(count)
+            return options
+        if name in _FLAG_OPTIONS:
+            options[name] = True
+            i += 1
+            continue
+        if name not in _VALUE_OPTIONS:
+            return None
+        if i + 1 >= len(args):
+            raise ValueError(f"Usage: {USAGE}")
+        _set_option(options, name, args[i + 1])
+        i += 2
+    return options
+
+
+def _set_option(options, name, value):
+    """Validate and store one option value."""
+    if name == "tag":
+        options["tags"] += [tag for tag in value.split(",") if tag]
+    elif name == "priority":
+        if value.upper() not in PRIORITIES or len(value) != 1:
+            raise ValueError(f"Priority must be one of {', '.join(PRIORITIES)}.")
+        options["priority"] = value.upper()
+    elif name == "grep":
+        try:
+            options["grep"] = re.compile(value.encode("utf-8"))
+        except re.error as e:
+            raise ValueError(f"Invalid regex: {e}") from e
+    elif name == "out":
+        options["out"] = value
+    else:
+        if not value.isdigit() or int(value) < 1:
+            raise ValueError(f"--{name} must be a positive number.")
+        options[name.replace("-", "_")] = int(value)
+
+
+def device_command(options):
+    """Build the logcat command run on the device, with tag and priority filters."""
+    command = ["logcat", "-v", "threadtime"]
+    if options["dump"]:
+        command.append("-d")
+    if options["tags"]:
+        command += [f"{tag}:{options['priority']}" for tag in options["tags"]] + ["*:S"]
+    elif options["priority"] != "V":
+        command.append(f"*:{options['priority']}")
+    return " ".join(command)
+
+
+class RotatingLog:
+    """A log file that is rotated to .1, .2, ... once it reaches a size limit."""
+
+    def __init__(self, path, max_bytes, keep=5, compress=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.compress = compress
+        self.file = open(path, "ab")  # pylint: disable=consider-using-with
+        self.size = self.file.tell()
+
+    def write(self, data):
+        """Append bytes, rotating first if they would exceed the size limit."""
+        if self.size and self.size + len(data) > self.max_bytes:
+            self.rotate()
+        self.file.write(data)
+        self.size += len(data)
+
+    def _name(self, number):
+        """Return the file name of a rotated log."""
+        return f"{self.path}.{number}" + (".gz" if self.compress else "")
+
+    def rotate(self):
+        """Shift the rotated files up by one and start a new log."""
+        self.file.close()
+        for number in range(self.keep - 1, 0, -1):
+            if os.path.exists(self._name(number)):
+                os.replace(self._name(number), self._name(number + 1))
+        if self.compress:
+            # Level 1 keeps rotation fast on busy devices
+            with open(self.path, "rb") as src, gzip.open(self._name(1), "wb",
+                                                         compresslevel=1) as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self._name(1))
+        self.file = open(self.path, "ab")  # pylint: disable=consider-using-with
+        self.size = 0
+
+    def close(self):
+        """Close the current log file."""
+        self.file.close()
+
+
+def log_path(directory, serial):
+    """Return the log file of a device, with characters unsafe in file names replaced."""
+    return os.path.join(directory, "logcat_" + re.sub(r"[^\w.-]", "_", serial) + ".txt")
+
+
+def stream_logcat(client, serial, options, prefix=""):
+    """
+    Stream a device's logcat to the console, a rotated file and the ring buffer.
+
+    Args:
+        client (AdbClient): The client used to reach the device.
+        serial (str): The device to read from.
+        options (dict): Options from parse_logcat_args.
+        prefix (str): Text printed in front of every console line.
+
+    Returns:
+        True once the stream ends, e.g. after --dump or when the job is killed.
+    """
+    ring = deque(maxlen=options["ring"])
+    with _recent_lock:
+        _recent[serial] = ring
+    log = None
+    if options["out"]:
+        os.makedirs(options["out"], exist_ok=True)
+        log = RotatingLog(log_path(options["out"], serial), options["max_size"] << 20,
+                          options["keep"], options["gzip"])
+    grep = options["grep"]
+    pending = b""
+    try:
+        for chunk in client.exec_out(device_command(options), serial, CHUNK_SIZE):
+            data = pending + chunk
+            end = data.rfind(b"\n") + 1
+            pending = data[end:]
+            lines = data[:end].splitlines(keepends=True)
+            if grep is not None:
+                lines = [line for line in lines if grep.search(line)]
+            if lines:
+                _emit(lines, ring, log, options["quiet"], prefix)
+        if pending and (grep is None or grep.search(pending)):
+            _emit([pending + b"\n"], ring, log, options["quiet"], prefix)
+    finally:
+        if log is not None:
+            log.close()
+    return True
+
+
+def _emit(lines, ring, log, quiet, prefix):
+    """Send a batch of matching lines everywhere they go, with one write each."""
+    ring.extend(lines)
+    block = b"".join(lines)
+    if log is not None:
+        log.write(block)
+    if not quiet:
+        text = block.decode("utf-8", errors="replace").replace("\r\n", "\n")
+        if prefix:
+            text = "".join(f"{prefix}{line}" for line in text.splitlines(keepends=True))
+        print(text, end='', flush=True)
+
+
+def recent_lines(serial, count):
+    """Return the last count lines seen from a device, decoded."""
+    with _recent_lock:
+        ring = _recent.get(serial)
+        lines = list(ring)[-count:] if ring is not None and count else []
+    return [line.decode("utf-8", errors="replace").rstrip("\r\n") for line in lines]
+
+
+def buffered_serials():
+    """Return the serials that have lines in the ring buffer."""
+    with _recent_lock:
+        return sorted(_recent)
+
+
+def print_recent(serials, count):
+    """Print the last count lines of each device from the ring buffer."""
+    for serial in serials:
+        prefix = f"[{serial}] " if len(serials) > 1 else ""
+        print("".join(f"{prefix}{line}\n" for line in recent_lines(serial, count)), end='')
+
+
+def register_logcat_command(registry, services):
+    """
+    Register the logcat command.
+
+    Args:
+        registry (CommandRegistry): The shell's command registry.
+        services (dict): Shell services: client, run_adb, run_on_selected,
+            selected_serials and targets.
+    """
+    def logcat_command(parsed):
+        try:
+            options = parse_logcat_args(split_args(parsed.raw))
+        except ValueError as e:
+            print(f"Error: {e}")
+            return False
+        if options is None:
+            # Not our options, so they are meant for adb logcat itself
+            return services["run_adb"](f"logcat {parsed.raw}".strip())
+        if options["last"] is not None:
+            targets = services["targets"]()
+            print_recent(services["selected_serials"](targets) if targets
+                         else buffered_serials(), options["last"])
+            return True
+
+        def stream(serial, prefix):
+            try:
+                return stream_logcat(services["client"], serial, options, prefix)
+            except (AdbError, OSError) as e:
+                print(f"{prefix}Error: {e}\n", end='')
+                return False
+        return services["run_on_selected"](stream, max_workers=MAX_LOGCAT_DEVICES)
+
+    registry.register("logcat", logcat_command, USAGE,
+                      "Stream logcat, filtered by tag, priority and regex, to the console "
+                      "and/or size-rotated files per device. Run it with & and stop it with "
+                      "kill. Other options are passed to adb logcat", max_args=None)
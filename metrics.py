@@ -0,0 +1,300 @@
+"""
+Per-command timing and metrics for OpenADB Shell.
+
+Every command line gets a CommandTiming in a context variable, so the
+layers doing the work can report into it without being passed anything:
+process_stream and adb_client note when a process was spawned or a
+server connection opened and every chunk of output, fan-out notes how
+long each device took. `timing on` prints the result after each command,
+`timing log <file>` appends one JSON line per command (and per device
+poll and config read or write) to a file, and per-device latencies are
+collected into histograms that `timing devices` prints.
+
+Metrics also keeps the fleet counters served by metrics_server: commands
+run, installs per device and bytes transferred per device.
+"""
+import copy
+import cProfile
+import contextvars
+import io
+import json
+import pstats
+from threading import Lock
+from time import perf_counter, time
+
+
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+PROFILE_LINES = 20
+
+current_timing = contextvars.ContextVar("current_timing", default=None)
+
+
+def format_bytes(count):
+    """Return a byte count as B, KB or MB."""
+    if count < 1024:
+        return f"{count} B"
+    if count < 1 << 20:
+        return f"{count / 1024:.1f} KB"
+    return f"{count / (1 << 20):.1f} MB"
+
+
+class CommandTiming:
+    """Where the time of one command line went."""
+
+    def __init__(self, command):
+        self.command = command
+        self.started = perf_counter()
+        self.spawn = None  # Seconds to start the first process or open the first connection
+        self.first_byte = None  # Seconds until the first output arrived
+        self.bytes = 0
+        self.devices = {}  # serial -> seconds
+        self._lock = Lock()
+
+    def spawned(self, seconds):
+        """Record the time a process spawn or server connection took."""
+        with self._lock:
+            if self.spawn is None:
+                self.spawn = seconds
+
+    def output(self, count):
+        """Record a chunk of output."""
+        with self._lock:
+            if self.first_byte is None:
+                self.first_byte = perf_counter() - self.started
+            self.bytes += count
+
+    def device(self, serial, seconds):
+        """Record how long the command took on one device."""
+        with self._lock:
+            self.devices[serial] = seconds
+
+    def summary(self, wall):
+        """Return the timing line printed by `timing on`."""
+        def ms(seconds):
+            return "-" if seconds is None else f"{seconds * 1000:.1f} ms"
+        return (f"[timing] wall {ms(wall)} | spawn/connect {ms(self.spawn)} | "
+                f"first byte {ms(self.first_byte)} | {format_bytes(self.bytes)} streamed")
+
+
+class Histogram:
+    """Counts of latencies per bucket of BUCKETS_MS."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.total = 0.0
+
+    def add(self, milliseconds):
+        """Count one latency."""
+        for i, bound in enumerate(BUCKETS_MS):
+            if milliseconds <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += milliseconds
+
+    def to_dict(self):
+        """Return the histogram as JSON-ready data."""
+        labels = [f"<={bound}" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}"]
+        return {"count": sum(self.counts), "total_ms": round(self.total, 3),
+                "buckets_ms": dict(zip(labels, self.counts))}
+
+
+class Metrics:
+    """Prints command timings and writes the JSON-lines metrics log."""
+
+    def __init__(self):
+        self.enabled = False  # Print a timing line after every command
+        self.log = None
+        self.log_path = None
+        self.histograms = {}  # serial -> Histogram
+        self.commands = {"ok": 0, "failed": 0}
+        self.command_histogram = Histogram()
+        self.installs = {}  # (serial, "ok" or "failed") -> count
+        self.transfers = {}  # (serial, "pull" or "push") -> bytes
+        self.state_changes = {}  # serial -> time() of its last state change
+        self._lock = Lock()
+
+    def start(self, command):
+        """Start timing a command line in the current context."""
+        timing = CommandTiming(command)
+        current_timing.set(timing)
+        return timing
+
+    def finish(self, timing, result):
+        """Print and log a finished command."""
+        wall = perf_counter() - timing.started
+        with self._lock:
+            self.commands["ok" if result is not False else "failed"] += 1
+            self.command_histogram.add(wall * 1000)
+            for serial, seconds in timing.devices.items():
+                self.histograms.setdefault(serial, Histogram()).add(seconds * 1000)
+        if self.enabled:
+            print(timing.summary(wall))
+        if self.log is not None:
+            self.write({"event": "command", "command": timing.command,
+                        "ok": result is not False, "wall_ms": _ms(wall),
+                        "spawn_ms": _ms(timing.spawn), "first_byte_ms": _ms(timing.first_byte),
+                        "bytes": timing.bytes,
+                        "devices_ms": {serial: _ms(seconds)
+                                       for serial, seconds in timing.devices.items()}})
+
+    def count_install(self, serial, success):
+        """Count an install attempt on a device."""
+        key = (serial, "ok" if success else "failed")
+        with self._lock:
+            self.installs[key] = self.installs.get(key, 0) + 1
+
+    def count_transfer(self, serial, direction, count):
+        """Count bytes pulled from or pushed to a device."""
+        key = (serial, direction)
+        with self._lock:
+            self.transfers[key] = self.transfers.get(key, 0) + count
+
+    def device_event(self, event, serial, state):  # pylint: disable=unused-argument
+        """Device tracker listener remembering when each device last changed state."""
+        with self._lock:
+            self.state_changes[serial] = time()
+
+    def snapshot(self):
+        """Return a copy of the fleet counters, taken at one moment."""
+        with self._lock:
+            return copy.deepcopy({
+                "commands": self.commands, "command_histogram": self.command_histogram,
+                "histograms": self.histograms, "installs": self.installs,
+                "transfers": self.transfers, "state_changes": self.state_changes})
+
+    def write(self, event):
+        """Append an event to the metrics log, if one is open."""
+        with self._lock:
+            if self.log is not None:
+                self.log.write(json.dumps({"time": time(), **event}) + "\n")
+                self.log.flush()
+
+    def open_log(self, path):
+        """Start appending metrics to a JSON-lines file."""
+        self.close_log()
+        log = open(path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+        with self._lock:
+            self.log, self.log_path = log, path
+
+    def close_log(self):
+        """Write the device histograms to the log and close it."""
+        if self.log is None:
+            return
+        self.write({"event": "histograms", "devices": self.histogram_data()})
+        with self._lock:
+            self.log.close()
+            self.log = self.log_path = None
+
+    def histogram_data(self):
+        """Return every device's latency histogram as JSON-ready data."""
+        with self._lock:
+            return {serial: histogram.to_dict()
+                    for serial, histogram in sorted(self.histograms.items())}
+
+
+def _ms(seconds):
+    """Round seconds to milliseconds for the log."""
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+metrics = Metrics()
+
+
+def note_spawn(seconds):
+    """Report how long starting a process or opening a connection took."""
+    timing = current_timing.get()
+    if timing is not None:
+        timing.spawned(seconds)
+
+
+def note_output(count):
+    """Report a chunk of command output."""
+    timing = current_timing.get()
+    if timing is not None:
+        timing.output(count)
+
+
+def note_device(serial, seconds):
+    """Report how long a command took on one device."""
+    timing = current_timing.get()
+    if timing is not None:
+        timing.device(serial, seconds)
+
+
+def observe(event, seconds, **fields):
+    """Log a background measurement, e.g. a device poll or a config save."""
+    if metrics.log is not None:
+        metrics.write({"event": event, "ms": _ms(seconds), **fields})
+
+
+def profile(run, *args):
+    """
+    Run run(*args) under cProfile.
+
+    Returns:
+        (result, report) where report lists the functions that took the
+        most time themselves. Only the calling thread is profiled.
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(run, *args)
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats("tottime").print_stats(PROFILE_LINES)
+    return result, report.getvalue()
+
+
+def register_timing_commands(registry, services):
+    """
+    Register the timing and profile commands.
+
+    Args:
+        registry (CommandRegistry): The shell's command registry.
+        services (dict): Shell services; profile runs commands with run_line, so
+            the command is timed once, as part of the profile command.
+    """
+    def timing_command(parsed):
+        args = [arg.lower() for arg in parsed.args]
+        if args in (["on"], ["off"]):
+            metrics.enabled = args[0] == "on"
+            print(f"Command timing {'enabled' if metrics.enabled else 'disabled'}.")
+        elif args == ["log", "off"]:
+            metrics.close_log()
+            print("Metrics log closed.")
+        elif args[:1] == ["log"] and len(args) >= 2:
+            path = parsed.raw.split(None, 1)[1]
+            try:
+                metrics.open_log(path)
+            except OSError as e:
+                print(f"Error: {e}")
+                return False
+            print(f"Writing metrics to {path}.")
+        elif args == ["devices"]:
+            data = metrics.histogram_data()
+            if not data:
+                print("No device latencies recorded yet.")
+            for serial, histogram in data.items():
+                buckets = "  ".join(f"{label}ms:{count}" for label, count
+                                    in histogram["buckets_ms"].items() if count)
+                print(f"{serial}: {histogram['count']} command(s), average "
+                      f"{histogram['total_ms'] / histogram['count']:.1f} ms  {buckets}")
+        elif not args:
+            print(f"Command timing is {'on' if metrics.enabled else 'off'}, metrics log: "
+                  f"{metrics.log_path or 'off'}.")
+        else:
+            print("Error: Usage: timing [on|off|devices] or timing log <file|off>")
+            return False
+        return True
+
+    def profile_command(parsed):
+        result, report = profile(services["run_line"], parsed.raw)
+        print(report, end='')
+        return result
+
+    registry.register("timing", timing_command, "timing [on|off|devices|log <file|off>]",
+                      "Print wall, spawn and first-byte time and bytes streamed after each "
+                      "command, show per-device latency histograms or log metrics as JSON "
+                      "lines", max_args=None, custom=False)
+    registry.register("profile", profile_command, "profile <command>",
+                      "Run a command under cProfile and print its hotspots",
+                      min_args=1, max_args=None, custom=False)
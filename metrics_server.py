@@ -0,0 +1,181 @@
+"""
+Prometheus-style metrics endpoint for OpenADB Shell.
+
+When the metrics_port setting is set, the shell serves GET /metrics on
+localhost in the Prometheus text format: the state of every tracked
+device and how long it has been in it, command counts and latencies,
+install results and bytes transferred per device. Everything is rendered
+from the device tracker and the metrics counters in memory, so a scrape
+never runs adb. The server runs on the shell's asyncio event loop.
+"""
+import asyncio
+from threading import get_ident
+from time import time
+
+from metrics import BUCKETS_MS
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+MAX_REQUEST = 8192  # Longest request head read before giving up on a client
+REQUEST_TIMEOUT = 10.0
+
+
+def _labels(**labels):
+    """Format Prometheus labels, escaping the values."""
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _histogram(lines, name, histogram, **labels):
+    """Add a Histogram with millisecond buckets as a histogram in seconds."""
+    cumulative = 0
+    for bound, count in zip(BUCKETS_MS, histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound / 1000)} {cumulative}")
+    total = sum(histogram.counts)
+    lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {total}')
+    lines.append(f"{name}_sum{_labels(**labels)} {round(histogram.total / 1000, 6)}")
+    lines.append(f"{name}_count{_labels(**labels)} {total}")
+
+
+def render(metrics, states, now=None):
+    """
+    Render the fleet metrics in the Prometheus text format.
+
+    Args:
+        metrics (Metrics): The shell's metrics counters.
+        states (dict): serial -> state, as kept by the device tracker.
+        now (float): Current time(), for the state ages.
+
+    Returns:
+        str: The exposition text.
+    """
+    now = time() if now is None else now
+    counters = metrics.snapshot()
+    changes = counters["state_changes"]
+    lines = [
+        "# HELP openadbshell_device_state Devices known to the adb server, by state.",
+        "# TYPE openadbshell_device_state gauge",
+    ]
+    lines += [f"openadbshell_device_state{_labels(serial=serial, state=state)} 1"
+              for serial, state in sorted(states.items())]
+    lines += [
+        "# HELP openadbshell_device_state_age_seconds Time since the device last "
+        "changed state.",
+        "# TYPE openadbshell_device_state_age_seconds gauge",
+    ]
+    lines += [f"openadbshell_device_state_age_seconds{_labels(serial=serial)} "
+              f"{max(now - changes[serial], 0.0):.3f}"
+              for serial in sorted(states) if serial in changes]
+    lines += [
+        "# HELP openadbshell_commands_total Command lines run, by result.",
+        "# TYPE openadbshell_commands_total counter",
+    ]
+    lines += [f"openadbshell_commands_total{_labels(result=result)} {count}"
+              for result, count in counters["commands"].items()]
+    lines += [
+        "# HELP openadbshell_command_duration_seconds Wall time of command lines.",
+        "# TYPE openadbshell_command_duration_seconds histogram",
+    ]
+    _histogram(lines, "openadbshell_command_duration_seconds", counters["command_histogram"])
+    lines += [
+        "# HELP openadbshell_device_command_duration_seconds Time commands took on "
+        "each device.",
+        "# TYPE openadbshell_device_command_duration_seconds histogram",
+    ]
+    for serial, histogram in sorted(counters["histograms"].items()):
+        _histogram(lines, "openadbshell_device_command_duration_seconds", histogram,
+                   serial=serial)
+    lines += [
+        "# HELP openadbshell_installs_total Install attempts per device, by result.",
+        "# TYPE openadbshell_installs_total counter",
+    ]
+    lines += [f"openadbshell_installs_total{_labels(serial=serial, result=result)} {count}"
+              for (serial, result), count in sorted(counters["installs"].items())]
+    lines += [
+        "# HELP openadbshell_transfer_bytes_total Bytes pulled from or pushed to each "
+        "device.",
+        "# TYPE openadbshell_transfer_bytes_total counter",
+    ]
+    lines += [f"openadbshell_transfer_bytes_total"
+              f"{_labels(serial=serial, direction=direction)} {count}"
+              for (serial, direction), count in sorted(counters["transfers"].items())]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves render() over HTTP on localhost."""
+
+    def __init__(self, metrics, states, host="127.0.0.1"):
+        """
+        Args:
+            metrics (Metrics): The counters to serve.
+            states (callable): Returns the tracker's serial -> state map.
+            host (str): Address to listen on, localhost only by default.
+        """
+        self.metrics = metrics
+        self.states = states
+        self.host = host
+        self.port = None
+        self._loop = None
+        self._loop_thread = None
+        self._server = None
+
+    async def start(self, port):
+        """Listen on port, or stop serving if port is 0 or None."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = get_ident()
+        await self.close()
+        if port:
+            self._server = await asyncio.start_server(self._on_connect, self.host, port,
+                                                      limit=MAX_REQUEST)
+            self.port = port
+
+    def set_port(self, port):
+        """
+        Move the endpoint to another port, or stop it. Safe to call from any thread.
+
+        Raises:
+            OSError: If the port cannot be listened on.
+        """
+        if self._loop is None or self._loop.is_closed():
+            return
+        future = asyncio.run_coroutine_threadsafe(self.start(port), self._loop)
+        if get_ident() != self._loop_thread:
+            future.result(timeout=5.0)
+
+    async def close(self):
+        """Stop listening."""
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = self.port = None
+
+    async def _on_connect(self, reader, writer):
+        """Answer one HTTP request and close the connection."""
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT)
+            request_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+            method, path = (request_line.split(" ") + ["", ""])[:2]
+            if method not in ("GET", "HEAD"):
+                status, body = "405 Method Not Allowed", "Only GET is supported.\n"
+            elif path.split("?", 1)[0] not in ("/metrics", "/"):
+                status, body = "404 Not Found", "Metrics are served at /metrics.\n"
+            else:
+                status, body = "200 OK", render(self.metrics, self.states())
+            data = body.encode("utf-8")
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                         f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n"
+                         .encode("latin-1") + (data if method != "HEAD" else b""))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                OSError):
+            pass
+        finally:
+            writer.close()
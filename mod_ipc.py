@@ -0,0 +1,153 @@
+"""
+Local event channel between the shell and its mods.
+
+The shell listens on a localhost TCP port (written to mods/ipc_port.dat)
+and pushes line-delimited JSON events to every connected mod: a state
+snapshot on connect, state changes as soon as they happen, device events
+and a periodic heartbeat. The server and its heartbeat run as tasks on the
+shell's asyncio event loop. Events published close together are sent in a
+single write per mod.
+"""
+import asyncio
+import json
+import os
+from threading import Lock, get_ident
+from time import time
+
+
+HEARTBEAT_INTERVAL = 10.0
+PORT_FILE = os.path.join("mods", "ipc_port.dat")
+# A mod that stops reading is dropped once this much output is waiting for it
+MAX_BUFFERED = 1 << 20
+
+
+class ModEventServer:
+    """Pushes shell state and events to subscribed mods."""
+
+    def __init__(self, host="127.0.0.1", port=0, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 on_heartbeat=None):
+        """
+        Args:
+            host (str): Address to listen on, localhost only by default.
+            port (int): Port to listen on, 0 picks a free one.
+            heartbeat_interval (float): Seconds between heartbeat events.
+            on_heartbeat (callable): Optional hook called on every heartbeat,
+                e.g. to keep the legacy running.dat file fresh.
+        """
+        self.host = host
+        self.port = port
+        self.heartbeat_interval = heartbeat_interval
+        self.on_heartbeat = on_heartbeat
+        self.state = {}
+        self._state_lock = Lock()
+        self._subscribers = []
+        self._pending = []
+        self._loop = None
+        self._loop_thread = None
+        self._server = None
+        self._heartbeat = None
+
+    async def start(self, port_file=PORT_FILE):
+        """Start listening and write the chosen port for mods to discover."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = get_ident()
+        self._server = await asyncio.start_server(self._on_connect, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if port_file:
+            try:
+                with open(port_file, "w", encoding="utf-8") as f:
+                    f.write(str(self.port))
+            except OSError as e:
+                print(f"Error writing mod IPC port: {e}")
+        self._heartbeat = self._loop.create_task(self._heartbeat_loop())
+        return self.port
+
+    def stop(self):
+        """Tell mods the shell is exiting and close every connection."""
+        if self._server is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self.close(), self._loop)
+        if get_ident() != self._loop_thread:
+            future.result(timeout=1.0)
+
+    async def close(self):
+        """Send the exit event, then close the server and every connection."""
+        if self._server is None:
+            return
+        self._queue({"event": "exit"})
+        self._flush()
+        self._heartbeat.cancel()
+        self._server.close()
+        for writer in list(self._subscribers):
+            await self._drop(writer)
+        self._server = None
+
+    def publish(self, event):
+        """Queue an event for every subscribed mod. Safe to call from any thread."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._queue, event)
+
+    def update_state(self, **changes):
+        """Record state changes and publish only the values that differ."""
+        with self._state_lock:
+            changed = {key: value for key, value in changes.items()
+                       if self.state.get(key) != value}
+            if not changed:
+                return
+            self.state.update(changed)
+        self.publish({"event": "state", **changed})
+
+    @staticmethod
+    def _encode(events):
+        """Encode events as line-delimited JSON."""
+        return "".join(json.dumps(event) + "\n" for event in events).encode("utf-8")
+
+    def _queue(self, event):
+        """Add an event to the next batch, flushing once this loop iteration ends."""
+        self._pending.append(event)
+        if len(self._pending) == 1:
+            self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        """Send every queued event to every mod in one write."""
+        events, self._pending = self._pending, []
+        if not events:
+            return
+        payload = self._encode(events)
+        for writer in list(self._subscribers):
+            if writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+                self._loop.create_task(self._drop(writer))
+            else:
+                writer.write(payload)
+
+    async def _on_connect(self, reader, writer):
+        """Send a new mod the current state snapshot and keep it subscribed."""
+        with self._state_lock:
+            snapshot = {"event": "hello", "time": time(), **self.state}
+        writer.write(self._encode([snapshot]))
+        self._subscribers.append(writer)
+        try:
+            # Mods only listen; reading just notices when they disconnect
+            while await reader.read(4096):
+                pass
+        except OSError:
+            pass
+        await self._drop(writer)
+
+    async def _heartbeat_loop(self):
+        """Publish a heartbeat every heartbeat_interval seconds."""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            self._queue({"event": "heartbeat", "time": time()})
+            if self.on_heartbeat:
+                self.on_heartbeat()
+
+    async def _drop(self, writer):
+        """Forget a mod whose connection went away."""
+        if writer in self._subscribers:
+            self._subscribers.remove(writer)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
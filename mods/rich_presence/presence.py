@@ -3,86 +3,200 @@
 from time import time, sleep
 import os
 import sys
-import datetime
-from threading import Thread
+import json
+import socket
+from threading import Condition, Thread
 from pypresence import Presence
+from pypresence.exceptions import PyPresenceException
 
 
-def update_vars():
-    """Update variables from files"""
-    global enabled_rich_presence, devices, exiting
+CLIENT_ID = "REDACTED"  # Replace with your actual Discord client ID
+STATE_TEXT = ("Connected to {} device(s) in OpenADB Shell! Download here: "
+              "https://github.com/lukbrew25/openadbshell")
+# Changes within this many seconds of the last update are sent together,
+# which also keeps us under Discord's limit of 5 updates per 20 seconds
+DEBOUNCE = 5.0
+MAX_BACKOFF = 60.0
+FILE_POLL_INTERVAL = 15.0
+ENABLED_FILE = os.path.join("mods", "rich_presence", "enabled.dat")
+DEVICES_FILE = os.path.join("mods", "devices.dat")
+RUNNING_FILE = os.path.join("mods", "running.dat")
+
+
+class ShellState:
+    """What the shell told us, shared between the reader thread and the updater."""
+
+    def __init__(self, enabled, devices):
+        self.enabled = enabled
+        self.devices = devices
+        self.exiting = False
+        self.version = 0  # Goes up with every change
+        self.changed = Condition()
+
+    def set(self, **values):
+        """Change some of enabled, devices and exiting, waking the updater if any differ."""
+        with self.changed:
+            values = {key: value for key, value in values.items()
+                      if getattr(self, key) != value}
+            if values:
+                for key, value in values.items():
+                    setattr(self, key, value)
+                self.version += 1
+                self.changed.notify_all()
+
+    def wait(self, version, timeout=None):
+        """Wait until the state moved past version or timeout seconds passed."""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version or self.exiting, timeout)
+            return self.version
+
+    def pause(self, seconds):
+        """Sleep for seconds, waking early if the shell exits."""
+        with self.changed:
+            self.changed.wait_for(lambda: self.exiting, seconds)
+
+    def wanted(self):
+        """Return the presence the state asks for; the device count only matters when shown."""
+        with self.changed:
+            return (self.enabled, self.devices if self.enabled else None)
+
+
+def read_ipc_port():
+    """Read the port the shell pushes mod events on, if it wrote one."""
+    try:
+        with open(os.path.join("mods", "ipc_port.dat"), "r", encoding="utf-8") as datafile:
+            return int(datafile.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def read_file(path):
+    """Return the stripped contents of a small text file."""
+    with open(path, "r", encoding="utf-8") as datafile:
+        return datafile.read().strip()
+
+
+def listen_for_events(state, port):
+    """Update the state as the shell pushes events, until the shell goes away."""
+    # The shell sends a heartbeat every 10 seconds, so silence means it is gone
+    with socket.create_connection(("127.0.0.1", port), timeout=30) as sock:
+        for line in sock.makefile("r", encoding="utf-8"):
+            event = json.loads(line)
+            if "rich_presence" in event:
+                state.set(enabled=bool(event["rich_presence"]))
+            if "devices" in event:
+                state.set(devices=str(event["devices"]))
+            if event.get("event") == "exit":
+                break
+
+
+def poll_files(state):
+    """Follow the .dat files of older shells, only reading the ones that were rewritten."""
+    seen = {}
+    while True:
+        for path, key in ((ENABLED_FILE, "enabled"), (DEVICES_FILE, "devices")):
+            modified = os.path.getmtime(path)
+            if seen.get(path) != modified:
+                seen[path] = modified
+                value = read_file(path)
+                state.set(**{key: value == "1" if key == "enabled" else value})
+        # running.dat is rewritten every heartbeat, so its age tells if the shell is gone
+        if os.path.exists(RUNNING_FILE) and time() - os.path.getmtime(RUNNING_FILE) > 30:
+            return
+        sleep(FILE_POLL_INTERVAL)
+
+
+def update_vars(state):
+    """Update the state from the shell's event stream, or from files for older shells"""
     try:
-        while True:
-            with open(os.path.join("mods", "rich_presence",
-                                   "enabled.dat"), "r", encoding="utf-8"
-                      ) as datafile:
-                enabled_rich_presence = datafile.read().strip() == "1"
-                datafile.close()
-            with open(os.path.join("mods", "devices.dat"),
-                      "r", encoding="utf-8") as datafile:
-                devices = datafile.read().strip()
-                datafile.close()
-            with open(os.path.join("mods", "running.dat"), "r", encoding="utf-8") as datafile:
-                running = datafile.read().strip()
-                datafile.close()
-                if running:
-                    running_time = datetime.datetime.strptime(running, "%Y-%m-%d %H:%M:%S.%f")
-                    current_time = datetime.datetime.now()
-                    if (current_time - running_time).total_seconds() > 30:
-                        exiting = True
-                        break
-            sleep(15)
+        port = read_ipc_port()
+        if port:
+            try:
+                listen_for_events(state, port)
+                return
+            except OSError:
+                pass  # Fall back to the files, they tell if the shell is gone
+            except ValueError as e:
+                print(f"Error reading shell events: {e}")
+        poll_files(state)
     except Exception as e:
         print(f"Error reading files: {e}")
+    finally:
+        state.set(exiting=True)
+
 
+def close_quietly(rpc):
+    """Close a Discord connection that may already be broken."""
+    try:
+        rpc.close()
+    except (PyPresenceException, OSError, RuntimeError, AssertionError):
+        pass
 
-RPC = None
-exiting = False
-try:
-    if not os.path.exists(os.path.join("mods", "rich_presence", "enabled.dat")):
-        with open(os.path.join("mods", "rich_presence", "enabled.dat"), "w", encoding="utf-8") as f:
-            f.write("1")
-            f.close()
-    if not os.path.exists(os.path.join("mods", "devices.dat")):
-        with open(os.path.join("mods", "devices.dat"), "w", encoding="utf-8") as f:
-            f.write("0")
-            f.close()
-    with open(os.path.join("mods", "rich_presence", "enabled.dat"), "r", encoding="utf-8") as f:
-        enabled_rich_presence = f.read().strip() == "1"
-        f.close()
-    with open(os.path.join("mods", "devices.dat"), "r", encoding="utf-8") as f:
-        devices = f.read().strip()
-        f.close()
-    Thread(target=update_vars, daemon=True).start()
+
+def run_updater(state, make_client=lambda: Presence(CLIENT_ID)):
+    """
+    Keep Discord showing the state, sending an update only when it changed.
+
+    One connection is kept for as long as it works. When an update fails
+    the connection is dropped and made again on the next attempt, waiting
+    twice as long after each failure, up to MAX_BACKOFF seconds.
+    """
+    rpc = None
+    sent = (False, None)  # Nothing is shown until the first update
+    last_sent = 0.0
+    backoff = 0.0  # Seconds until the next retry after a failure, 0 if none is due
+    version = 0
     start = int(time())
-    while not exiting:
-        if enabled_rich_presence:
-            client_id = "REDACTED"  # Replace with your actual Discord client ID
-            RPC = Presence(client_id)
-            RPC.connect()
-            RPC.update(state="Connected to " + str(devices) + " devices in "
-                             "OpenADB Shell! Download here: "
-                             "https://github.com/lukbrew25/openadbshell",
-                       start=start)
-            sleep(15)
-            while not exiting:
-                if not enabled_rich_presence or exiting:
-                    RPC.close()
-                    break
-                RPC.update(state="Connected to " + str(devices) +
-                                 " device(s) in OpenADB Shell! Download here: "
-                                 "https://github.com/lukbrew25/openadbshell",
-                           start=start)
-                sleep(15)
-        if not enabled_rich_presence or exiting:
-            if RPC:
-                RPC.close()
+    while True:
+        if state.wanted() == sent and not state.exiting:
+            version = state.wait(version)
+        if state.exiting:
             break
-        sleep(30)
-except Exception as e:
-    print(f"Error in Rich Presence: {e}")
+        # Coalesce changes that arrive shortly after the previous update
+        delay = max(last_sent + DEBOUNCE - time(), backoff)
+        if delay > 0:
+            state.pause(delay)
+            if state.exiting:
+                break
+        wanted = state.wanted()
+        if wanted == sent:
+            continue
+        try:
+            if rpc is None:
+                rpc = make_client()
+                rpc.connect()
+            if wanted[0]:
+                rpc.update(state=STATE_TEXT.format(wanted[1]), start=start)
+            else:
+                rpc.clear()
+            sent, backoff = wanted, 0.0
+        except (PyPresenceException, OSError, RuntimeError) as e:
+            print(f"Error updating Rich Presence: {e}")
+            if rpc is not None:
+                close_quietly(rpc)
+                rpc = None
+            backoff = min(backoff * 2 or 1.0, MAX_BACKOFF)
+        last_sent = time()
+    if rpc is not None:
+        close_quietly(rpc)
+
+
+def main():
+    """Show the shell's device count in Discord until the shell exits."""
+    try:
+        if not os.path.exists(ENABLED_FILE):
+            with open(ENABLED_FILE, "w", encoding="utf-8") as f:
+                f.write("1")
+        if not os.path.exists(DEVICES_FILE):
+            with open(DEVICES_FILE, "w", encoding="utf-8") as f:
+                f.write("0")
+        state = ShellState(read_file(ENABLED_FILE) == "1", read_file(DEVICES_FILE))
+        Thread(target=update_vars, args=(state,), daemon=True).start()
+        run_updater(state)
+    except Exception as e:
+        print(f"Error in Rich Presence: {e}")
+    sys.exit(0)
 
-if RPC:
-    RPC.close()
 
-sys.exit(0)
+if __name__ == "__main__":
+    main()
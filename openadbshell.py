@@ -9,924 +9,896 @@ interacting with ADB (Android Debug Bridge).
 import subprocess
 import sys
 import os
-from time import sleep
-import tkinter as tk
-from tkinter import BooleanVar, messagebox, filedialog, ttk
+from time import perf_counter, sleep
 import datetime
-from threading import Thread, Event
+import asyncio
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextvars import ContextVar
+from functools import partial
+from threading import Thread
+from startup import StartupTimer, adb_version, cached_adb_version
+from adb_client import AdbClient, AdbError, AdbConnectionError, run_native_command
+from device_tracker import DeviceTracker
+from fanout import split_device_selector, resolve_targets, run_on_devices, MAX_PARALLEL_DEVICES
+from autoconnect import autoconnect_devices
+from installer import find_apks, parse_install_args, install_app
+from config_store import ConfigStore
+from mod_ipc import ModEventServer, PORT_FILE
+from plugins import PluginManager
+from commands import CommandRegistry
+from shell_session import ShellSessions
+from jobs import (POLL_INTERVAL, JobManager, ask, register_job_commands, run_foreground,
+                  split_background)
+from pipeline import STAGES, run_pipeline, split_pipeline
+from process_stream import stream_process, ADB_FAILURE_PATTERN
+from logcat import register_logcat_command
+from capture import register_capture_commands
+from completion import Completer, setup_readline
+from package_index import PackageIndex
+from sync_transfer import register_transfer_commands
+from batch import parse_arguments, read_script, run_script
+from metrics import metrics, note_device, register_timing_commands
+from metrics_server import MetricsServer
 
 
 adb_path = os.path.join("adb", "adb.exe")
-
-
-def save_config():
-    """Save configuration to config.dat file."""
-    try:
-        with open("config.dat", "w", encoding="utf-8") as config_file:
-            config_file.write(f"do_cust_command={do_cust_command}\n")
-            config_file.write(f"rich_presence={rich_presence}\n")
-            config_file.write(f"do_mods={do_mods}\n")
-            config_file.write(f"adb_path={adb_path}\n")
-            config_file.close()
-    except Exception as e:
-        print(f"Error saving config: {e}")
+adb_client = AdbClient()
+shell_sessions = ShellSessions(adb_client)  # One persistent shell per device
+package_index = PackageIndex()
 
 
 def load_config():
-    """Load configuration from config.dat file."""
+    """Load configuration from the config store."""
     global do_cust_command
     global rich_presence
     global do_mods
+    global background_autoconnect
     global adb_path
-    try:
-        if os.path.exists("config.dat"):
-            with open("config.dat", "r", encoding="utf-8") as config_file:
-                for line in config_file:
-                    line = line.strip()
-                    if line.startswith("do_cust_command="):
-                        value = line.split("=", 1)[1]
-                        do_cust_command = value.lower() == "true"
-                    if line.startswith("rich_presence="):
-                        value = line.split("=", 1)[1]
-                        rich_presence = value.lower() == "true"
-                    if line.startswith("do_mods="):
-                        value = line.split("=", 1)[1]
-                        do_mods = value.lower() == "true"
-                    if line.startswith("adb_path="):
-                        adb_path = line.split("=", 1)[1]
-                config_file.close()
-        else:
-            # Create config file with default value if it doesn't exist
-            with open("config.dat", "w", encoding="utf-8") as config_file:
-                config_file.write("do_cust_command=True\n")
-                config_file.write("rich_presence=True\n")
-                config_file.write("do_mods=False\n")
-                config_file.write(f"adb_path={adb_path}\n")
-                config_file.close()
-    except Exception as e:
-        print(f"Error loading config: {e}")
+    do_cust_command = config_store.get("do_cust_command")
+    rich_presence = config_store.get("rich_presence")
+    do_mods = config_store.get("do_mods")
+    background_autoconnect = config_store.get("background_autoconnect")
+    adb_path = config_store.get("adb_path")
 
 
 def load_saved_devices():
-    """Load saved devices from config.dat file."""
-    saved_devices = []
-    try:
-        if os.path.exists("config.dat"):
-            with open("config.dat", "r", encoding="utf-8") as config_file:
-                for line in config_file:
-                    line = line.strip()
-                    if line.startswith("saved_device="):
-                        device_data = line.split("=", 1)[1]
-                        if "/!/" in device_data:
-                            parts = device_data.split("/!/")
-                            if len(parts) >= 2:
-                                name, ip_port = parts[0], parts[1]
-                                # Check for autoconnect flag (backward compatibility)
-                                autoconnect = False
-                                if len(parts) >= 3:
-                                    autoconnect = parts[2].lower() == "true"
-                                saved_devices.append({
-                                    "name": name,
-                                    "ip_port": ip_port,
-                                    "autoconnect": autoconnect
-                                })
-    except Exception as e:
-        print(f"Error loading saved devices: {e}")
-    return saved_devices
+    """Load saved devices from the config store."""
+    return config_store.devices()
 
 
-def save_saved_devices(devices):
-    """Save devices to config.dat file, preserving other config entries."""
+def autoconnect_on_startup():
+    """Connect to devices with autoconnect enabled on startup."""
     try:
-        # Read existing non-device config entries
-        other_configs = []
-        if os.path.exists("config.dat"):
-            with open("config.dat", "r", encoding="utf-8") as config_file:
-                for line in config_file:
-                    line = line.strip()
-                    if not line.startswith("saved_device="):
-                        other_configs.append(line)
-
-        # Write all config entries back
-        with open("config.dat", "w", encoding="utf-8") as config_file:
-            for config_line in other_configs:
-                if config_line:  # Skip empty lines
-                    config_file.write(f"{config_line}\n")
-            for device in devices:
-                autoconnect_str = "True" if device.get('autoconnect', False) else "False"
-                config_file.write(f"saved_device={device['name']}/!/"
-                                  f"{device['ip_port']}/!/{autoconnect_str}\n")
+        autoconnect_devices(load_saved_devices(), on_server_missing=start_adb_server)
     except Exception as e:
-        print(f"Error saving devices: {e}")
+        print(f"Error during autoconnect: {e}")
+
 
+def run_and_stream_command(command, prefix="", failure_pattern=None):
+    """
+    Executes a given command and streams its stdout and stderr to the console.
 
-def clear_all_saved_devices():
-    """Clear all saved devices immediately."""
+    Args:
+        command (str): The command string to execute.
+        prefix (str): Text printed in front of every output line.
+        failure_pattern (re.Pattern): Output that marks the command as failed
+            even if it exits with status 0. Optional.
+    """
     try:
-        if os.path.exists("config.dat"):
-            # Read existing non-device config entries
-            other_configs = []
-            with open("config.dat", "r", encoding="utf-8") as config_file:
-                for line in config_file:
-                    line = line.strip()
-                    if not line.startswith("saved_device="):
-                        other_configs.append(line)
-
-            # Write back only non-device config entries
-            with open("config.dat", "w", encoding="utf-8") as config_file:
-                for config_line in other_configs:
-                    if config_line:  # Skip empty lines
-                        config_file.write(f"{config_line}\n")
-        return True
+        return stream_process(command, prefix, failure_pattern)
     except Exception as e:
-        print(f"Error clearing saved devices: {e}")
+        print(f"An error occurred: {e}")
         return False
 
 
-def open_config_window():  # pylint: disable=too-many-statements
-    """Opens a configuration window to manage settings and saved devices."""
-    global do_cust_command
-    global rich_presence
-    global do_mods
+def run_adb_command(args):
+    """
+    Runs an adb command, using the in-process adb client where possible and
+    falling back to spawning the adb executable. If the command was given a
+    device selector it runs on every selected device in parallel.
 
-    def save_and_close():
-        global do_cust_command
-        global rich_presence
-        global do_mods
-        global adb_path
-        do_cust_command = cust_command_var.get()
-        rich_presence = rich_presence_var.get()
-        do_mods = do_mods_var.get()
-        adb_path = adb_path_var.get()
-        if not os.path.exists(adb_path):
-            messagebox.showerror("Error", "Selected ADB executable not "
-                                          "found. Resetting to default.")
-            adb_path_var.set(os.path.join("adb", "adb.exe"))
-        save_config()
-
-        # Save devices from the table
-        devices = []
-        for item in device_tree.get_children():
-            values = device_tree.item(item, 'values')
-            if len(values) >= 2 and values[0] and values[1]:
-                autoconnect = False
-                if len(values) >= 3:
-                    autoconnect = values[2].upper() == 'Y'
-                devices.append({
-                    "name": values[0],
-                    "ip_port": values[1],
-                    "autoconnect": autoconnect
-                })
-        save_saved_devices(devices)
-
-        config_win.destroy()
-
-    def clear_all_devices():
-        """Clear all saved devices immediately."""
-        result = messagebox.askyesno("Confirm Clear",
-                                     "Are you sure you want to clear all saved "
-                                     "devices? This action cannot be undone.")
-        if result:
-            if clear_all_saved_devices():
-                # Clear the tree view
-                for item in device_tree.get_children():
-                    device_tree.delete(item)
-                messagebox.showinfo("Success",
-                                    "All saved devices have been cleared.")
-            else:
-                messagebox.showerror("Error", "Failed to clear saved devices.")
-
-    def add_device():
-        """Add a new empty row to the device table."""
-        device_tree.insert('', 'end', values=('EXAMPLE_NAME', 'IP:PORT', 'N'))
-
-    def delete_selected_device():
-        """Delete the selected device from the table."""
-        selected_items = device_tree.selection()
-        for item in selected_items:
-            device_tree.delete(item)
-
-    config_win = tk.Tk()
-    config_win.title("OpenADB Config")
-    config_win.geometry("1000x500")
-    config_win.resizable(True, True)
-
-    # Custom commands section
-    cmd_frame = tk.Frame(config_win)
-    cmd_frame.pack(fill=tk.X, padx=10, pady=5)
-
-    cust_command_var = BooleanVar(value=do_cust_command)
-    chk = tk.Checkbutton(cmd_frame, text="Enable custom command set", variable=cust_command_var)
-    chk.pack(anchor=tk.W)
-
-    rich_presence_var = BooleanVar(value=rich_presence)
-    rich_presence_chk = tk.Checkbutton(cmd_frame, text="Enable Rich Presence",
-                                       variable=rich_presence_var)
-    rich_presence_chk.pack(anchor=tk.W)
-
-    do_mods_var = BooleanVar(value=do_mods)
-    do_mods_chk = tk.Checkbutton(cmd_frame, text="Enable mods (unsecure)",
-                                 variable=do_mods_var)
-    do_mods_chk.pack(anchor=tk.W)
-
-    # --- ADB Path Section ---
-    adb_frame = tk.LabelFrame(config_win, text="ADB Executable Path", padx=5, pady=5)
-    adb_frame.pack(fill=tk.X, padx=10, pady=5)
-
-    adb_path_var = tk.StringVar(value=adb_path)
-    adb_entry = tk.Entry(adb_frame, textvariable=adb_path_var, width=60)
-    adb_entry.pack(side=tk.LEFT, padx=5)
-
-    def browse_adb():
-        """Open a file dialog to select adb.exe."""
-        file_path = filedialog.askopenfilename(
-            title="Select adb.exe",
-            filetypes=[("ADB Executable", "adb.exe"), ("All Files", "*")]
-        )
-        if file_path:
-            adb_path_var.set(file_path)
-
-    def reset_adb():
-        """Reset the ADB path to the default relative path."""
-        adb_path_var.set(os.path.join("adb", "adb.exe"))
-
-    def set_to_path():
-        """Set the ADB path to just 'adb' to use the system PATH."""
-        adb_path_var.set("adb")
-
-    browse_btn = tk.Button(adb_frame, text="Browse", command=browse_adb)
-    browse_btn.pack(side=tk.LEFT, padx=5)
-    reset_btn = tk.Button(adb_frame, text="Reset to Default", command=reset_adb)
-    reset_btn.pack(side=tk.LEFT, padx=5)
-    path_btn = tk.Button(adb_frame, text="Call ADB from Path", command=set_to_path)
-    path_btn.pack(side=tk.LEFT, padx=5)
-
-    # Saved devices section
-    devices_frame = tk.LabelFrame(config_win, text="Saved Devices", padx=5, pady=5)
-    devices_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
-
-    # Device table
-    columns = ('Name', 'IP:Port', 'Autoconnect')
-    device_tree = ttk.Treeview(devices_frame, columns=columns, show='headings',
-                               height=10)
-
-    # Configure columns
-    device_tree.heading('Name', text='Device Name')
-    device_tree.heading('IP:Port', text='IP Address:Port')
-    device_tree.heading('Autoconnect', text='Autoconnect')
-    device_tree.column('Name', width=150)
-    device_tree.column('IP:Port', width=150)
-    device_tree.column('Autoconnect', width=100)
-
-    # Scrollbar for the tree
-    scrollbar = ttk.Scrollbar(devices_frame, orient=tk.VERTICAL,
-                              command=device_tree.yview)
-    device_tree.configure(yscrollcommand=scrollbar.set)
-
-    # Pack tree and scrollbar
-    device_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-
-    # Load existing saved devices
-    saved_devices = load_saved_devices()
-    for device in saved_devices:
-        autoconnect_display = "Y" if device.get('autoconnect', False) else "N"
-        device_tree.insert('', 'end', values=(device['name'],
-                                              device['ip_port'],
-                                              autoconnect_display))
-
-    # Device management buttons
-    device_btn_frame = tk.Frame(devices_frame)
-    device_btn_frame.pack(fill=tk.X, pady=5)
-
-    add_btn = tk.Button(device_btn_frame, text="Add Device", command=add_device)
-    add_btn.pack(side=tk.LEFT, padx=5)
-
-    delete_btn = tk.Button(device_btn_frame, text="Delete Selected",
-                           command=delete_selected_device)
-    delete_btn.pack(side=tk.LEFT, padx=5)
-
-    clear_btn = tk.Button(device_btn_frame, text="Clear All (Immediate)",
-                          command=clear_all_devices, bg='#ffcccc')
-    clear_btn.pack(side=tk.LEFT, padx=5)
-
-    # Make cells editable
-    def on_double_click(event):
-        """Handle double-click to edit cells."""
-        region = device_tree.identify_region(event.x, event.y)
-        if region == "cell":
-            column = device_tree.identify_column(event.x)
-            item = device_tree.identify('row', event.x, event.y)
-
-            if item:
-                col_index = int(column.replace('#', '')) - 1
-                if col_index in [0, 1, 2]:  # Allow editing Name, IP:Port, and Autoconnect
-                    edit_cell(item, col_index)
-
-    def edit_cell(item, col_index):
-        """Create an entry widget to edit the cell."""
-        bbox = device_tree.bbox(item, column=col_index)
-        if not bbox:
-            return
-        x, y, width, height = bbox
-
-        values = device_tree.item(item, 'values')
-        if col_index >= len(values):
-            return
-        current_value = values[col_index]
-
-        # Special handling for autoconnect column (toggle Y/N)
-        if col_index == 2:  # Autoconnect column
-            new_value = 'Y' if current_value.upper() != 'Y' else 'N'
-            values = list(device_tree.item(item, 'values'))
-            values[col_index] = new_value
-            device_tree.item(item, values=values)
-            return
-
-        # Regular text entry for other columns
-        entry = tk.Entry(device_tree)
-        entry.place(x=x, y=y, width=width, height=height)
-        entry.insert(0, current_value)
-        entry.focus()
-
-        def save_edit(event=None):  # pylint: disable=unused-argument
-            new_value = entry.get()
-            values = list(device_tree.item(item, 'values'))
-            values[col_index] = new_value
-            device_tree.item(item, values=values)
-            entry.destroy()
-
-        def cancel_edit(event=None):  # pylint: disable=unused-argument
-            entry.destroy()
-
-        entry.bind('<Return>', save_edit)
-        entry.bind('<Escape>', cancel_edit)
-        entry.bind('<FocusOut>', save_edit)
-
-    device_tree.bind('<Double-1>', on_double_click)
-
-    # Bottom buttons
-
-    def reset_all():
-        """Reset all settings to default."""
-        global do_cust_command, rich_presence, do_mods, adb_path
-        result = messagebox.askyesno("Confirm Reset",
-                                     "Are you sure you want to reset all settings? "
-                                     "This action cannot be undone.")
-        if result:
-            do_cust_command = True
-            rich_presence = True
-            do_mods = False
-            adb_path = os.path.join("adb", "adb.exe")
-            cust_command_var.set(do_cust_command)
-            rich_presence_var.set(rich_presence)
-            do_mods_var.set(do_mods)
-            adb_path_var.set(adb_path)
-            save_config()
-            # Clear the device table
-            for item in device_tree.get_children():
-                device_tree.delete(item)
-            if os.path.exists("config.dat"):
-                os.remove("config.dat")
-            with open("config.dat", "w", encoding="utf-8") as f:
-                f.write("do_cust_command=True\n")
-                f.write("rich_presence=True\n")
-                f.write("do_mods=False\n")
-                f.write(f"adb_path={adb_path}\n")
-                f.close()
-            messagebox.showinfo("Success", "All settings have "
-                                           "been reset to default. You may have to relaunch "
-                                           "this shell for some changes to take effect.")
-
-    btn_frame = tk.Frame(config_win)
-    btn_frame.pack(fill=tk.X, padx=10, pady=10)
-
-    save_btn = tk.Button(btn_frame, text="Save", command=save_and_close)
-    save_btn.pack(side=tk.LEFT, padx=5)
-
-    exit_btn = tk.Button(btn_frame, text="Cancel", command=config_win.destroy)
-    exit_btn.pack(side=tk.LEFT, padx=5)
-
-    reset_all_btn = tk.Button(
-        btn_frame,
-        text="Reset All",
-        command=reset_all,
-    )
-    reset_all_btn.pack(side=tk.LEFT, padx=5)
-
-    # Instructions
-    instructions = tk.Label(config_win,
-                            text="Double-click cells to edit. "
-                                 "Click Autoconnect column to toggle Y/N. "
-                                 "Use 'Save' to apply table changes, "
-                                 "'Clear All' takes "
-                                 "immediate effect.",
-                            font=('Arial', 8), fg='gray')
-    instructions.pack(side=tk.BOTTOM, pady=5)
-
-    config_win.mainloop()
+    Args:
+        args (str): The adb arguments, without the adb executable prefix.
+    """
+    if command_targets.get() is not None:
+        return run_on_devices(
+            selected_serials(command_targets.get()),
+            lambda serial, prefix: run_single_adb_command(f"-s {serial} {args}", prefix))
+    return run_single_adb_command(args)
 
 
-def autoconnect_on_startup():
-    """Connect to devices with autoconnect enabled on startup."""
-    global devices
-    try:
-        saved_devices = load_saved_devices()
-        for device in saved_devices:
-            if device.get('autoconnect', False):
-                print(f"Auto-connecting to {device['name']} ({device['ip_port']})...")
-                run_command = f"{adb_path} connect {device['ip_port']}"
-                if run_and_stream_command(run_command):
-                    print(f"Successfully auto-connected to {device['name']}")
-                else:
-                    print(f"Failed to auto-connect to {device['name']}")
-    except Exception as e:
-        print(f"Error during autoconnect: {e}")
+def selected_serials(selector):
+    """
+    Resolve a device selector against the attached devices.
+
+    Args:
+        selector: "all" or a list of serials.
+    """
+    states = device_tracker.states()
+    if not states:
+        try:
+            states = dict(adb_client.devices())
+        except AdbError:
+            states = {}
+    return resolve_targets(selector, states)
 
 
-def run_and_stream_command(command):
+def run_single_adb_command(args, prefix=""):
     """
-    Executes a given command and streams its stdout and stderr to the console.
+    Runs an adb command once, using the in-process adb client where possible.
 
     Args:
-        command (str): The command string to execute.
+        args (str): The adb arguments, without the adb executable prefix.
+        prefix (str): Text printed in front of every output line.
     """
     try:
-        success = True
-        process = subprocess.Popen(
-            command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1
-        )
-
-        for line in iter(process.stdout.readline, ''):
-            print(line, end='')
-            if "cannot" in line.lower():
-                success = False
-
-        for line in iter(process.stderr.readline, ''):
-            print(f"Error: {line}", end='')
-            if "cannot" in line.lower():
-                success = False
-
-        process.wait()
-        return success
-    except Exception as e:
-        print(f"An error occurred: {e}")
+        result = run_native_command(adb_client, args, prefix, shell_sessions)
+    except AdbConnectionError:
+        # Server not running yet, the adb executable will start it.
+        result = None
+    except AdbError as e:
+        print(f"{prefix}Error: {e}\n", end='')
         return False
+    if result is None:
+        result = run_and_stream_command(f"{adb_path} {args}", prefix, ADB_FAILURE_PATTERN)
+    package_index.note_command(args)
+    return result
 
 
 def update_rich_presence():
     """Update Discord Rich Presence with the enabled status."""
-    global rich_presence, rich_presence_exists
-    while True:
-        if rich_presence_exists:
-            with open("mods/rich_presence/enabled.dat", "w", encoding="utf-8") as f:
-                f.write("1" if rich_presence else "0")
-                f.close()
-        sleep(10)
+    if rich_presence_exists:
+        with open("mods/rich_presence/enabled.dat", "w", encoding="utf-8") as f:
+            f.write("1" if rich_presence else "0")
+            f.close()
+    mod_events.update_state(rich_presence=rich_presence)
 
 
 def mod_running_check():
-    """Allow mods to check if shell is still running."""
-    while True:
+    """Allow mods that read running.dat to check if shell is still running."""
+    if os.path.isdir("mods"):
         with open("mods/running.dat", "w", encoding="utf-8") as f:
             f.write(str(datetime.datetime.now()))
             f.close()
-        sleep(10)
 
 
-try:
-    if not os.path.exists("config.dat"):
-        with open("config.dat", "w", encoding="utf-8") as f:
-            f.write("do_cust_command=True\n")
-            f.write("rich_presence=True\n")
-            f.write("do_mods=False\n")
-            f.write(f"adb_path={adb_path}\n")
-            f.close()
-except Exception as e:
-    print(f"Error creating config file: {e}")
+def on_setting_changed(key, value):  # pylint: disable=unused-argument
+    """Push setting changes to mods as soon as they happen."""
+    if key == "rich_presence":
+        update_rich_presence()
+    elif key == "metrics_port":
+        set_metrics_port(value)
 
 
-def count_connected_devices():
-    """Count the number of connected devices using adb."""
-    while True:
-        global devices
-        try:
-            result = subprocess.run([adb_path, "devices"],
-                                    capture_output=True, text=True,
-                                    check=False)
-            lines = result.stdout.strip().split("\n")[1:]
-            devices = sum(1 for l in lines if l.strip() and
-                          not any(x in l for x in ["offline", "unauthorized"]))
-        except Exception as e:
-            print(f"Error counting devices: {e}")
-            devices = 0
+def set_metrics_port(port):
+    """Move the metrics endpoint to a new port, or turn it off with 0."""
+    try:
+        metrics_server.set_port(port)
+    except OSError as e:
+        print(f"Error serving metrics on port {port}: {e}")
+        return
+    if port:
+        print(f"Serving metrics at http://{metrics_server.host}:{port}/metrics")
+
+
+async def start_metrics_server():
+    """Serve metrics if the metrics_port setting asks for it."""
+    try:
+        await metrics_server.start(config_store.get("metrics_port"))
+    except OSError as e:
+        print(f"Error serving metrics on port {config_store.get('metrics_port')}: {e}")
+
+
+def publish_device_event(event, serial, state):
+    """Tell mods about a device being added, removed or changing state."""
+    mod_events.publish({"event": "device", "action": event, "serial": serial,
+                        "state": state})
+    plugin_manager.emit(f"device_{event}", serial, state)
+
+
+def close_device_session(event, serial, state):
+    """Close the persistent shell of a device that went away."""
+    if event == "removed" or state != "device":
+        shell_sessions.close(serial)
+
+
+def write_devices_file():
+    """Write the number of connected devices for mods to read."""
+    if not os.path.isdir("mods"):
+        return
+    try:
         with open("mods/devices.dat", "w", encoding="utf-8") as f:
             f.write(str(devices))
             f.close()
-        sleep(10)
+    except OSError as e:
+        print(f"Error writing device count: {e}")
+
+
+def count_connected_devices(event=None, serial=None, state=None):  # pylint: disable=unused-argument
+    """Update the connected device count when the device tracker reports a change."""
+    global devices
+    count = device_tracker.count()
+    if count != devices:
+        devices = count
+        write_devices_file()
+        mod_events.update_state(devices=devices)
+
+
+def start_adb_server():
+    """Start the adb server so the device tracker can connect to it."""
+    try:
+        subprocess.run([adb_path, "start-server"], capture_output=True, check=False)
+    except OSError as e:
+        print(f"Error starting adb server: {e}")
+
+
+WSA_PORT = "58526"
+# Setting -> (message when enabled, message when disabled)
+SETTING_TOGGLES = {
+    "rich_presence": ("Rich presence capability enabled.", "Rich presence disabled."),
+    "do_cust_command": ("Custom command capability enabled.",
+                        "Custom command functionality disabled. "
+                        "Shell now limited to config and adb functions."),
+    "do_mods": ("Mod functionality enabled.", "Mod functionality disabled."),
+    "background_autoconnect": ("Saved devices will be autoconnected in the background.",
+                               "Saved devices will be autoconnected before the prompt appears."),
+}
+
+
+def config_command(parsed):
+    """Open the config window or change a single setting."""
+    if not parsed.args:
+        # Imported on first use so that tkinter is only loaded for the window
+        from config_window import open_config_window  # pylint: disable=import-outside-toplevel
+        open_config_window(config_store, on_saved=load_config)
+        return True
+    setting = parsed.args[0].lower()
+    if setting == "metrics_port" and len(parsed.args) == 2:
+        port = parsed.args[1].lower()
+        port = "0" if port == "off" else port
+        if not port.isdigit() or int(port) > 65535:
+            print("Error: Usage: config metrics_port <port/off>")
+            return False
+        config_store.set("metrics_port", int(port))
+        if not int(port):
+            print("Metrics endpoint disabled.")
+        return True
+    if setting == "adb_path" and len(parsed.args) > 1:
+        new_path = parsed.raw.partition(" ")[2].strip()
+        if not os.path.exists(new_path):
+            print("The new path does not exist.")
+            return False
+        config_store.set("adb_path", new_path)
+        load_config()
+        print(f"ADB executable path changed to {new_path}.")
+        return True
+    action = parsed.args[1].lower() if len(parsed.args) == 2 else ""
+    if setting == "rich_presence" and action == "delete":
+        return delete_rich_presence()
+    if setting not in SETTING_TOGGLES or action not in ("enable", "disable"):
+        print("Error: Usage: config [<setting> <enable/disable>] or config adb_path <path>")
+        return False
+    config_store.set(setting, action == "enable")
+    load_config()
+    print(SETTING_TOGGLES[setting][0 if action == "enable" else 1])
+    return True
+
+
+def delete_rich_presence():
+    """Permanently delete the rich presence mod after confirmation."""
+    print("Deleting rich presence itself is highly discouraged. "
+          "You will not be able to re-enable. "
+          "Are you sure you want to permanently delete this functionality? (y/n)")
+    do_deletion = ask()
+    if do_deletion.lower() != "y":
+        print("Rich presence deletion cancelled.")
+        return False
+    if os.path.exists("mods/rich_presence"):
+        os.remove("mods/rich_presence/mod.exe")
+        os.remove("mods/rich_presence/presence.exe")
+    print("Rich presence deleted. You must re-install "
+          "openadbshell to regain this functionality. "
+          "Config menus may still behave like this function exists.")
+    return True
+
+
+def exit_command(parsed):  # pylint: disable=unused-argument
+    """Optionally disconnect every device, then exit the shell."""
+    disconnect = ask("Would you like to disconnect from all devices before "
+                     "exiting? (y/n): ")
+    if disconnect.lower().startswith('y'):
+        run_adb_command("disconnect")
+    shutdown()
+
+
+def shutdown():
+    """Stop everything the shell started and exit."""
+    print("Exiting adb shell.")
+    metrics.close_log()
+    job_manager.kill_all()
+    device_tracker.stop()
+    shell_sessions.close_all()
+    mod_events.stop()
+    sys.exit(0)
+
+
+def about_command(parsed):  # pylint: disable=unused-argument
+    """Show information about OpenADB Shell."""
+    print("OpenADB Shell is a simple command-line interface for interacting with ADB (Android "
+          "Debug Bridge) on Windows only.")
+    print("Version: 2.1.0")
+    print("Created by lukbrew25")
+    print("GitHub: https://github.com/lukbrew25/openadbshell")
+    print("This software is fully open source and available on GitHub.")
+    print("For more information, please refer to the README.md file.")
+    print("You can also contribute to the project by submitting issues or pull requests.")
+    print("Thank you for using OpenADB Shell!")
+    print("--------------------------------------------")
+    print("Credits: lukbrew25 for the project, all future contributors, "
+          "the Python developers and community, "
+          "pypresence for Rich Presence support, and pyinstaller for packaging.")
+    print("Disclaimer: This software is provided 'as is', without warranty of any "
+          "kind, express or implied.")
+    print("Use at your own risk. The developer is not responsible "
+          "for any damage or data loss.")
+    print("This project and lukbrew25 are not affiliated with or "
+          "sponsored by Google, Microsoft, "
+          "Discord, the Python foundation, "
+          "the pypresence and pyinstaller projects, "
+          "or any other third-party software, entity, "
+          "organization, or company and so such claims are made.")
+
+
+def help_command(parsed):  # pylint: disable=unused-argument
+    """Print the help generated from the command registry."""
+    print("Available commands:")
+    for line in command_registry.help_lines(do_cust_command):
+        print(line)
+    print("")
+    print("Note: Devices with autoconnect enabled will automatically connect on startup.")
+
+
+def local_port(port):
+    """Return the local port to use, accepting "wsa" for the default WSA port."""
+    if port.isdigit():
+        return port
+    if port.lower() == "wsa":
+        return WSA_PORT
+    print("Error: Please provide a valid port number.")
+    return None
+
+
+def localconnect_command(parsed):
+    """Connect to a local adb port."""
+    port = local_port(parsed.args[0])
+    return port is not None and run_adb_command(f"connect localhost:{port}")
+
+
+def localdisconnect_command(parsed):
+    """Disconnect from a local adb port."""
+    port = local_port(parsed.args[0])
+    return port is not None and run_adb_command(f"disconnect localhost:{port}")
+
+
+def save_command(parsed):
+    """Save a device connection under a name."""
+    parts = parsed.raw.split("--name")
+    if len(parts) != 2:
+        print("Error: Please provide an IP:port and a name for the saved device.")
+        return False
+    ip_port = parts[0].strip()
+    name = parts[1].strip()
+    if not ip_port or not name:
+        print("Error: Please provide both IP:port and a name.")
+        return False
+    config_store.add_device(name, ip_port)
+    return True
+
+
+def removesaved_command(parsed):
+    """Remove a saved device by name."""
+    if config_store.remove_device(parsed.raw):
+        print(f"Removed saved device '{parsed.raw}'.")
+        return True
+    print(f"Error: No saved device found with name '{parsed.raw}'.")
+    return False
+
+
+def saved_device_command(action):
+    """Return a handler that runs connect or disconnect on a saved device."""
+    def handler(parsed):
+        saved_device = config_store.find_device(parsed.raw)
+        if saved_device:
+            return run_adb_command(f"{action} {saved_device['ip_port']}")
+        print(f"Error: No saved device found with name '{parsed.raw}'.")
+        return False
+    return handler
+
+
+def default_serial():
+    """Return the device adb would pick without -s, printing an error if there is none."""
+    if os.environ.get("ANDROID_SERIAL"):
+        return os.environ["ANDROID_SERIAL"]
+    ready = [serial for serial, state in device_tracker.states().items() if state == "device"]
+    if len(ready) == 1:
+        return ready[0]
+    print("Error: more than one device/emulator" if ready else
+          "Error: no devices/emulators found")
+    return None
+
+
+def run_on_selected(run, max_workers=MAX_PARALLEL_DEVICES):
+    """Run run(serial, prefix) on the selected devices, or on the default device."""
+    if command_targets.get() is not None:
+        return run_on_devices(selected_serials(command_targets.get()), run, max_workers)
+    serial = default_serial()
+    if serial is None:
+        return False
+    started = perf_counter()
+    try:
+        return run(serial, "")
+    finally:
+        note_device(serial, perf_counter() - started)
+
 
+def installedapps_command(parsed):
+    """List installed packages from the package index, refreshing it when stale or asked to."""
+    enabled = False if "-d" in parsed.args else True if "-e" in parsed.args else None
+    text = " ".join(arg for arg in parsed.args if not arg.startswith("-"))
 
+    def list_packages(serial, prefix):
+        try:
+            if "--refresh" in parsed.args or not package_index.is_fresh(serial):
+                package_index.refresh(shell_sessions, serial)
+        except (AdbError, OSError) as e:
+            print(f"{prefix}Error: {e}\n", end='')
+            return False
+        names = package_index.names(serial, text, enabled)
+        print("".join(f"{prefix}package:{name}\n" for name in names), end='')
+        return bool(names)
+    return run_on_selected(list_packages)
+
+
+def apppath_command(parsed):
+    """Show the APK paths of a package, from the package index when it is fresh."""
+    def show_paths(serial, prefix):
+        try:
+            paths = package_index.paths(shell_sessions, serial, parsed.args[0])
+        except (AdbError, OSError) as e:
+            print(f"{prefix}Error: {e}\n", end='')
+            return False
+        print("".join(f"{prefix}package:{path}\n" for path in paths), end='')
+        return bool(paths)
+    return run_on_selected(show_paths)
+
+
+def installapp_command(parsed):
+    """Install the apks folder on the selected devices."""
+    install_options = parse_install_args(parsed.args)
+    apk_files = find_apks()
+    if install_options is None:
+        print("Error: Usage: installapp [--jobs <n>] [--retries <n>] [--force]")
+    elif apk_files is None:
+        print("Error: 'apks' directory not found. Please create an 'apks' directory "
+              "and place your APK files there.")
+    elif not apk_files:
+        print("No APK files found in the 'apks' directory.")
+    else:
+        serials = selected_serials(command_targets.get() or "all")
+        try:
+            return install_app(serials, apk_files, run_single_adb_command, adb_client,
+                               **install_options)
+        finally:
+            for serial in serials:
+                package_index.expire(serial)
+    return False
+
+
+def register_commands(registry):
+    """Register every built-in command, in the order they are listed in help."""
+    any_args = {"max_args": None}
+    registry.register("config", config_command, **any_args, custom=False,
+                      help_text="Open the configuration window to enable/disable "
+                                "custom commands and manage saved devices with autoconnect. "
+                                "This command will always be available")
+    registry.add_help("config rich_presence <enable/disable/delete>",
+                      "Config Rich Presence support")
+    registry.add_help("config do_cust_command <enable/disable>", "Enable/disable custom commands")
+    registry.add_help("config do_mods <enable/disable>", "Enable/disable mods")
+    registry.add_help("config adb_path <path>", "Set the path to the adb executable")
+    registry.add_help("config background_autoconnect <enable/disable>",
+                      "Autoconnect saved devices in the background on startup")
+    registry.add_help("config metrics_port <port/off>",
+                      "Serve Prometheus metrics at http://127.0.0.1:<port>/metrics")
+    registry.register("exit", exit_command, help_text="Exit the adb shell")
+    registry.register("clear", lambda parsed: os.system('cls'), help_text="Clear the console")
+    registry.register("cls", lambda parsed: os.system('cls'))
+    registry.register("help", help_command, help_text="Show this help message")
+    registry.register("save", save_command, "save ip:port --name <name>",
+                      "Save a device connection with a name", min_args=3, **any_args,
+                      error="Please provide an IP:port and a name for the saved device.")
+    name_required = {"min_args": 1, "max_args": None,
+                     "error": "Please provide a name for the saved device."}
+    registry.register("removesaved", removesaved_command, "removesaved <name>",
+                      "Remove a saved device by name", **name_required)
+    registry.register("connectsaved", saved_device_command("connect"), "connectsaved <name>",
+                      "Connect to a saved device by name", **name_required)
+    registry.register("disconnectsaved", saved_device_command("disconnect"),
+                      "disconnectsaved <name>", "Disconnect from a saved device by name",
+                      **name_required)
+    registry.register("installedapps", installedapps_command,
+                      "installedapps [-e|-d] [--refresh] [<filter>]",
+                      "List installed apps (only enabled/disabled with -e/-d) whose name "
+                      "contains the filter, from the package cache. --refresh reads the "
+                      "package list from the device first", **any_args)
+    registry.register("installapp", installapp_command,
+                      "installapp [--jobs <n>] [--retries <n>] [--force]",
+                      "Install all apks (must belong to same app) in the 'apks' folder to "
+                      "all connected devices at once, skipping devices that already have "
+                      "the same build", **any_args)
+    registry.register("apppath", apppath_command,
+                      "apppath <com.example.example>", "Show the path to the apk file",
+                      min_args=1, max_args=1, error="Please provide a package name.")
+    port_required = {"min_args": 1, "max_args": 1,
+                     "error": "Please provide a valid port number."}
+    registry.register("localconnect", localconnect_command, "localconnect <port>",
+                      "Connect to a local adb server by only port", **port_required)
+    registry.register("localdisconnect", localdisconnect_command, "localdisconnect <port>",
+                      "Disconnect from a local adb server by only port", **port_required)
+    registry.register("wsaconnect", lambda parsed: run_adb_command(f"connect localhost:{WSA_PORT}"),
+                      help_text=f"Connect to local default WSA adb port ({WSA_PORT}).")
+    registry.register("wsadisconnect",
+                      lambda parsed: run_adb_command(f"disconnect localhost:{WSA_PORT}"),
+                      help_text=f"Disconnect from local default WSA adb port ({WSA_PORT}).")
+    registry.alias("connect wsa", "wsaconnect")
+    registry.alias("disconnect wsa", "wsadisconnect")
+    register_logcat_command(registry, shell_services)
+    register_capture_commands(registry, shell_services)
+    register_transfer_commands(registry, shell_services)
+    register_timing_commands(registry, shell_services)
+    registry.register("shpm", lambda parsed: run_adb_command(f"shell pm {parsed.raw}"),
+                      "shpm <command>", "Execute a shell pm command on the device.",
+                      min_args=1, **any_args)
+    for prefix in ("adb", "adb.exe"):
+        registry.register(prefix, lambda parsed: run_adb_command(parsed.raw), custom=False,
+                          min_args=1, **any_args)
+    registry.add_help("<adb command>", "Execute an adb command", custom=False)
+    registry.add_help("@all <command>", "Run an adb command on all connected devices "
+                                        "at once (-all also works)", custom=False)
+    registry.add_help("@<serial1,serial2> <command>", "Run an adb command on the listed "
+                                                      "devices at once", custom=False)
+    for name in ("cmd", "cmd.exe"):
+        registry.register(name, lambda parsed: run_and_stream_command(f"cmd.exe /c {parsed.raw}"),
+                          f"{name} <command>", "Execute a command in command prompt",
+                          min_args=1, **any_args)
+    for name in ("powershell", "powershell.exe", "pwrsh"):
+        registry.register(name, lambda parsed: run_and_stream_command(
+            f"powershell.exe -Command {parsed.raw}"),
+            f"{name} <command>", "Execute a command in PowerShell", min_args=1, **any_args)
+    register_job_commands(registry, job_manager)
+    registry.add_help("<command> | <stage> [| <stage>...]",
+                      f"Filter a command's output here, with {', '.join(STAGES)}", custom=False)
+    registry.register("about", about_command,
+                      help_text="Show information about OpenADB Shell")
+
+
+def register_plugin_commands(registry):
+    """Register the commands declared by plugins, without replacing built-ins."""
+    plugin_manager.register_commands(registry)
+
+
+cli_options = parse_arguments(sys.argv[1:])
+startup_timer = StartupTimer(cli_options.timings)
+startup_timer.mark("imports")
 if (os.path.exists(os.path.join("mods", "rich_presence", "mod.exe")) and
         os.path.exists(os.path.join("mods", "rich_presence", "presence.exe"))):
     rich_presence_exists = True
 else:
     rich_presence_exists = False
-    print("Rich Presence mod not found, disabling all Rich Presence functionality.")
-
-print("---------------------------------------------")
+    if cli_options.script is None:
+        print("Rich Presence mod not found, disabling all Rich Presence functionality.")
+if cli_options.script is None:
+    print("---------------------------------------------")
 
 devices = 0  # Number of connected devices
-stop_device_counter = Event()
+# Device selector of the command being run, per worker thread and job
+command_targets = ContextVar("command_targets", default=None)
 
-# Start the device counter thread
-Thread(target=count_connected_devices, daemon=True).start()
 do_cust_command = True
 rich_presence = True
 do_mods = False
+background_autoconnect = False
+config_store = ConfigStore()
 load_config()
-if rich_presence_exists:
-    Thread(target=update_rich_presence, daemon=True).start()
-Thread(target=mod_running_check, daemon=True).start()
-print("Welcome to OpenADB Shell! (v2.1)")
-print("Type 'help' for a list of shell-specific commands or type standard adb commands directly "
-      "without the adb.exe prefix.")
-print("--------------------------------------------")
-print("Created by lukbrew25")
-print("Fully open source software, available on GitHub")
-print("https://github.com/lukbrew25/openadbshell")
-print("--------------------------------------------")
-if not os.path.exists(adb_path):
-    print("ADB executable not found in 'adb' directory. Please ensure you have the android "
-          "platform tools files in the adb folder. Once those files are in place, you can "
-          "optionally pick a custom adb executable and location. Exiting...")
-    sleep(10)
-    sys.exit(1)
-run_and_stream_command(adb_path + " version")
-print("--------------------------------------------")
-
-if os.path.exists("mods") and do_mods:
-    mods = []
-    for item in os.listdir("mods"):
-        if os.path.isdir(os.path.join("mods", item)) and item != "rich_presence":
-            files = os.listdir(os.path.join("mods", item))
-            for file in files:
-                if file == "mod.exe":
-                    mods.append(item)
-    if mods:
-        for mod in mods:
-            print(f"Mod {mod} found, running...")
-            run_and_stream_command(f"mods\\{mod}\\mod.exe")
+# Mods get state changes pushed over IPC, the .dat files are kept for older mods
+mod_events = ModEventServer(on_heartbeat=mod_running_check)
+mod_running_check()
+update_rich_presence()
+mod_events.update_state(devices=devices)
+config_store.add_listener(on_setting_changed)
+job_manager = JobManager()
+background_tasks = set()
+# What command modules outside this file get to use
+shell_services = {
+    "client": adb_client,
+    "sessions": shell_sessions,
+    "run_adb": run_adb_command,
+    "run_adb_on": run_single_adb_command,
+    "run_on_selected": run_on_selected,
+    "selected_serials": selected_serials,
+    "targets": command_targets.get,
+}
+command_registry = CommandRegistry()
+register_commands(command_registry)
+plugin_manager = PluginManager({
+    "run_adb": run_adb_command,
+    "devices": lambda: device_tracker.states(),
+    "setting": config_store.get,
+})
+write_devices_file()
+device_tracker = DeviceTracker(adb_client, on_server_missing=start_adb_server)
+device_tracker.add_listener(count_connected_devices)
+device_tracker.add_listener(publish_device_event)
+device_tracker.add_listener(close_device_session)
+device_tracker.add_listener(package_index.device_event)
+device_tracker.add_listener(metrics.device_event)
+metrics_server = MetricsServer(metrics, device_tracker.states)
+
+
+ADB_MISSING = ("ADB executable not found in 'adb' directory. Please ensure you have the android "
+               "platform tools files in the adb folder. Once those files are in place, you can "
+               "optionally pick a custom adb executable and location.")
+
+
+def startup():
+    """Print the banner and check that adb exists, returning False if it does not."""
+    print("Welcome to OpenADB Shell! (v2.1)")
+    print("Type 'help' for a list of shell-specific commands or type standard adb commands "
+          "directly without the adb.exe prefix.")
+    print("--------------------------------------------")
+    print("Created by lukbrew25")
+    print("Fully open source software, available on GitHub")
+    print("https://github.com/lukbrew25/openadbshell")
+    print("--------------------------------------------")
+    if not os.path.exists(adb_path):
+        print(f"{ADB_MISSING} Exiting...")
+        sleep(10)
+        return False
+    return True
+
+
+def print_adb_version():
+    """Print the adb version, running adb and refreshing the cache."""
+    try:
+        print(adb_version(adb_path), end='')
+    except OSError as e:
+        print(f"Error running adb version: {e}")
+
+
+def run_in_background(name, func, *args):
+    """Run a startup step in a worker thread without waiting for it, timing it."""
+    def timed():
+        with startup_timer.background(name):
+            func(*args)
+    task = asyncio.get_running_loop().create_task(asyncio.to_thread(timed))
+    background_tasks.add(task)  # Tasks are only weakly referenced by the loop
+    task.add_done_callback(background_tasks.discard)
+
+
+def run_mods(commands):
+    """Run the executable mods one after another."""
+    for command in commands:
+        run_and_stream_command(command)
+
+
+def start_mods():
+    """
+    Find the Python plugins and the executable mods.
+
+    Returns:
+        The commands that run the executable mods, left to the caller so
+        they can run in the background.
+    """
+    commands = []
+    if os.path.exists("mods") and do_mods:
+        for plugin in plugin_manager.discover():
+            print(f"Mod {plugin.name} found, it will load when first used.")
+        register_plugin_commands(command_registry)
+        mods = []
+        for item in os.listdir("mods"):
+            if os.path.isdir(os.path.join("mods", item)) and item != "rich_presence":
+                files = os.listdir(os.path.join("mods", item))
+                for file in files:
+                    if file == "mod.exe":
+                        mods.append(item)
+        if mods:
+            for mod in mods:
+                print(f"Mod {mod} found, running...")
+                commands.append(f"mods\\{mod}\\mod.exe")
+        elif not plugin_manager.plugins:
+            print("No mods found in the 'mods' directory.")
+    elif do_mods:
+        print("No mods directory found")
     else:
-        print("No mods found in the 'mods' directory.")
-elif do_mods:
-    print("No mods directory found")
-else:
-    print("Mods are disabled in the configuration.")
-
-if rich_presence_exists:
-    run_and_stream_command("mods\\rich_presence\\mod.exe")
-
-print("--------------------------------------------")
-print("Loading saved devices...")
-autoconnect_on_startup()
-run_and_stream_command(adb_path + " devices")
-print("--------------------------------------------")
-
-while True:
-    user_command = str(input("openadbshell:"))
-    if user_command.lower() == "config":
-        open_config_window()
-    elif user_command.lower() == "config rich_presence enable":
-        with open("config.dat", "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            f.close()
-        with open("config.dat", "w", encoding="utf-8") as f:
-            for line in lines:
-                if line.startswith("rich_presence"):
-                    f.write("rich_presence=True\n")
-                else:
-                    f.write(line)
-        rich_presence = True
-        print("Rich presence capability enabled.")
-    elif user_command.lower() == "config rich_presence disable":
-        with open("config.dat", "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            f.close()
-        with open("config.dat", "w", encoding="utf-8") as f:
-            for line in lines:
-                if line.startswith("rich_presence"):
-                    f.write("rich_presence=False\n")
-                else:
-                    f.write(line)
-        rich_presence = False
-        print("Rich presence disabled.")
-    elif user_command.lower() == "config rich_presence delete":
-        print("Deleting rich presence itself is highly discouraged. "
-              "You will not be able to re-enable. "
-              "Are you sure you want to permanently delete this functionality? (y/n)")
-        do_deletion = input()
-        if do_deletion.lower() == "y":
-            if os.path.exists("mods/rich_presence"):
-                os.remove("mods/rich_presence/mod.exe")
-                os.remove("mods/rich_presence/presence.exe")
-            print("Rich presence deleted. You must re-install "
-                  "openadbshell to regain this functionality. "
-                  "Config menus may still behave like this function exists.")
-        else:
-            print("Rich presence deletion cancelled.")
-    elif user_command.lower() == "config do_cust_command enable":
-        do_cust_command = True
-        with open("config.dat", "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            f.close()
-        with open("config.dat", "w", encoding="utf-8") as f:
-            for line in lines:
-                if line.startswith("do_cust_command"):
-                    f.write("do_cust_command=True\n")
-        print("Custom command capability enabled.")
-    elif user_command.lower() == "config do_cust_command disable":
-        do_cust_command = False
-        with open("config.dat", "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            f.close()
-        with open("config.dat", "w", encoding="utf-8") as f:
-            for line in lines:
-                if line.startswith("do_cust_command"):
-                    f.write("do_cust_command=False\n")
-                else:
-                    f.write(line)
-        print("Custom command functionality disabled. "
-              "Shell now limited to config and adb functions.")
-    elif user_command.lower() == "config do_mods enable":
-        do_mods = True
-        with open("config.dat", "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            f.close()
-        with open("config.dat", "w", encoding="utf-8") as f:
-            for line in lines:
-                if line.startswith("do_mods"):
-                    f.write("do_mods=True\n")
-                else:
-                    f.write(line)
-        print("Mod functionality enabled.")
-    elif user_command.lower() == "config do_mods disable":
-        do_mods = False
-        with open("config.dat", "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            f.close()
-        with open("config.dat", "w", encoding="utf-8") as f:
-            for line in lines:
-                if line.startswith("do_mods"):
-                    f.write("do_mods=False\n")
-        print("Mod functionality disabled.")
-    elif user_command.lower().startswith("config adb_path "):
-        new_path = user_command.lower()[16:].strip()
-        if os.path.exists(new_path):
-            with open("config.dat", "r", encoding="utf-8") as f:
-                lines = f.readlines()
-                f.close()
-            with open("config.dat", "w", encoding="utf-8") as f:
-                for line in lines:
-                    if line.startswith("adb_path"):
-                        f.write(f"adb_path={new_path}\n")
-                    else:
-                        f.write(line)
-            adb_path = new_path
-            print(f"ADB executable path changed to {new_path}.")
-        else:
-            print("The new path does not exist.")
-    elif do_cust_command and user_command.lower() == "exit":
-        disconnect = input("Would you like to disconnect from all devices before "
-                           "exiting? (y/n): ")
-        if disconnect.lower().startswith('y'):
-            run_and_stream_command(adb_path + " disconnect")
-            devices = 0
-        print("Exiting adb shell.")
-        sys.exit(0)
-    elif do_cust_command and user_command.lower() == "clear":
-        os.system('cls')
-    elif do_cust_command and user_command.lower() == "cls":
-        os.system('cls')
-    elif do_cust_command and user_command.lower() == "about":
-        print("OpenADB Shell is a simple command-line interface for interacting with ADB (Android "
-              "Debug Bridge) on Windows only.")
-        print("Version: 2.1.0")
-        print("Created by lukbrew25")
-        print("GitHub: https://github.com/lukbrew25/openadbshell")
-        print("This software is fully open source and available on GitHub.")
-        print("For more information, please refer to the README.md file.")
-        print("You can also contribute to the project by submitting issues or pull requests.")
-        print("Thank you for using OpenADB Shell!")
-        print("--------------------------------------------")
-        print("Credits: lukbrew25 for the project, all future contributors, "
-              "the Python developers and community, "
-              "pypresence for Rich Presence support, and pyinstaller for packaging.")
-        print("Disclaimer: This software is provided 'as is', without warranty of any "
-              "kind, express or implied.")
-        print("Use at your own risk. The developer is not responsible "
-              "for any damage or data loss.")
-        print("This project and lukbrew25 are not affiliated with or "
-              "sponsored by Google, Microsoft, "
-              "Discord, the Python foundation, "
-              "the pypresence and pyinstaller projects, "
-              "or any other third-party software, entity, "
-              "organization, or company and so such claims are made.")
-    elif do_cust_command and user_command.lower() == "help":
-        print("Available commands:")
-        print("  config - Open the configuration window to enable/disable "
-              "custom commands and manage saved devices with autoconnect. "
-              "This command will always be available")
-        print("  config rich_presence <enable/disable/delete> - Config Rich Presence support")
-        print("  config do_cust_command <enable/disable> - Enable/disable custom commands")
-        print("  config do_mods <enable/disable> - Enable/disable mods")
-        print("  config adb_path <path> - Set the path to the adb executable")
-        print("  exit - Exit the adb shell")
-        print("  clear - Clear the console")
-        print("  help - Show this help message")
-        print("  save ip:port --name <name> - Save a device connection with a name")
-        print("  removesaved <name> - Remove a saved device by name")
-        print("  connectsaved <name> - Connect to a saved device by name")
-        print("  disconnectsaved <name> - Disconnect from a saved device by name")
-        print("  installedapps - List installed apps on connected devices")
-        print("  installapp - Install all apks (must belong to same app) "
-              "in the 'apks' folder to all connected devices")
-        print("  apppath <com.example.example> - Show the path to the apk file")
-        print("  localconnect <port> - Connect to a local adb server by only port")
-        print("  localdisconnect <port> - Disconnect from "
-              "a local adb server by only port")
-        print("  wsaconnect - Connect to local default WSA adb port (58526).")
-        print("  wsadisconnect - Disconnect from local default WSA adb port (58526).")
-        print("  shpm <command> - Execute a shell pm command on the device.")
-        print("  <adb command> - Execute an adb command")
-        print("  cmd <command> - Execute a command in command prompt")
-        print("  cmd.exe <command> - Execute a command in command prompt")
-        print("  powershell <command> - Execute a command in PowerShell")
-        print("  powershell.exe <command> - Execute a command in PowerShell")
-        print("  pwrsh <command> - Execute a command in PowerShell")
-        print("  about - Show information about OpenADB Shell")
-        print("")
-        print("Note: Devices with autoconnect enabled will automatically connect on startup.")
-    elif do_cust_command and user_command.lower() == "installedapps":
-        run_command = adb_path + " shell pm list packages"
-        run_and_stream_command(run_command)
-    elif do_cust_command and user_command.startswith("apppath "):
-        package_name = user_command[8:].strip()
-        if not package_name:
-            print("Error: Please provide a package name.")
-            continue
-        run_command = adb_path + " shell pm path " + str(package_name)
-        run_and_stream_command(run_command)
-    elif do_cust_command and user_command.lower().startswith("localconnect "):
-        port = user_command[13:].strip()
-        if not port.isdigit():
-            if port.lower() == "wsa":
-                port = "58526"
-            else:
-                print("Error: Please provide a valid port number.")
-                continue
-        run_command = adb_path + " connect localhost:" + str(port)
-        if run_and_stream_command(run_command):
-            devices += 1
-    elif do_cust_command and user_command.lower().startswith("localdisconnect "):
-        port = user_command[16:].strip()
-        if not port.isdigit():
-            if port.lower() == "wsa":
-                port = "58526"
-            else:
-                print("Error: Please provide a valid port number.")
-                continue
-        run_command = adb_path + " disconnect localhost:" + str(port)
-        if run_and_stream_command(run_command):
-            devices -= 1
-            devices = max(devices, 0)
-    elif do_cust_command and user_command.lower() == "wsaconnect":
-        run_command = adb_path + " connect localhost:58526"
-        if run_and_stream_command(run_command):
-            devices += 1
-    elif do_cust_command and user_command.lower() == "wsadisconnect":
-        run_command = adb_path + " disconnect localhost:58526"
-        if run_and_stream_command(run_command):
-            devices -= 1
-            devices = max(devices, 0)
-    elif do_cust_command and user_command.lower() == "connect wsa":
-        run_command = adb_path + " connect localhost:58526"
-        if run_and_stream_command(run_command):
-            devices += 1
-    elif do_cust_command and user_command.lower() == "disconnect wsa":
-        run_command = adb_path + " disconnect localhost:58526"
-        if run_and_stream_command(run_command):
-            devices -= 1
-            devices = max(devices, 0)
-    elif do_cust_command and user_command.lower().startswith("save "):
-        parts = user_command[5:].strip().split("--name")
-        if len(parts) != 2:
-            print("Error: Please provide an IP:port and a name for the saved device.")
-            continue
-        ip_port = parts[0].strip()
-        name = parts[1].strip()
-        if not ip_port or not name:
-            print("Error: Please provide both IP:port and a name.")
+        print("Mods are disabled in the configuration.")
+    if rich_presence_exists:
+        commands.append("mods\\rich_presence\\mod.exe")
+    return commands
+
+
+def run_command(line):
+    """Run a shell command, or an adb command if no shell command matches."""
+    handled, result = command_registry.dispatch(line, do_cust_command)
+    if not handled:
+        result = run_adb_command(line)
+    return result
+
+
+def run_line(line):
+    """Run one command line, with its device selector and pipeline, without timing it."""
+    line, targets = split_device_selector(line)
+    command_targets.set(targets)
+    command, stages = split_pipeline(line)
+    if stages:
+        return run_pipeline(partial(run_command, command), stages)
+    return run_command(line)
+
+
+def execute(line):
+    """Run and time one command line. Called in a worker thread, or as a background job."""
+    timing = metrics.start(line)
+    result = None
+    try:
+        result = run_line(line)
+        return result
+    finally:
+        metrics.finish(timing, result)
+        plugin_manager.emit("command_executed", split_device_selector(line)[0])
+
+
+shell_services["run_line"] = run_line
+
+
+def repl(loop, history=None):
+    """
+    Read commands on the main thread, running them in worker threads.
+
+    Ctrl+C drops the line being typed, or stops the command running in
+    the foreground; either way the prompt comes back. End of input exits.
+    """
+    while True:
+        try:
+            user_command = input("openadbshell:")
+        except KeyboardInterrupt:
+            print()
             continue
-        with open("config.dat", "a", encoding="utf-8") as f:
-            f.write(f"saved_device={name}/!/{ip_port}/!/False\n")
-            f.close()
-    elif do_cust_command and user_command.lower().startswith("removesaved "):
-        name = user_command[10:].strip()
-        if not name:
-            print("Error: Please provide a name for the saved device.")
+        except EOFError:
+            print()
+            shutdown()
+        if history is not None:
+            history.add(user_command)
+        user_command, background = split_background(user_command)
+        if background:
+            job = job_manager.start(user_command, partial(execute, user_command), loop)
+            print(f"[{job.id}] {user_command}")
             continue
         try:
-            with open("config.dat", "r", encoding="utf-8") as f:
-                lines = f.readlines()
-                f.close()
-            with open("config.dat", "w", encoding="utf-8") as f:
-                for line in lines:
-                    if not line.startswith(f"saved_device={name}/!/"):
-                        f.write(line)
-            print(f"Removed saved device '{name}'.")
-        except Exception as e:
-            print(f"Error removing saved device: {e}")
-    elif do_cust_command and user_command.lower().startswith("connectsaved "):
-        name = user_command[13:].strip()
-        if not name:
-            print("Error: Please provide a name for the saved device.")
-            continue
+            run_foreground(user_command, partial(execute, user_command))
+        except KeyboardInterrupt:
+            pass
+
+
+def wait_for(loop, coroutine):
+    """Run a coroutine on the event loop, waiting for it in a way Ctrl+C can interrupt."""
+    future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+    while True:
         try:
-            with open("config.dat", "r", encoding="utf-8") as f:
-                for line in f:
-                    if line.startswith(f"saved_device={name}/!/"):
-                        parts = line.strip().split("/!/")
-                        if len(parts) >= 2:
-                            ip_port = parts[1]
-                            run_command = f"{adb_path} connect {ip_port}"
-                            run_and_stream_command(run_command)
-                            break
-                else:
-                    print(f"Error: No saved device found with name '{name}'.")
-                f.close()
-        except Exception as e:
-            print(f"Error reading config.dat: {e}")
-    elif do_cust_command and user_command.lower().startswith("disconnectsaved "):
-        name = user_command[16:].strip()
-        if not name:
-            print("Error: Please provide a name for the saved device.")
+            return future.result(POLL_INTERVAL)
+        except FutureTimeoutError:
             continue
-        try:
-            with open("config.dat", "r", encoding="utf-8") as f:
-                for line in f:
-                    if line.startswith(f"saved_device={name}/!/"):
-                        parts = line.strip().split("/!/")
-                        if len(parts) >= 2:
-                            ip_port = parts[1]
-                            run_command = f"{adb_path} disconnect {ip_port}"
-                            run_and_stream_command(run_command)
-                            break
-                else:
-                    print(f"Error: No saved device found with name '{name}'.")
-                f.close()
-        except Exception as e:
-            print(f"Error reading config.dat: {e}")
-    elif do_cust_command and user_command.lower().startswith("shpm "):
-        run_command = adb_path + " shell pm " + user_command[5:]
-        run_and_stream_command(run_command)
-    elif user_command.startswith("adb "):
-        run_command = adb_path + " " + user_command[4:]
-        run_and_stream_command(run_command)
-    elif user_command.startswith("adb.exe "):
-        run_command = adb_path + " " + user_command[8:]
-        run_and_stream_command(run_command)
-    elif user_command.startswith("cmd ") and do_cust_command:
-        run_command = "cmd.exe /c " + user_command[4:]
-        run_and_stream_command(run_command)
-    elif user_command.startswith("cmd.exe ") and do_cust_command:
-        run_command = "cmd.exe /c " + user_command[8:]
-        run_and_stream_command(run_command)
-    elif user_command.startswith("powershell ") and do_cust_command:
-        run_command = "powershell.exe -Command " + user_command[11:]
-        run_and_stream_command(run_command)
-    elif user_command.startswith("powershell.exe ") and do_cust_command:
-        run_command = "powershell.exe -Command " + user_command[15:]
-        run_and_stream_command(run_command)
-    elif user_command.startswith("pwrsh ") and do_cust_command:
-        run_command = "powershell.exe -Command " + user_command[5:]
-        run_and_stream_command(run_command)
-    elif do_cust_command and user_command.lower() == "installapp":
-        if not os.path.exists("apks"):
-            print("Error: 'apks' directory not found. Please create an 'apks' directory "
-                  "and place your APK files there.")
-        else:
-            apk_files = [f for f in os.listdir("apks") if f.endswith('.apk')]
-            if not apk_files:
-                print("No APK files found in the 'apks' directory.")
-            else:
-                run_command = adb_path + " install-multiple -r " + " ".join(
-                    [os.path.join("apks", apk) for apk in apk_files])
-                run_and_stream_command(run_command)
+
+
+async def start_batch():
+    """
+    Start what a script needs: device tracking, metrics and plugins, but no banner or mods.
+
+    Returns:
+        False if adb is missing, in which case nothing was started.
+    """
+    if not os.path.exists(adb_path):
+        print(f"Error: {ADB_MISSING}", file=sys.stderr)
+        return False
+    device_tracker.start()
+    await start_metrics_server()
+    # Commands without a device selector need to know which devices are attached
+    await asyncio.to_thread(device_tracker.synced.wait, 5.0)
+    startup_timer.mark("device listing")
+    if do_mods:
+        plugin_manager.discover()
+        register_plugin_commands(command_registry)
+        startup_timer.mark("plugins")
+    startup_timer.report(sys.stderr)
+    return True
+
+
+def run_batch(loop, options):
+    """Run a script, returning the exit status."""
+    if not wait_for(loop, start_batch()):
+        return 1
+    failed = run_foreground("script", partial(run_script, read_script(options.script), execute,
+                                              options.fail_fast))
+    job_manager.kill_all()
+    device_tracker.stop()
+    shell_sessions.close_all()
+    metrics.close_log()
+    return 1 if failed else 0
+
+
+async def start_shell():
+    """
+    Start the background tasks and run the startup sequence.
+
+    Returns:
+        (started, history): started is False if adb is missing; history is
+        the prompt's History, None without readline.
+    """
+    # Nothing is started before the check that adb exists
+    if not await asyncio.to_thread(startup):
+        return False, None
+    startup_timer.mark("banner")
+    await mod_events.start(port_file=PORT_FILE if os.path.isdir("mods") else None)
+    # Track devices through the adb server instead of polling adb devices
+    device_tracker.start()
+    await start_metrics_server()
+    startup_timer.mark("event loop")
+    # Only a new or changed adb binary is run; that happens in the background
+    version = await asyncio.to_thread(cached_adb_version, adb_path)
+    if version is None:
+        run_in_background("adb version", print_adb_version)
     else:
-        run_command = adb_path + " " + user_command
-        run_and_stream_command(run_command)
+        print(version, end='')
+    print("--------------------------------------------")
+    startup_timer.mark("adb version check")
+    mod_commands = await asyncio.to_thread(start_mods)
+    if mod_commands:
+        run_in_background("mods", run_mods, mod_commands)
+    startup_timer.mark("plugins")
+    print("--------------------------------------------")
+    print("Loading saved devices...")
+    if background_autoconnect:
+        run_in_background("autoconnect", autoconnect_on_startup)
+    else:
+        await asyncio.to_thread(autoconnect_on_startup)
+        startup_timer.mark("autoconnect")
+    await asyncio.to_thread(run_adb_command, "devices")
+    print("--------------------------------------------")
+    startup_timer.mark("devices")
+    history = setup_readline(Completer(command_registry, config_store.device_names,
+                                       config_store.devices, device_tracker.states,
+                                       package_index.search))
+    startup_timer.report()
+    return True, history
+
+
+def main():
+    """
+    Run the event loop in a background thread and the prompt, or a script,
+    on the main thread, where Ctrl+C arrives.
+    """
+    startup_timer.mark("setup")
+    loop = asyncio.new_event_loop()
+    Thread(target=loop.run_forever, name="event loop", daemon=True).start()
+    if cli_options.script is not None:
+        sys.exit(run_batch(loop, cli_options))
+    started, history = wait_for(loop, start_shell())
+    if not started:
+        sys.exit(1)
+    repl(loop, history)
+
+
+try:
+    main()
+except KeyboardInterrupt:
+    # Ctrl+C during startup or a script; commands at the prompt are stopped instead
+    job_manager.kill_all()
+    sys.exit(130)
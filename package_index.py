@@ -0,0 +1,259 @@
+"""
+Cached per-device index of installed packages.
+
+One bulk `pm list packages` query fills in every package's name, base APK
+path, versionCode, uid and enabled state. The index is kept in memory and
+in package_cache.json, and each refresh only rebuilds the entries of
+packages that were added, removed or updated, so the full APK path lists
+fetched for individual packages survive refreshes. Lookups, filtering and
+prefix search run against the in-memory index without touching the device.
+
+A device's index is trusted until it is CACHE_MAX_AGE old or a package
+change makes it stale: an install, uninstall or pm command run through
+the shell, or the device (re)appearing, since anything may have changed
+while it was away.
+"""
+import bisect
+import json
+import os
+import tempfile
+from threading import Lock
+from time import time
+
+
+PACKAGE_CACHE_FILE = "package_cache.json"
+CACHE_MAX_AGE = 300.0  # Seconds a device's index is trusted without a package change
+SEPARATOR = "__OAS_DISABLED__"
+BULK_QUERY = (f"pm list packages -f -U --show-versioncode; echo {SEPARATOR}; "
+              f"pm list packages -d")
+# Android 8 and older do not know --show-versioncode
+LEGACY_BULK_QUERY = f"pm list packages -f -U; echo {SEPARATOR}; pm list packages -d"
+# adb commands, and pm/cmd package subcommands, that change a device's packages
+ADB_PACKAGE_COMMANDS = {"install", "install-multiple", "install-multi-package", "uninstall"}
+PM_PACKAGE_COMMANDS = {"install", "install-existing", "uninstall", "enable", "disable",
+                       "disable-user", "disable-until-used", "default-state", "hide", "unhide",
+                       "suspend", "unsuspend"}
+
+
+def parse_package_listing(text):
+    """
+    Parse the output of BULK_QUERY.
+
+    Returns:
+        A dict of package name -> entry dict, or {} if the listing is empty.
+    """
+    listing, _, disabled_listing = text.partition(SEPARATOR)
+    disabled = {line[8:].strip() for line in disabled_listing.splitlines()
+                if line.startswith("package:")}
+    packages = {}
+    for line in listing.splitlines():
+        if not line.startswith("package:"):
+            continue
+        fields = line[8:].split()
+        if not fields:
+            continue
+        # The path can contain '=' itself, the name never does
+        path, _, name = fields[0].rpartition("=")
+        entry = {"paths": [path] if path else [], "all_paths": False,
+                 "version_code": None, "uid": None, "enabled": name not in disabled}
+        for field in fields[1:]:
+            key, _, value = field.partition(":")
+            if key == "versionCode" and value.isdigit():
+                entry["version_code"] = int(value)
+            elif key == "uid" and value.isdigit():
+                entry["uid"] = int(value)
+        packages[name] = entry
+    return packages
+
+
+def changes_packages(args):
+    """
+    Check whether an adb command installs, removes or toggles packages.
+
+    Args:
+        args (str): The adb arguments, e.g. "-s emulator-5554 shell pm uninstall x".
+
+    Returns:
+        (changes, serial) where serial is the device given with -s, or None.
+    """
+    words = args.lower().split()
+    serial = None
+    if len(words) >= 2 and words[0] == "-s":
+        serial = args.split()[1]
+        words = words[2:]
+    if words[:1] == ["shell"]:
+        words = words[1:]
+        if words[:2] == ["cmd", "package"]:
+            return len(words) > 2 and words[2] in PM_PACKAGE_COMMANDS, serial
+        return words[:1] == ["pm"] and len(words) > 1 and words[1] in PM_PACKAGE_COMMANDS, serial
+    return bool(words) and words[0] in ADB_PACKAGE_COMMANDS, serial
+
+
+class PackageIndex:
+    """Per-device package index kept in memory and on disk."""
+
+    def __init__(self, path=PACKAGE_CACHE_FILE):
+        self.path = path
+        self._devices = {}
+        self._names = {}  # serial -> sorted package names, for prefix search
+        self._all_names = None  # Sorted names of every device, built on first search
+        self._dirty = False
+        self._lock = Lock()
+        self.load()
+
+    def load(self):
+        """Load the cache file, starting empty if it is missing or broken."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                devices = json.load(f).get("devices", {})
+        except (OSError, ValueError):
+            devices = {}
+        with self._lock:
+            self._devices = devices
+            self._names = {serial: sorted(device["packages"])
+                           for serial, device in devices.items()}
+            self._all_names = None
+            self._dirty = False
+
+    def save(self):
+        """Write the cache atomically if anything changed since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return False
+            directory = os.path.dirname(os.path.abspath(self.path))
+            try:
+                with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory,
+                                                 suffix=".tmp", delete=False) as f:
+                    json.dump({"devices": self._devices}, f)
+                os.replace(f.name, self.path)
+            except OSError as e:
+                print(f"Error saving package cache: {e}")
+                return False
+            self._dirty = False
+            return True
+
+    def refresh(self, sessions, serial):
+        """
+        Refresh a device's index with one bulk query.
+
+        Args:
+            sessions (ShellSessions): Used to query the device.
+            serial (str): The device to refresh.
+
+        Returns:
+            (added, removed, changed) lists of package names.
+        """
+        _, text = sessions.output(BULK_QUERY, serial)
+        packages = parse_package_listing(text)
+        if not packages:
+            _, text = sessions.output(LEGACY_BULK_QUERY, serial)
+            packages = parse_package_listing(text)
+        if not packages:
+            return [], [], []  # Query failed, keep what is cached
+        with self._lock:
+            old = self._devices.get(serial, {}).get("packages", {})
+            added = sorted(set(packages) - set(old))
+            removed = sorted(set(old) - set(packages))
+            changed = []
+            for name, entry in packages.items():
+                previous = old.get(name)
+                if previous is None:
+                    continue
+                if (previous["version_code"], previous["uid"], previous["paths"][:1]) == (
+                        entry["version_code"], entry["uid"], entry["paths"][:1]):
+                    # Same build, keep the full path list fetched earlier
+                    entry["paths"] = previous["paths"]
+                    entry["all_paths"] = previous["all_paths"]
+                if previous != entry:
+                    changed.append(name)
+            self._devices[serial] = {"updated": time(), "packages": packages}
+            self._names[serial] = sorted(packages)
+            self._all_names = None
+            self._dirty = True
+        self.save()
+        return added, removed, sorted(changed)
+
+    def is_fresh(self, serial, max_age=CACHE_MAX_AGE):
+        """Check whether a device's index was refreshed recently."""
+        device = self._devices.get(serial)
+        return device is not None and time() - device["updated"] < max_age
+
+    def get(self, serial, package):
+        """Return the cached entry of a package, or None."""
+        return self._devices.get(serial, {}).get("packages", {}).get(package)
+
+    def names(self, serial, text="", enabled=None):
+        """
+        Return sorted package names of a device containing text.
+
+        Args:
+            enabled (bool): Only enabled (True) or disabled (False) packages,
+                None for both.
+        """
+        packages = self._devices.get(serial, {}).get("packages", {})
+        return [name for name in self._names.get(serial, [])
+                if text in name and (enabled is None or packages[name]["enabled"] == enabled)]
+
+    def search(self, serial, prefix):
+        """Return the sorted package names starting with prefix, on every device if None."""
+        if serial is None:
+            names = self._all_names
+            if names is None:
+                with self._lock:
+                    names = self._all_names = sorted(set().union(*self._names.values()))
+        else:
+            names = self._names.get(serial, [])
+        start = bisect.bisect_left(names, prefix)
+        end = bisect.bisect_left(names, prefix + "\uffff")
+        return names[start:end]
+
+    def paths(self, sessions, serial, package):
+        """
+        Return every APK path of a package, split APKs included.
+
+        Served from the cache if the device's index is fresh, otherwise one
+        `pm path` query whose result is cached.
+        """
+        entry = self.get(serial, package)
+        if entry is not None and entry["all_paths"] and self.is_fresh(serial):
+            return entry["paths"]
+        _, text = sessions.output(f"pm path {package}", serial)
+        paths = [line[8:].strip() for line in text.splitlines() if line.startswith("package:")]
+        if entry is not None and paths:
+            with self._lock:
+                entry["paths"] = paths
+                entry["all_paths"] = True
+                self._dirty = True
+            self.save()
+        return paths
+
+    def expire(self, serial, save=True):
+        """Mark a device's index stale, e.g. after installing on it."""
+        with self._lock:
+            if serial in self._devices:
+                self._devices[serial]["updated"] = 0
+                self._dirty = True
+        if save:
+            self.save()
+
+    def note_command(self, args):
+        """
+        Mark indexes stale after an adb command that changes packages.
+
+        Without -s the command ran on the default device, which is not
+        known here, so every index is marked stale.
+
+        Returns:
+            True if the command changes packages.
+        """
+        changes, serial = changes_packages(args)
+        if changes:
+            for stale in [serial] if serial else list(self._devices):
+                self.expire(stale, save=False)
+            self.save()
+        return changes
+
+    def device_event(self, event, serial, state):
+        """Device tracker listener: a device that (re)appears may have new packages."""
+        if event == "added" or (event == "changed" and state == "device"):
+            self.expire(serial, save=False)  # Saved with the next refresh
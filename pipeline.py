@@ -0,0 +1,338 @@
+"""
+Output pipelines: `<command> | grep x | head -n 5`.
+
+Trailing `| stage` segments of a command line are run in-process instead
+of spawning a host shell, so they work on the output of every command:
+adb commands, the shell's own commands and `cmd`/`powershell` alike.
+The command runs in its own thread with its output sent to a line queue
+instead of the console, and each stage is a lazy generator over those
+lines. A stage that needs no more input, such as `head`, ends the
+pipeline early and stops the command's processes and sockets like
+killing a job would, so `logcat | head -n 5` does not wait for logcat.
+
+Only trailing segments whose first word is a known stage are taken, so a
+quoted `shell "pm list packages | grep foo"` or an unknown `| findstr x`
+still goes to the command itself.
+"""
+import contextvars
+import itertools
+import json
+import queue
+import re
+import sys
+from collections import deque
+from contextlib import ExitStack
+from threading import Lock, Thread
+
+from commands import split_args
+from fanout import print_line
+from jobs import Job, killed, current_job, track, untrack
+
+
+PIPE_LINES = 4096  # Lines buffered before the command waits for the stages
+DEFAULT_LINES = 10  # For head and tail without -n
+_END = object()
+
+output_sink = contextvars.ContextVar("output_sink", default=None)
+_route_lock = Lock()
+
+
+class RoutedStdout:
+    """sys.stdout replacement writing to the context's output sink, if it has one."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        """Write to the sink of the running pipeline, or to the console."""
+        sink = output_sink.get()
+        if sink is None:
+            return self.stream.write(text)
+        return sink.write(text)
+
+    def flush(self):
+        """Flush the console; a sink has nothing to flush."""
+        if output_sink.get() is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        # fileno, isatty, encoding... so input() and readline keep working
+        return getattr(self.stream, name)
+
+
+def route_stdout():
+    """Replace sys.stdout with a RoutedStdout, once."""
+    with _route_lock:
+        if not isinstance(sys.stdout, RoutedStdout):
+            sys.stdout = RoutedStdout(sys.stdout)
+
+
+def split_pipeline(line):
+    """
+    Split trailing pipeline stages off a command line.
+
+    Returns:
+        (command, stages) where stages is a list of argument lists, e.g.
+        [["grep", "-i", "error"], ["head", "-n", "5"]], empty if there are none.
+    """
+    pipes = []
+    quote = None
+    for index, char in enumerate(line):
+        if quote:
+            quote = None if char == quote else quote
+        elif char in "\"'":
+            quote = char
+        elif char == "|" and "|" not in line[index - 1:index] + line[index + 1:index + 2]:
+            pipes.append(index)
+    stages = []
+    end = len(line)
+    for pipe in reversed(pipes):
+        try:
+            args = split_args(line[pipe + 1:end])
+        except ValueError:
+            break
+        if not args or args[0].lower() not in STAGES:
+            break
+        stages.insert(0, args)
+        end = pipe
+    return line[:end].rstrip(), stages
+
+
+def _line_count(args, name):
+    """Parse the [-n N | -N] option of head and tail."""
+    if not args:
+        return DEFAULT_LINES
+    if len(args) == 2 and args[0] == "-n":
+        value = args[1]
+    elif len(args) == 1 and args[0].startswith("-"):
+        value = args[0][2:] if args[0].startswith("-n") else args[0][1:]
+    else:
+        value = None
+    if value is None or not value.isdigit():
+        raise ValueError(f"Usage: {name} [-n lines]")
+    return int(value)
+
+
+def _grep(args, stack):  # pylint: disable=unused-argument
+    """grep [-i] [-v] [-F] [-m count] pattern: keep the lines matching a regex."""
+    flags, invert, fixed, limit = 0, False, False, None
+    args = list(args)
+    while len(args) > 1 and args[0].startswith("-"):
+        option = args.pop(0)
+        if option == "-m":
+            if not args[0].isdigit():
+                raise ValueError("grep: -m needs a count")
+            limit = int(args.pop(0))
+        elif option in ("-i", "-v", "-F"):
+            flags |= re.IGNORECASE if option == "-i" else 0
+            invert = invert or option == "-v"
+            fixed = fixed or option == "-F"
+        else:
+            raise ValueError(f"grep: unknown option {option}")
+    if len(args) != 1:
+        raise ValueError("Usage: grep [-i] [-v] [-F] [-m count] pattern")
+    try:
+        pattern = re.compile(re.escape(args[0]) if fixed else args[0], flags)
+    except re.error as e:
+        raise ValueError(f"grep: bad pattern: {e}") from e
+
+    def stage(lines):
+        matches = (line for line in lines if (pattern.search(line) is None) == invert)
+        return itertools.islice(matches, limit)
+    return stage
+
+
+def _head(args, stack):  # pylint: disable=unused-argument
+    """head [-n lines]: the first lines, then the command is stopped."""
+    count = _line_count(args, "head")
+    return lambda lines: itertools.islice(lines, count)
+
+
+def _tail(args, stack):  # pylint: disable=unused-argument
+    """tail [-n lines]: the last lines, once the command has finished."""
+    count = _line_count(args, "tail")
+
+    def stage(lines):
+        yield from deque(lines, maxlen=count)
+    return stage
+
+
+def _count(args, stack):  # pylint: disable=unused-argument
+    """count: the number of lines."""
+    if args:
+        raise ValueError("Usage: count")
+
+    def stage(lines):
+        yield str(sum(1 for _ in lines))
+    return stage
+
+
+def _sort(args, stack):  # pylint: disable=unused-argument
+    """sort [-r] [-n] [-u]: sort the lines, numerically by their leading number with -n."""
+    unknown = set(args) - {"-r", "-n", "-u"}
+    if unknown:
+        raise ValueError("Usage: sort [-r] [-n] [-u]")
+    number = re.compile(r"\s*(-?\d+(?:\.\d+)?)")
+
+    def numeric(line):
+        match = number.match(line)
+        return float(match.group(1)) if match else 0.0
+
+    def stage(lines):
+        lines = set(lines) if "-u" in args else lines
+        yield from sorted(lines, key=numeric if "-n" in args else None, reverse="-r" in args)
+    return stage
+
+
+def _uniq(args, stack):  # pylint: disable=unused-argument
+    """uniq [-c]: drop repeated adjacent lines, prefixing how often they came with -c."""
+    if args not in ([], ["-c"]):
+        raise ValueError("Usage: uniq [-c]")
+
+    def stage(lines):
+        for line, group in itertools.groupby(lines):
+            yield f"{sum(1 for _ in group):7} {line}" if args else line
+    return stage
+
+
+def _tee(args, stack):
+    """tee [-a] file: also write the lines to a file."""
+    append = args[:1] == ["-a"]
+    if len(args) != 1 + append:
+        raise ValueError("Usage: tee [-a] file")
+    try:
+        f = stack.enter_context(open(args[-1], "a" if append else "w", encoding="utf-8"))
+    except OSError as e:
+        raise ValueError(f"tee: {e}") from e
+
+    def stage(lines):
+        for line in lines:
+            f.write(f"{line}\n")
+            yield line
+    return stage
+
+
+def _json(args, stack):  # pylint: disable=unused-argument
+    """json: the lines as a JSON array of strings, printed as they come."""
+    if args:
+        raise ValueError("Usage: json")
+
+    def stage(lines):
+        previous = None
+        yield "["
+        for line in lines:
+            if previous is not None:
+                yield f"  {previous},"
+            previous = json.dumps(line, ensure_ascii=False)
+        if previous is not None:
+            yield f"  {previous}"
+        yield "]"
+    return stage
+
+
+STAGES = {"grep": _grep, "head": _head, "tail": _tail, "count": _count, "sort": _sort,
+          "uniq": _uniq, "tee": _tee, "json": _json}
+
+
+class Pipe:
+    """Carries a command's output from its thread to the stages, line by line."""
+
+    def __init__(self, size=PIPE_LINES):
+        self.job = Job(None, "pipeline")  # Tracks what the command opens, to stop it early
+        self.lines = queue.Queue(size)
+        self.pending = ""
+        self.closed = False
+        self.ended = False
+        self._lock = Lock()
+
+    def write(self, text):
+        """Queue the complete lines of some output, waiting while the queue is full."""
+        with self._lock:
+            if self.closed:
+                return len(text)
+            lines = (self.pending + text).split("\n")
+            self.pending = lines.pop()
+        for line in lines:
+            self.lines.put(line.rstrip("\r"))
+        return len(text)
+
+    def end(self):
+        """Queue an unterminated last line and mark the end of the output."""
+        with self._lock:
+            pending, self.pending = self.pending, ""
+        if pending and not self.closed:
+            self.lines.put(pending.rstrip("\r"))
+        self.lines.put(_END)
+
+    def __iter__(self):
+        while not self.ended:
+            line = self.lines.get()
+            if line is _END:
+                self.ended = True
+                return
+            yield line
+
+    def close(self):
+        """Stop the command, e.g. once head has its lines or the job was killed."""
+        with self._lock:
+            self.closed = True
+        self.job.kill()
+
+    def drain(self):
+        """Discard output until the command has finished."""
+        while not self.ended:
+            self.ended = self.lines.get() is _END
+
+
+def run_pipeline(run, stages):
+    """
+    Run a command, passing its output through pipeline stages.
+
+    Args:
+        run (callable): Runs the command and returns its result.
+        stages (list): Argument lists of the stages, from split_pipeline.
+
+    Returns:
+        The command's result, or True if the stages ended it early.
+    """
+    with ExitStack() as stack:
+        try:
+            filters = [STAGES[args[0].lower()](args[1:], stack) for args in stages]
+        except ValueError as e:
+            print(f"Error: {e}")
+            return False
+        route_stdout()
+        pipe = Pipe()
+        outcome = {}
+
+        def produce():
+            current_job.set(pipe.job)
+            output_sink.set(pipe)
+            try:
+                outcome["result"] = run()
+            except Exception as e:  # Raised again in the calling thread
+                outcome["error"] = e
+            finally:
+                pipe.end()
+
+        track(pipe)  # Killing the job this runs in also stops the command
+        try:
+            Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True).start()
+            lines = iter(pipe)
+            for stage in filters:
+                lines = stage(lines)
+            for line in lines:
+                if killed():
+                    break
+                print_line(line)
+        finally:
+            if not pipe.ended:
+                pipe.close()  # The stages are done, or failed; the command is not
+            untrack(pipe)
+            pipe.drain()
+    if pipe.closed:
+        # Errors of a command that was stopped are the stopping showing
+        return not killed() or outcome.get("result")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome.get("result")
@@ -0,0 +1,186 @@
+"""
+In-process Python plugin API for mods.
+
+A plugin is a folder in mods/ holding a mod.json manifest and a mod.py
+module. The manifest declares the commands the plugin provides and the
+events it listens to, so the shell knows about them without importing
+anything. mod.py is only imported the first time one of its commands is
+used or one of its events fires, and must define register(shell):
+
+    def register(shell):
+        shell.command("hello", lambda args: print("Hello", args))
+        shell.on("device_added", lambda serial, state: print(serial))
+
+Events: device_added(serial, state), device_removed(serial, state),
+device_changed(serial, state) and command_executed(command).
+"""
+import importlib.util
+import json
+import os
+from threading import Lock
+
+
+MANIFEST_FILE = "mod.json"
+MODULE_FILE = "mod.py"
+EVENTS = ("device_added", "device_removed", "device_changed", "command_executed")
+
+
+class PluginApi:
+    """The object handed to a plugin's register() function."""
+
+    def __init__(self, plugin, services):
+        self._plugin = plugin
+        self._services = services
+
+    def command(self, name, handler, help_text=""):
+        """Register handler(args) for a shell command declared in mod.json."""
+        self._plugin.commands[name.lower()] = (handler, help_text)
+
+    def on(self, event, handler):
+        """Register handler(*args) for one of the EVENTS declared in mod.json."""
+        if event not in EVENTS:
+            raise ValueError(f"Unknown event '{event}'")
+        self._plugin.hooks.setdefault(event, []).append(handler)
+
+    def run_adb(self, args):
+        """Run an adb command like the shell does and return whether it succeeded."""
+        return self._services["run_adb"](args)
+
+    def devices(self):
+        """Return a serial -> state map of the attached devices."""
+        return self._services["devices"]()
+
+    def setting(self, key):
+        """Return a shell setting, e.g. adb_path."""
+        return self._services["setting"](key)
+
+
+class Plugin:  # pylint: disable=too-few-public-methods
+    """A plugin found in mods/, imported lazily."""
+
+    def __init__(self, name, directory, manifest):
+        self.name = name
+        self.directory = directory
+        self.declared_commands = {c.lower(): h for c, h in manifest.get("commands", {}).items()}
+        self.declared_events = [e for e in manifest.get("events", []) if e in EVENTS]
+        self.commands = {}
+        self.hooks = {}
+        self.module = None
+        self.failed = False
+        self._lock = Lock()
+
+    def load(self, services):
+        """Import mod.py and call its register() function, once."""
+        with self._lock:
+            if self.module is None and not self.failed:
+                self._import(services)
+            return not self.failed
+
+    def _import(self, services):
+        """Import mod.py and let it register its commands and hooks."""
+        path = os.path.join(self.directory, MODULE_FILE)
+        try:
+            spec = importlib.util.spec_from_file_location(f"openadb_mod_{self.name}", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            module.register(PluginApi(self, services))
+        except Exception as e:
+            print(f"Error loading mod {self.name}: {e}")
+            self.failed = True
+            return
+        self.module = module
+
+
+class PluginManager:
+    """Finds plugins and routes commands and events to them."""
+
+    def __init__(self, services):
+        """
+        Args:
+            services (dict): Shell functions exposed to plugins: run_adb(args),
+                devices() and setting(key).
+        """
+        self.services = services
+        self.plugins = []
+        self._commands = {}
+        self._events = {}
+
+    def discover(self, directory="mods"):
+        """Read every plugin manifest in the mods folder without importing anything."""
+        if not os.path.isdir(directory):
+            return []
+        for item in sorted(os.listdir(directory)):
+            folder = os.path.join(directory, item)
+            manifest_path = os.path.join(folder, MANIFEST_FILE)
+            if not (os.path.isfile(manifest_path)
+                    and os.path.isfile(os.path.join(folder, MODULE_FILE))):
+                continue
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    plugin = Plugin(item, folder, json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Error reading {manifest_path}: {e}")
+                continue
+            self.plugins.append(plugin)
+            for command in plugin.declared_commands:
+                self._commands.setdefault(command, plugin)
+            for event in plugin.declared_events:
+                self._events.setdefault(event, []).append(plugin)
+        return self.plugins
+
+    def has_command(self, name):
+        """Check whether a plugin declared a command."""
+        return name.lower() in self._commands
+
+    def command_help(self):
+        """Return (command, help text) for every plugin command."""
+        return [(command, plugin.declared_commands[command])
+                for command, plugin in sorted(self._commands.items())]
+
+    def register_commands(self, registry):
+        """
+        Register every plugin command with a CommandRegistry.
+
+        Built-in commands keep their name: a plugin command clashing with
+        one is skipped with a warning.
+
+        Returns:
+            The names of the skipped commands.
+        """
+        skipped = []
+        for name, help_text in self.command_help():
+            registered = registry.register(
+                name, lambda parsed, name=name: self.run_command(name, parsed.raw),
+                help_text=f"{help_text} (mod)", max_args=None, replace=False)
+            if not registered:
+                print(f"Warning: Mod {self._commands[name].name} declares the command "
+                      f"'{name}', which is built in. The mod's command is skipped.")
+                skipped.append(name)
+        return skipped
+
+    def run_command(self, name, args):
+        """Load the plugin owning a command if needed and run the command."""
+        plugin = self._commands[name.lower()]
+        if not plugin.load(self.services):
+            return False
+        entry = plugin.commands.get(name.lower())
+        if entry is None:
+            print(f"Error: Mod {plugin.name} did not register the command '{name}'.")
+            return False
+        try:
+            result = entry[0](args)
+        except Exception as e:
+            print(f"Error in mod {plugin.name}: {e}")
+            return False
+        return result is not False
+
+    def emit(self, event, *args):
+        """Fire an event, loading the plugins that subscribed to it."""
+        for plugin in self._events.get(event, []):
+            if not plugin.load(self.services):
+                continue
+            for hook in plugin.hooks.get(event, []):
+                try:
+                    hook(*args)
+                except Exception as e:
+                    print(f"Error in mod {plugin.name}: {e}")
@@ -0,0 +1,93 @@
+"""
+Streams the output of a child process to the console.
+
+Both pipes are drained at the same time by reader threads, so a child
+writing a lot to stderr can never block on a full pipe, and chunks are
+printed in the order they arrive. Reads are large and unbuffered by line;
+only prefixed output is split into lines.
+"""
+import locale
+import os
+import queue
+import re
+import subprocess
+from threading import Thread
+from time import perf_counter
+
+from adb_client import LinePrinter
+from jobs import track, untrack
+from metrics import note_output, note_spawn
+
+
+CHUNK_SIZE = 65536
+# adb reports some failures, e.g. "cannot connect", with exit code 0
+ADB_FAILURE_PATTERN = re.compile(r"cannot", re.IGNORECASE)
+PATTERN_WINDOW = 256  # Characters kept to match a pattern split across chunks
+
+
+def _drain(pipe, name, chunks, chunk_size):
+    """Read a pipe until EOF, queueing (name, bytes) and finally (name, None)."""
+    try:
+        while True:
+            data = pipe.read1(chunk_size)
+            if not data:
+                break
+            chunks.put((name, data))
+    except (OSError, ValueError):
+        pass  # The process was killed
+    finally:
+        chunks.put((name, None))
+
+
+def stream_process(command, prefix="", failure_pattern=None, chunk_size=CHUNK_SIZE):
+    """
+    Run a shell command, printing stdout and stderr as they arrive.
+
+    Args:
+        command (str): The command string to execute.
+        prefix (str): Text printed in front of every output line.
+        failure_pattern (re.Pattern): Optional compiled pattern; the command
+            counts as failed if its output matches it.
+        chunk_size (int): Most bytes read from a pipe at once.
+
+    Returns:
+        True if the command exited with status 0 and no output matched
+        failure_pattern.
+    """
+    started = perf_counter()
+    process = subprocess.Popen(
+        command,
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        # Own process group, so killing a job also stops the children
+        start_new_session=os.name != "nt"
+    )
+    note_spawn(perf_counter() - started)
+    track(process)  # Lets kill stop it if this runs as a background job
+    try:
+        chunks = queue.SimpleQueue()
+        for name, pipe in (("stdout", process.stdout), ("stderr", process.stderr)):
+            Thread(target=_drain, args=(pipe, name, chunks, chunk_size), daemon=True).start()
+        encoding = locale.getpreferredencoding(False)
+        printers = {"stdout": LinePrinter(prefix, encoding),
+                    "stderr": LinePrinter(f"{prefix}Error: ", encoding)}
+        tails = {"stdout": "", "stderr": ""}
+        failed = False
+        open_pipes = 2
+        while open_pipes:
+            name, data = chunks.get()
+            if data is not None:
+                note_output(len(data))
+            text = printers[name].write(data) if data is not None else printers[name].flush()
+            if data is None:
+                open_pipes -= 1
+            if failure_pattern is not None and not failed and text:
+                window = tails[name] + text
+                failed = failure_pattern.search(window) is not None
+                tails[name] = window[-PATTERN_WINDOW:]
+        return process.wait() == 0 and not failed
+    finally:
+        untrack(process)
+        process.stdout.close()
+        process.stderr.close()
@@ -0,0 +1,276 @@
+"""
+Persistent shell-v2 sessions, one per device.
+
+Opening a device shell costs a transport switch and a new shell process
+on the device. A ShellSession keeps one non-PTY shell open and sends each
+command through it, wrapped so the end of its output and its exit code
+are marked by a random sentinel on both stdout and stderr. Every command
+runs in its own subshell with stdin closed, so `cd`, `exit` or a command
+reading stdin cannot break the session. Dead sessions are reopened on the
+next command.
+"""
+import shlex
+import socket
+import struct
+import uuid
+from threading import Lock
+from time import perf_counter
+
+from adb_client import AdbError, AdbConnectionError, ShellSessionError, LinePrinter
+from jobs import track, untrack
+from metrics import note_output, note_spawn
+
+
+# Shell protocol v2 packet ids
+ID_STDIN = 0
+ID_STDOUT = 1
+ID_STDERR = 2
+ID_EXIT = 3
+HEADER = struct.Struct("<BI")
+
+
+def split_marker(data, marker):
+    """
+    Split output at a sentinel.
+
+    Returns:
+        (output, rest, found). If the sentinel was found, rest is what
+        follows it; otherwise rest holds back the bytes that could be the
+        start of a sentinel split across packets.
+    """
+    index = data.find(marker)
+    if index >= 0:
+        return data[:index], data[index + len(marker):], True
+    split = max(0, len(data) - len(marker) + 1)
+    return data[:split], data[split:], False
+
+
+class ShellSession:
+    """One long-lived shell-v2 session on a device."""
+
+    def __init__(self, client, serial=None):
+        """
+        Args:
+            client (AdbClient): The client used to reach the adb server.
+            serial (str): The device to open the shell on, or None for the only device.
+        """
+        self.serial = serial
+        self.lock = Lock()
+        self.closed = False
+        self._sock = client.transport(serial)
+        try:
+            client.request(self._sock, "shell,v2,raw:")
+        except Exception:
+            self._sock.close()
+            raise
+        self._sock.settimeout(None)
+        self._buffer = b""
+
+    def close(self):
+        """Close the session; the device shell exits with it."""
+        self.closed = True
+        try:
+            # Also wakes up a thread blocked reading the session
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+    def send(self, command):
+        """
+        Send a command wrapped in sentinels.
+
+        Returns:
+            The sentinel marking the end of the command's output.
+        """
+        marker = f"__OAS_{uuid.uuid4().hex}__"
+        script = (f"(eval {shlex.quote(command)}) </dev/null; "
+                  f"printf '%s %d\\n' {marker} $?; printf '%s\\n' {marker} >&2\n")
+        data = script.encode("utf-8")
+        self._sock.sendall(HEADER.pack(ID_STDIN, len(data)) + data)
+        return marker.encode("ascii")
+
+    def _read_packet(self):
+        """Read one shell-v2 packet, returning (id, data)."""
+        while len(self._buffer) < HEADER.size:
+            self._fill()
+        packet_id, length = HEADER.unpack_from(self._buffer)
+        while len(self._buffer) < HEADER.size + length:
+            self._fill()
+        data = self._buffer[HEADER.size:HEADER.size + length]
+        self._buffer = self._buffer[HEADER.size + length:]
+        return packet_id, data
+
+    def _fill(self):
+        """Read more bytes from the device, failing if the session died."""
+        chunk = self._sock.recv(65536)
+        if not chunk:
+            self.closed = True
+            raise AdbError("shell session closed")
+        self._buffer += chunk
+
+    def read(self, marker):
+        """
+        Yield (stream id, bytes) for one command's output until both
+        sentinels arrive, then (ID_EXIT, exit code).
+        """
+        pending = {ID_STDOUT: b"", ID_STDERR: b""}
+        done = {ID_STDOUT: False, ID_STDERR: False}
+        status = b""  # What follows the stdout sentinel: " <exit code>\n"
+        while not (done[ID_STDOUT] and done[ID_STDERR]):
+            packet_id, data = self._read_packet()
+            if packet_id == ID_EXIT:
+                self.close()
+                raise AdbError("shell session exited")
+            if packet_id not in pending:
+                continue
+            if done[packet_id]:
+                if packet_id == ID_STDOUT:
+                    status += data
+                continue
+            output, rest, done[packet_id] = split_marker(pending[packet_id] + data, marker)
+            pending[packet_id] = b"" if done[packet_id] else rest
+            if done[packet_id] and packet_id == ID_STDOUT:
+                status = rest
+            if output:
+                yield packet_id, output
+        while b"\n" not in status:
+            packet_id, data = self._read_packet()
+            if packet_id == ID_STDOUT:
+                status += data
+        try:
+            exit_code = int(status.split(b"\n", 1)[0])
+        except ValueError:
+            exit_code = None
+        yield ID_EXIT, exit_code
+
+
+class ShellSessions:
+    """Keeps one ShellSession per device and reopens sessions that died."""
+
+    def __init__(self, client):
+        self.client = client
+        self._sessions = {}
+        self._opening = {}  # serial -> Lock held while a session for it is opened
+        self._lock = Lock()
+
+    def _session(self, serial):
+        """Return the open session for a device, opening one if needed."""
+        with self._lock:
+            opening = self._opening.setdefault(serial, Lock())
+        # Commands arriving together for one device share the session one of them opens
+        with opening:
+            with self._lock:
+                session = self._sessions.get(serial)
+            if session is not None and not session.closed:
+                return session
+            try:
+                session = ShellSession(self.client, serial)
+            except AdbConnectionError:
+                raise
+            except AdbError as e:
+                raise ShellSessionError(str(e)) from e
+            with self._lock:
+                self._sessions[serial] = session
+            return session
+
+    def close(self, serial=None):
+        """
+        Close the session of a device, e.g. when it is disconnected.
+
+        The session of the default device (serial None) is closed as well,
+        since it may run on that device.
+        """
+        with self._lock:
+            sessions = [self._sessions.pop(serial, None), self._sessions.pop(None, None)]
+        for session in sessions:
+            if session is not None:
+                session.close()
+
+    def close_all(self):
+        """Close every session."""
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+    def run(self, command, serial=None):
+        """
+        Run a command in the device's session.
+
+        Yields (ID_STDOUT or ID_STDERR, bytes) as output arrives and finally
+        (ID_EXIT, exit code). The session is reopened once if it turns out
+        to be dead before the command produced any output. Stopping early
+        closes the session, since the rest of the output would otherwise be
+        read by the next command.
+
+        Raises:
+            ShellSessionError: If the device cannot open a shell-v2 session.
+        """
+        for attempt in range(2):
+            started = perf_counter()
+            session = self._session(serial)
+            produced = False
+            finished = False
+            with session.lock:
+                track(session)  # Killing the job closes the session
+                try:
+                    marker = session.send(command)
+                    note_spawn(perf_counter() - started)
+                    for item in session.read(marker):
+                        produced = True
+                        finished = item[0] == ID_EXIT
+                        if not finished:
+                            note_output(len(item[1]))
+                        yield item
+                    finished = True
+                except (AdbError, OSError):
+                    session.close()
+                    if produced or attempt:
+                        raise
+                    continue
+                finally:
+                    untrack(session)
+                    if not finished:
+                        session.close()
+            return
+
+    def stream(self, command, serial=None, prefix=""):
+        """
+        Run a command and print its stdout and stderr, as "Error: " lines, as they arrive.
+
+        Returns:
+            True if the command exited with status 0.
+        """
+        printers = {ID_STDOUT: LinePrinter(prefix), ID_STDERR: LinePrinter(f"{prefix}Error: ")}
+        exit_code = None
+        for stream, data in self.run(command, serial):
+            if stream == ID_EXIT:
+                exit_code = data
+            else:
+                printers[stream].write(data)
+        for printer in printers.values():
+            printer.flush()
+        return exit_code == 0
+
+    def output(self, command, serial=None):
+        """
+        Run a command and collect its stdout.
+
+        Falls back to a one-off shell if the device does not support shell
+        v2, in which case the exit code is None.
+
+        Returns:
+            (exit code, stdout decoded as text)
+        """
+        chunks = []
+        exit_code = None
+        try:
+            for stream, data in self.run(command, serial):
+                if stream == ID_EXIT:
+                    exit_code = data
+                elif stream == ID_STDOUT:
+                    chunks.append(data)
+        except ShellSessionError:
+            chunks = list(self.client.shell(command, serial))
+        return exit_code, b"".join(chunks).decode("utf-8", errors="replace")
@@ -0,0 +1,110 @@
+"""
+Startup helpers for OpenADB Shell: phase timings and a cached `adb version`.
+
+StartupTimer records how long each startup phase took, for `--timings`.
+The clock starts when this module is imported, which openadbshell.py does
+before its other local modules, so the first phase covers those imports.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+
+STARTED = perf_counter()
+VERSION_CACHE_FILE = "adb_version.json"
+
+
+class StartupTimer:
+    """Durations of the startup phases, printed by report() when enabled."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.phases = []  # (name, seconds, ran in the background)
+        self.reported = False
+        self._last = STARTED
+        self._lock = Lock()
+
+    def mark(self, name):
+        """End a foreground phase: everything since the previous mark."""
+        now = perf_counter()
+        with self._lock:
+            self.phases.append((name, now - self._last, False))
+        self._last = now
+
+    @contextmanager
+    def background(self, name):
+        """Time a phase that runs alongside the others."""
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - started
+            with self._lock:
+                self.phases.append((name, elapsed, True))
+                late = self.reported
+            if late and self.enabled:
+                print(f"[timings] {name} finished in the background after "
+                      f"{elapsed * 1000:.1f} ms")
+
+    def report(self, stream=None):
+        """Print the phases so far and the total time since startup began."""
+        self.reported = True
+        if not self.enabled:
+            return
+        stream = stream or sys.stdout
+        with self._lock:
+            phases = list(self.phases)
+        lines = ["Startup timings:"]
+        for name, elapsed, background in phases:
+            lines.append(f"  {name:<24} {elapsed * 1000:8.1f} ms"
+                         + ("  (background)" if background else ""))
+        lines.append(f"  {'total':<24} {(perf_counter() - STARTED) * 1000:8.1f} ms")
+        print("\n".join(lines), file=stream)
+
+
+def _version_key(adb_path):
+    """Identify an adb binary by its path, size and modification time."""
+    binary = shutil.which(adb_path) or adb_path
+    info = os.stat(binary)
+    return binary, {"path": os.path.abspath(binary), "size": info.st_size,
+                    "mtime": info.st_mtime_ns}
+
+
+def cached_adb_version(adb_path, cache_file=VERSION_CACHE_FILE):
+    """Return the cached `adb version` output, or None if the binary changed since."""
+    try:
+        key = _version_key(adb_path)[1]
+        with open(cache_file, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        return cache["output"] if cache.get("key") == key else None
+    except (OSError, ValueError, KeyError, AttributeError):
+        return None
+
+
+def adb_version(adb_path, cache_file=VERSION_CACHE_FILE):
+    """
+    Run `adb version` and cache its output for cached_adb_version.
+
+    Raises:
+        OSError: If the adb binary cannot be found or run.
+    """
+    binary, key = _version_key(adb_path)
+    result = subprocess.run([binary, "version"], capture_output=True, text=True,
+                            check=False)
+    output = result.stdout + result.stderr
+    if result.returncode == 0:
+        try:
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".tmp",
+                                             dir=os.path.dirname(os.path.abspath(cache_file)),
+                                             delete=False) as f:
+                json.dump({"key": key, "output": output}, f)
+            os.replace(f.name, cache_file)
+        except OSError as e:
+            print(f"Error saving adb version cache: {e}")
+    return output
@@ -0,0 +1,582 @@
+"""
+Parallel pull/push engine on top of the adb sync protocol.
+
+Each worker opens its own `sync:` connection to the device and takes files
+from a shared queue, so several files move at once. Files whose size and
+mtime already match on the other side are skipped, finished files are
+recorded in a manifest under transfers/, and an interrupted directory
+transfer picks up where it stopped when the same command is run again.
+Throughput is reported live in MB/s.
+"""
+import contextvars
+import hashlib
+import json
+import os
+import posixpath
+import queue
+import re
+import stat
+import struct
+import sys
+import tempfile
+from threading import Thread, Lock, Event
+from time import perf_counter
+
+from adb_client import AdbError
+from commands import split_args
+from fanout import print_line
+from jobs import track, untrack, killed
+from metrics import metrics
+
+
+MANIFEST_DIR = "transfers"
+DEFAULT_JOBS = 4
+MAX_DATA = 65536  # Largest DATA packet the sync protocol allows
+SIZE_LIMIT = 1 << 32  # Sync sizes are 32-bit, larger files wrap around
+MAX_LINKS = 8  # Symlinked folders followed inside each other, so a link loop ends
+PROGRESS_INTERVAL = 0.5
+USAGE_PULL = "pull [--jobs <n>] [--force] <remote path> [<local path>]"
+USAGE_PUSH = "push [--jobs <n>] [--force] <local path>... <remote path>"
+_LENGTH = struct.Struct("<I")
+_STAT = struct.Struct("<III")  # mode, size, mtime
+_DENT = struct.Struct("<IIII")  # mode, size, mtime, name length
+
+
+class LinkError(AdbError):
+    """A symlink that is not a folder; its size and mtime are the link's, so adb copies it."""
+
+
+class SyncConnection:
+    """One sync: session with a device."""
+
+    def __init__(self, client, serial=None):
+        self.sock = client.transport(serial)
+        try:
+            client.request(self.sock, "sync:")
+        except Exception:
+            self.sock.close()
+            raise
+        self.sock.settimeout(None)
+        track(self.sock)  # Killing the job closes the connection
+        self.reader = self.sock.makefile("rb", buffering=MAX_DATA * 4)
+
+    def close(self):
+        """End the sync session."""
+        untrack(self.sock)
+        try:
+            self._send(b"QUIT")
+        except OSError:
+            pass
+        self.reader.close()
+        self.sock.close()
+
+    def _send(self, packet_id, data=b""):
+        """Send a request with a length-prefixed payload."""
+        self.sock.sendall(packet_id + _LENGTH.pack(len(data)) + data)
+
+    def _read(self, size):
+        """Read exactly size bytes."""
+        data = self.reader.read(size)
+        if len(data) != size:
+            raise AdbError("device closed the sync connection")
+        return data
+
+    def _read_header(self):
+        """Read a packet id and its length field."""
+        header = self._read(8)
+        return header[:4], _LENGTH.unpack_from(header, 4)[0]
+
+    def _fail(self, length):
+        """Raise the error message of a FAIL packet."""
+        raise AdbError(self._read(length).decode("utf-8", errors="replace"))
+
+    def stat(self, path):
+        """
+        Return (mode, size, mtime) of a device path; mode is 0 if it does not exist.
+        """
+        self._send(b"STAT", path.encode("utf-8"))
+        packet_id = self._read(4)
+        if packet_id != b"STAT":
+            raise AdbError(f"unexpected sync reply {packet_id!r}")
+        return _STAT.unpack(self._read(_STAT.size))
+
+    def resolve(self, path):
+        """
+        Like stat(), but a symlink to a directory, such as /sdcard, is
+        reported as a directory. stat() describes the link itself.
+        """
+        mode, size, mtime = self.stat(path)
+        if stat.S_ISLNK(mode) and self.is_directory(path):
+            mode = stat.S_IFDIR | stat.S_IMODE(mode)
+        return mode, size, mtime
+
+    def is_directory(self, path):
+        """Check whether a path can be listed; a directory lists at least "."."""
+        return bool(self._list(path))
+
+    def list(self, path):
+        """Return (name, mode, size, mtime) for every entry of a device directory."""
+        return [entry for entry in self._list(path) if entry[0] not in (".", "..")]
+
+    def _list(self, path):
+        """Return the LIST entries of a path, "." and ".." included, none if it is no directory."""
+        self._send(b"LIST", path.encode("utf-8"))
+        entries = []
+        while True:
+            packet_id = self._read(4)
+            mode, size, mtime, length = _DENT.unpack(self._read(_DENT.size))
+            if packet_id == b"DONE":
+                return entries
+            if packet_id != b"DENT":
+                raise AdbError(f"unexpected sync reply {packet_id!r}")
+            entries.append((self._read(length).decode("utf-8", errors="replace"), mode, size,
+                            mtime))
+
+    def pull(self, remote, local, mtime, progress):
+        """Download a file to local through a .part file, keeping the device mtime."""
+        self._send(b"RECV", remote.encode("utf-8"))
+        partial = local + ".part"
+        with open(partial, "wb") as f:
+            while True:
+                packet_id, length = self._read_header()
+                if packet_id == b"DATA":
+                    f.write(self._read(length))
+                    progress.add(length)
+                elif packet_id == b"DONE":
+                    break
+                elif packet_id == b"FAIL":
+                    self._fail(length)
+                else:
+                    raise AdbError(f"unexpected sync reply {packet_id!r}")
+        os.replace(partial, local)
+        os.utime(local, (mtime, mtime))
+
+    def push(self, local, remote, mode, mtime, progress):
+        """Upload a file; the device creates missing directories and keeps the mtime."""
+        self._send(b"SEND", f"{remote},{mode}".encode("utf-8"))
+        with open(local, "rb") as f:
+            while True:
+                data = f.read(MAX_DATA)
+                if not data:
+                    break
+                self._send(b"DATA", data)
+                progress.add(len(data))
+        self.sock.sendall(b"DONE" + _LENGTH.pack(mtime))
+        packet_id, length = self._read_header()
+        if packet_id == b"FAIL":
+            self._fail(length)
+        if packet_id != b"OKAY":
+            raise AdbError(f"unexpected sync reply {packet_id!r}")
+
+
+def walk_remote(conn, root):
+    """
+    Return {relative path: (size, mtime, mode)} for every file under a device
+    directory. Symlinks to folders are followed, up to MAX_LINKS inside each
+    other; other symlinks are listed as files, with the link's size and mtime.
+    """
+    files = {}
+    pending = [("", 0)]
+    while pending:
+        relative, links = pending.pop()
+        for name, mode, size, mtime in conn.list(posixpath.join(root, relative)):
+            path = posixpath.join(relative, name)
+            if stat.S_ISDIR(mode):
+                pending.append((path, links))
+            elif stat.S_ISLNK(mode) and conn.is_directory(posixpath.join(root, path)):
+                if links < MAX_LINKS:
+                    pending.append((path, links + 1))
+            elif stat.S_ISREG(mode) or stat.S_ISLNK(mode):
+                files[path] = (size, mtime, mode)
+    return files
+
+
+def walk_local(root):
+    """Return {relative posix path: (size, mtime)} for every file under a local directory."""
+    files = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            info = os.stat(path)
+            relative = os.path.relpath(path, root).replace(os.sep, "/")
+            files[relative] = (info.st_size, int(info.st_mtime))
+    return files
+
+
+class Progress:
+    """Byte and file counters shared by the workers, printed as live MB/s."""
+
+    def __init__(self, total_files, total_bytes, prefix=""):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.prefix = prefix
+        self.bytes = 0
+        self.files = 0
+        self.started = perf_counter()
+        self._lock = Lock()
+
+    def add(self, count):
+        """Count transferred bytes."""
+        with self._lock:
+            self.bytes += count
+
+    def file_done(self):
+        """Count a finished file."""
+        with self._lock:
+            self.files += 1
+
+    def rate(self):
+        """Return the average throughput so far in MB/s."""
+        return self.bytes / (1 << 20) / max(perf_counter() - self.started, 1e-6)
+
+    def line(self):
+        """Return the progress line."""
+        return (f"{self.prefix}{self.files}/{self.total_files} files  "
+                f"{self.bytes / (1 << 20):.1f}/{self.total_bytes / (1 << 20):.1f} MB  "
+                f"{self.rate():.1f} MB/s")
+
+    def report(self, stop):
+        """Print the progress line until stop is set; one line per device when prefixed."""
+        interval = PROGRESS_INTERVAL if not self.prefix else PROGRESS_INTERVAL * 4
+        while not stop.wait(interval):
+            if self.prefix:
+                print_line(self.line())
+            else:
+                sys.stdout.write(f"\r{self.line()}  ")
+                sys.stdout.flush()
+        if not self.prefix:
+            sys.stdout.write("\r")
+
+
+class Manifest:
+    """Files already transferred by an interrupted transfer, kept under transfers/."""
+
+    def __init__(self, key, directory=MANIFEST_DIR):
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + ".json"
+        self.path = os.path.join(directory, name)
+        self.directory = directory
+        self.done = {}
+        self._lock = Lock()
+        self._unsaved = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.done = {path: tuple(entry) for path, entry in json.load(f)["done"].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def matches(self, path, size, mtime):
+        """Check whether a file was already transferred with this size and mtime."""
+        return self.done.get(path) == (size, mtime)
+
+    def record(self, path, size, mtime):
+        """Record a finished file, saving every few files."""
+        with self._lock:
+            self.done[path] = (size, mtime)
+            self._unsaved += 1
+            if self._unsaved >= 16:
+                self._save()
+
+    def save(self):
+        """Write the manifest now."""
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        """Write the manifest atomically. Caller holds the lock."""
+        self._unsaved = 0
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.directory,
+                                             suffix=".tmp", delete=False) as f:
+                json.dump({"done": self.done}, f)
+            os.replace(f.name, self.path)
+        except OSError as e:
+            print(f"Error saving transfer manifest: {e}")
+
+    def remove(self):
+        """Delete the manifest once the transfer completed."""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def parse_transfer_args(args):
+    """
+    Parse the pull/push options.
+
+    Returns:
+        (options, paths), or None if there are options the engine does not
+        know, which are then meant for adb itself.
+    """
+    options = {"jobs": DEFAULT_JOBS, "force": False}
+    paths = []
+    i = 0
+    while i < len(args):
+        if args[i] == "--force":
+            options["force"] = True
+        elif args[i] == "--jobs" and i + 1 < len(args) and args[i + 1].isdigit():
+            options["jobs"] = max(1, int(args[i + 1]))
+            i += 1
+        elif args[i].startswith("-"):
+            return None
+        else:
+            paths.append(args[i])
+        i += 1
+    return options, paths
+
+
+def _same_file(local, remote):
+    """
+    Compare the (size, mtime) of a local and a device file.
+
+    The device reports sizes modulo 4 GiB, so a file of 4 GiB or more
+    cannot be compared and is always copied.
+    """
+    return remote is not None and local[0] < SIZE_LIMIT and local == remote
+
+
+def _local_matches(path, size, mtime, mode):
+    """Check whether a local file already has the size and mtime of a device file."""
+    if stat.S_ISLNK(mode):
+        return False  # The size and mtime are the link's, not the file's
+    try:
+        info = os.stat(path)
+    except OSError:
+        return False
+    return _same_file((info.st_size, int(info.st_mtime)), (size, mtime))
+
+
+def plan_pull(conn, remote, local):
+    """
+    List the files a pull copies.
+
+    Returns:
+        (tasks, current, present): tasks are (source, destination, size,
+        mtime, mode) tuples, current holds the destinations that already
+        match and present the destinations that exist.
+
+    Raises:
+        LinkError: If remote is a symlink to a file.
+    """
+    mode, size, mtime = conn.resolve(remote)
+    if mode == 0:
+        raise AdbError(f"remote object '{remote}' does not exist")
+    if stat.S_ISLNK(mode):
+        raise LinkError(f"remote object '{remote}' is a symlink")
+    if os.path.isdir(local):
+        local = os.path.join(local, posixpath.basename(remote.rstrip("/")))
+    if stat.S_ISDIR(mode):
+        files = walk_remote(conn, remote)
+        tasks = [(posixpath.join(remote, path), os.path.join(local, *path.split("/")),
+                  size, mtime, mode) for path, (size, mtime, mode) in files.items()]
+    else:
+        tasks = [(remote, local, size, mtime, mode)]
+    current = {task[1] for task in tasks if _local_matches(*task[1:])}
+    present = {task[1] for task in tasks if os.path.isfile(task[1])}
+    return tasks, current, present
+
+
+def _push_mode(info):
+    """Return the mode a pushed file gets; Windows has no useful permission bits."""
+    if os.name == "nt":
+        return stat.S_IFREG | 0o644
+    return stat.S_IFREG | stat.S_IMODE(info.st_mode)
+
+
+def plan_push(conn, sources, remote):
+    """
+    List the files a push copies.
+
+    Returns:
+        (tasks, current, present) as for plan_pull.
+    """
+    remote_mode = conn.resolve(remote)[0]
+    into = stat.S_ISDIR(remote_mode) or remote.endswith("/") or len(sources) > 1
+    tasks = []
+    current = set()
+    present = set()
+    for source in sources:
+        name = os.path.basename(os.path.normpath(source))
+        root = posixpath.join(remote, name) if into else remote
+        if os.path.isdir(source):
+            existing = walk_remote(conn, root) if stat.S_ISDIR(conn.resolve(root)[0]) else {}
+            for path, (size, mtime) in walk_local(source).items():
+                destination = posixpath.join(root, path)
+                local = os.path.join(source, *path.split("/"))
+                tasks.append((local, destination, size, mtime, _push_mode(os.stat(local))))
+                remote_file = existing.get(path)
+                if remote_file and _same_file((size, mtime), remote_file[:2]):
+                    current.add(destination)
+                if path in existing:
+                    present.add(destination)
+        elif os.path.isfile(source):
+            info = os.stat(source)
+            size, mtime = info.st_size, int(info.st_mtime)
+            tasks.append((source, root, size, mtime, _push_mode(info)))
+            mode, remote_size, remote_mtime = conn.stat(root)
+            if stat.S_ISREG(mode):
+                present.add(root)
+                if _same_file((size, mtime), (remote_size, remote_mtime)):
+                    current.add(root)
+        else:
+            raise AdbError(f"cannot stat '{source}': No such file or directory")
+    return tasks, current, present
+
+
+def run_transfers(client, serial, direction, tasks, jobs, progress, manifest):
+    """
+    Copy files over up to jobs parallel sync connections.
+
+    Returns:
+        The number of files that failed.
+    """
+    work = queue.SimpleQueue()
+    for task in tasks:
+        work.put(task)
+    failures = []
+
+    def worker():
+        conn = None
+        try:
+            while not killed():
+                try:
+                    source, destination, size, mtime, mode = work.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    if conn is None:
+                        conn = SyncConnection(client, serial)
+                    if direction == "pull":
+                        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+                        conn.pull(source, destination, mtime, progress)
+                    else:
+                        conn.push(source, destination, mode, mtime, progress)
+                except (AdbError, OSError) as e:
+                    failures.append(destination)
+                    if not killed():
+                        print_line(f"{progress.prefix}Error: {source}: {e}")
+                    if isinstance(e, OSError) and conn is not None:
+                        conn.close()  # The connection may be broken; use a new one
+                        conn = None
+                    continue
+                progress.file_done()
+                manifest.record(destination, size, mtime)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    # Each worker needs its own copy of the context to see the current job
+    workers = [Thread(target=contextvars.copy_context().run, args=(worker,), daemon=True)
+               for _ in range(max(1, min(jobs, len(tasks))))]
+    stop = Event()
+    reporter = Thread(target=progress.report, args=(stop,), daemon=True)
+    reporter.start()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    stop.set()
+    reporter.join()
+    return len(failures)
+
+
+def transfer(client, serial, direction, paths, options, prefix=""):
+    """
+    Pull or push files, skipping those that are already up to date.
+
+    Args:
+        client (AdbClient): The client used to reach the device.
+        serial (str): The device to copy from or to.
+        direction (str): "pull" or "push".
+        paths (list): [remote, local] for pull, [local..., remote] for push.
+        options (dict): Options from parse_transfer_args.
+        prefix (str): Text printed in front of every output line.
+
+    Returns:
+        True if every file was copied or already up to date.
+    """
+    conn = SyncConnection(client, serial)
+    try:
+        if direction == "pull":
+            tasks, current, present = plan_pull(conn, paths[0], paths[1])
+        else:
+            tasks, current, present = plan_push(conn, paths[:-1], paths[-1])
+    finally:
+        conn.close()
+    # Running the same command on the same device again finds the same manifest
+    if direction == "pull":
+        key = [paths[0], os.path.abspath(paths[1])]
+    else:
+        key = [os.path.abspath(path) for path in paths[:-1]] + [paths[-1]]
+    manifest = Manifest("|".join([direction, serial] + key))
+    total = len(tasks)
+    if not options["force"]:
+        # A file the manifest lists was copied before, unless it was deleted since
+        tasks = [task for task in tasks if task[1] not in current and not (
+            task[1] in present and manifest.matches(task[1], task[2], task[3]))]
+    skipped = total - len(tasks)
+    progress = Progress(len(tasks), sum(task[2] for task in tasks), prefix)
+    failed = run_transfers(client, serial, direction, tasks, options["jobs"], progress,
+                           manifest) if tasks else 0
+    metrics.count_transfer(serial, direction, progress.bytes)
+    if failed or killed():
+        manifest.save()  # Running the command again resumes from here
+    else:
+        manifest.remove()
+    print_line(f"{prefix}{progress.files} file(s) {direction}ed, {skipped} skipped, "
+               f"{failed} failed: {progress.bytes / (1 << 20):.1f} MB in "
+               f"{perf_counter() - progress.started:.1f}s ({progress.rate():.1f} MB/s)")
+    return not failed and not killed()
+
+
+def register_transfer_commands(registry, services):
+    """
+    Register the pull and push commands.
+
+    Args:
+        registry (CommandRegistry): The shell's command registry.
+        services (dict): Shell services: client, run_adb, run_adb_on and
+            run_on_selected.
+    """
+    def transfer_command(direction, parsed):
+        try:
+            parsed_args = parse_transfer_args(split_args(parsed.raw))
+        except ValueError as e:
+            print(f"Error: {e}")
+            return False
+        if parsed_args is None:
+            # Not our options, so they are meant for adb itself
+            return services["run_adb"](f"{direction} {parsed.raw}")
+        options, paths = parsed_args
+        if direction == "pull" and len(paths) == 1:
+            paths.append(".")
+        if (direction == "pull" and len(paths) != 2) or len(paths) < 2:
+            print(f"Usage: {USAGE_PULL if direction == 'pull' else USAGE_PUSH}")
+            return False
+
+        def run(serial, prefix):
+            device_paths = list(paths)
+            if direction == "pull" and prefix:
+                # Several devices: one folder each so they do not overwrite each other
+                device_paths[1] = os.path.join(paths[1], re.sub(r"[^\w.-]", "_", serial))
+                os.makedirs(device_paths[1], exist_ok=True)
+            try:
+                return transfer(services["client"], serial, direction, device_paths,
+                                options, prefix)
+            except LinkError:
+                quoted = " ".join(f'"{path}"' for path in device_paths)
+                return services["run_adb_on"](f"-s {serial} {direction} {quoted}", prefix)
+            except (AdbError, OSError) as e:
+                print_line(f"{prefix}Error: {e}")
+                return False
+        return services["run_on_selected"](run)
+
+    registry.register("pull", lambda parsed: transfer_command("pull", parsed), USAGE_PULL,
+                      "Copy files from the device over parallel sync connections, skipping "
+                      "files that are up to date and resuming interrupted folders. Other "
+                      "options are passed to adb pull", min_args=1, max_args=None)
+    registry.register("push", lambda parsed: transfer_command("push", parsed), USAGE_PUSH,
+                      "Copy files to the device over parallel sync connections, skipping "
+                      "files that are up to date and resuming interrupted folders. Other "
+                      "options are passed to adb push", min_args=2, max_args=None)
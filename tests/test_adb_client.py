@@ -0,0 +1,207 @@
+"""Tests for the in-process adb client, run against fake adb servers."""
+import socket
+from threading import Thread
+
+import pytest
+
+from fake_adb_server import FakeAdbServer
+from adb_client import (AdbClient, AdbConnectionError, AdbError, LinePrinter, parse_devices,
+                        run_native_command)
+
+
+class ScriptedServer:  # pylint: disable=too-few-public-methods
+    """Answers one connection with canned bytes and records what the client sent."""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.received = b""
+        self._listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self._listener.getsockname()[1]
+        self._thread = Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        client, _ = self._listener.accept()
+        with client:
+            client.settimeout(5)
+            # Every request of these tests fits in one read
+            self.received = client.recv(4096)
+            client.sendall(self.reply)
+        self._listener.close()
+
+    def join(self):
+        """Wait until the connection was answered."""
+        self._thread.join(5)
+
+
+@pytest.fixture(name="server")
+def fixture_server():
+    """A fake adb server with two devices."""
+    server = FakeAdbServer(device_count=2).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(name="client")
+def fixture_client(server):
+    """A client talking to the fake server."""
+    return AdbClient(port=server.port)
+
+
+def test_request_is_length_prefixed():
+    """Requests go out as four hex digits of length and the payload."""
+    server = ScriptedServer(b"OKAY0004001f")
+    assert AdbClient(port=server.port).version() == 31
+    server.join()
+    assert server.received == b"000chost:version"
+
+
+def test_fail_raises_with_message():
+    """A FAIL status raises AdbError carrying the server's message."""
+    server = ScriptedServer(b"FAIL0014device 'x' not found")
+    with pytest.raises(AdbError, match="device 'x' not found"):
+        AdbClient(port=server.port).query("host:transport:x")
+    server.join()
+
+
+def test_unexpected_status_raises():
+    """Anything but OKAY or FAIL is a protocol error."""
+    server = ScriptedServer(b"WHAT")
+    with pytest.raises(AdbError, match="unexpected response"):
+        AdbClient(port=server.port).query("host:version")
+    server.join()
+
+
+def test_closed_connection_raises():
+    """A server closing mid-reply raises AdbError instead of returning half a string."""
+    server = ScriptedServer(b"OKAY0010short")
+    with pytest.raises(AdbError, match="closed the connection"):
+        AdbClient(port=server.port).query("host:devices")
+    server.join()
+
+
+def test_unreachable_server_raises_connection_error():
+    """No server listening is reported as AdbConnectionError."""
+    with socket.create_server(("127.0.0.1", 0)) as listener:
+        port = listener.getsockname()[1]
+    with pytest.raises(AdbConnectionError):
+        AdbClient(port=port, timeout=1.0).version()
+
+
+def test_devices(client, server):
+    """host:devices is parsed into (serial, state) tuples."""
+    assert client.devices() == [(serial, "device") for serial in server.serials]
+
+
+def test_parse_devices_skips_blank_lines():
+    """Blank and malformed lines of a listing are ignored."""
+    assert parse_devices("a\tdevice\n\nb\toffline\r\nbroken\n") == [
+        ("a", "device"), ("b", "offline")]
+
+
+def test_shell_on_device(client, server):
+    """shell: runs on the device picked with host:transport."""
+    output = b"".join(client.shell("echo hello", server.serials[1]))
+    assert output == b"hello\n"
+
+
+def test_unknown_device_fails(client):
+    """A transport to a missing device raises AdbError."""
+    with pytest.raises(AdbError):
+        b"".join(client.shell("echo hello", "missing"))
+
+
+def test_native_devices(client, server, capsys):
+    """`devices` is answered by the client and prints adb's listing."""
+    assert run_native_command(client, "devices") is True
+    output = capsys.readouterr().out
+    assert output.startswith("List of devices attached\n")
+    for serial in server.serials:
+        assert f"{serial}\tdevice\n" in output
+
+
+def test_native_version(client, capsys):
+    """`version` reports the server's protocol version."""
+    assert run_native_command(client, "version") is True
+    assert capsys.readouterr().out == "Android Debug Bridge version 1.0.41\n"
+
+
+def test_native_connect(client, capsys):
+    """`connect` prints the server's reply and succeeds unless it says otherwise."""
+    assert run_native_command(client, "connect 10.0.0.2:5555") is True
+    assert "10.0.0.2:5555" in capsys.readouterr().out
+
+
+def test_native_shell_with_serial_and_prefix(client, server, capsys):
+    """`-s serial shell` runs on that device and prefixes every line."""
+    result = run_native_command(client, f"-s {server.serials[1]} shell echo hi there",
+                                prefix="[dev] ")
+    assert result is True
+    assert capsys.readouterr().out == "[dev] hi there\n"
+
+
+def test_native_shell_keeps_backslashes(client, capsys):
+    """Backslashes reach the device as typed, like they do through adb.exe."""
+    assert run_native_command(client, r'shell echo "\d+" C:\x') is True
+    assert capsys.readouterr().out == "\\d+ C:\\x\n"
+
+
+def test_android_serial_picks_the_device(client, server, monkeypatch):
+    """Without -s, ANDROID_SERIAL picks the device like it does for adb.exe."""
+    monkeypatch.setenv("ANDROID_SERIAL", "missing")
+    with pytest.raises(AdbError):
+        b"".join(client.shell("echo hello"))
+    monkeypatch.setenv("ANDROID_SERIAL", server.serials[1])
+    assert b"".join(client.shell("echo hello")) == b"hello\n"
+
+
+@pytest.mark.parametrize("args", [
+    "install app.apk",
+    "shell -t ls",
+    "shell",
+    "logcat -d",
+    "shell echo 'unbalanced",
+    "",
+])
+def test_unsupported_commands_fall_back(client, args, capsys):
+    """Commands the client cannot run return None so adb.exe runs them, printing nothing."""
+    assert run_native_command(client, args) is None
+    assert capsys.readouterr().out == ""
+
+
+def test_unreachable_server_is_raised_for_the_caller(capsys):
+    """Without a server the error reaches the caller, which falls back to adb.exe."""
+    with socket.create_server(("127.0.0.1", 0)) as listener:
+        port = listener.getsockname()[1]
+    with pytest.raises(AdbConnectionError):
+        run_native_command(AdbClient(port=port, timeout=1.0), "devices")
+    assert capsys.readouterr().out == ""
+
+
+def test_line_printer_without_prefix_prints_chunks(capsys):
+    """Without a prefix chunks are printed as they come, partial lines included."""
+    printer = LinePrinter()
+    assert printer.write(b"one\ntw") == "one\ntw"
+    assert printer.write(b"o\n") == "o\n"
+    assert printer.flush() == ""
+    assert capsys.readouterr().out == "one\ntwo\n"
+
+
+def test_line_printer_prefixes_whole_lines(capsys):
+    """With a prefix only whole lines are printed, each with the prefix."""
+    printer = LinePrinter("[a] ")
+    printer.write(b"one\ntw")
+    assert capsys.readouterr().out == "[a] one\n"
+    printer.write(b"o\nthree")
+    assert capsys.readouterr().out == "[a] two\n"
+    assert printer.flush() == "three"
+    assert capsys.readouterr().out == "[a] three\n"
+
+
+def test_line_printer_joins_split_characters(capsys):
+    """A UTF-8 character split across chunks is decoded once both halves arrived."""
+    printer = LinePrinter("> ")
+    data = "grüße\n".encode("utf-8")
+    printer.write(data[:3])
+    printer.write(data[3:])
+    assert capsys.readouterr().out == "> grüße\n"
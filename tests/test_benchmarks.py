@@ -0,0 +1,24 @@
+"""Tests for comparing benchmark results with a baseline."""
+import pytest
+
+from run_benchmarks import compare, mode_mismatch
+
+
+@pytest.mark.parametrize("baseline, comparable", [
+    ({"mode": "full"}, True),
+    ({"quick": False}, True),
+    ({"mode": "quick"}, False),
+    ({"quick": True}, False),
+    ({}, False),
+])
+def test_only_same_mode_is_compared(baseline, comparable):
+    """Full results are only compared with a full baseline."""
+    assert (mode_mismatch({"mode": "full"}, baseline) is None) is comparable
+
+
+def test_regressions_respect_direction():
+    """Higher MB/s and lower times are improvements."""
+    rows = compare({"metrics": {"stream_mb_s": 50.0, "dispatch_us": 10.0, "new_ms": 1.0}},
+                   {"metrics": {"stream_mb_s": 100.0, "dispatch_us": 12.0}}, 0.25)
+    assert [(name, regressed) for name, _, _, _, regressed in rows] == [
+        ("stream_mb_s", True), ("dispatch_us", False)]
@@ -0,0 +1,45 @@
+"""Tests for splitting command arguments the way Windows paths need."""
+import pytest
+
+from capture import _SCREENCAP_OPTIONS, SCREENCAP_USAGE, parse_capture_args
+from commands import split_args
+from logcat import parse_logcat_args
+from pipeline import split_pipeline
+
+
+@pytest.mark.parametrize("text, expected", [
+    (r"--out C:\logs\x.txt", ["--out", r"C:\logs\x.txt"]),
+    (r'--out "C:\My Logs\x.txt" --gzip', ["--out", r"C:\My Logs\x.txt", "--gzip"]),
+    ("grep 'two words' #1", ["grep", "two words", "#1"]),
+    (r"\\server\share\a.txt", [r"\\server\share\a.txt"]),
+    ("", []),
+])
+def test_split_args_keeps_backslashes(text, expected):
+    """Quotes group words and are removed, backslashes and # are kept."""
+    assert split_args(text) == expected
+
+
+def test_split_args_unclosed_quote():
+    """An unclosed quote is an error, like shlex.split."""
+    with pytest.raises(ValueError):
+        split_args('--out "C:\\logs')
+
+
+def test_logcat_out_keeps_windows_path():
+    """logcat --out gets the path as typed."""
+    options = parse_logcat_args(split_args(r"--out C:\logs\x.txt --tag ActivityManager"))
+    assert options["out"] == r"C:\logs\x.txt"
+    assert options["tags"] == ["ActivityManager"]
+
+
+def test_capture_out_keeps_windows_path():
+    """screencap --out gets the folder as typed."""
+    options = parse_capture_args(split_args(r'--out "D:\Shots\run 1" --fps 2'),
+                                 _SCREENCAP_OPTIONS, SCREENCAP_USAGE)
+    assert options == {"out": r"D:\Shots\run 1", "fps": "2"}
+
+
+def test_pipeline_stages_keep_backslashes():
+    """tee paths and grep patterns keep their backslashes."""
+    assert split_pipeline(r'logcat -d | grep "\d+ ms" | tee C:\out\log.txt') == (
+        "logcat -d", [["grep", r"\d+ ms"], ["tee", r"C:\out\log.txt"]])
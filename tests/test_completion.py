@@ -0,0 +1,30 @@
+"""Tests for the persistent command history."""
+import completion
+from completion import History
+
+
+class StubReadline:
+    """A readline like pyreadline3's, which has no append_history_file."""
+
+    def __init__(self):
+        self.lines = []
+
+    def add_history(self, line):
+        """Remember a line, as input() does."""
+        self.lines.append(line)
+
+    def write_history_file(self, path):
+        """Write the whole history."""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("".join(f"{line}\n" for line in self.lines))
+
+
+def test_history_is_saved_without_append(tmp_path, monkeypatch):
+    """Without append_history_file every command is still saved."""
+    stub = StubReadline()
+    monkeypatch.setattr(completion, "readline", stub)
+    history = History(str(tmp_path / "history.txt"))
+    for line in ("devices", "shell ls"):
+        stub.add_history(line)
+        history.add(line)
+    assert (tmp_path / "history.txt").read_text(encoding="utf-8") == "devices\nshell ls\n"
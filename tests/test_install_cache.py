@@ -0,0 +1,19 @@
+"""Tests for the install ledger's skip decision."""
+from install_cache import InstallCache
+
+
+def test_missing_package_is_not_installed(tmp_path):
+    """A build recorded without a versionCode is not skipped once it was uninstalled."""
+    cache = InstallCache(str(tmp_path / "install_cache.json"))
+    cache.record("dev1", "com.example.a", "hash", None)
+    assert not cache.is_installed("dev1", "com.example.a", "hash", None)
+
+
+def test_same_build_is_installed(tmp_path):
+    """The same hash and versionCode on the device is skipped, anything else is not."""
+    cache = InstallCache(str(tmp_path / "install_cache.json"))
+    cache.record("dev1", "com.example.a", "hash", 7)
+    assert cache.is_installed("dev1", "com.example.a", "hash", 7)
+    assert not cache.is_installed("dev1", "com.example.a", "hash", 6)
+    assert not cache.is_installed("dev1", "com.example.a", "other", 7)
+    assert not cache.is_installed("dev2", "com.example.a", "hash", 7)
@@ -0,0 +1,20 @@
+"""Tests for command timing and profiling."""
+from commands import CommandRegistry
+from metrics import metrics, register_timing_commands
+
+
+def test_profiled_command_is_counted_once(capsys):
+    """profile runs its command untimed, so the command line is recorded once."""
+    registry = CommandRegistry()
+    register_timing_commands(registry, {"run_line": lambda line: print("ran", line)})
+    before = sum(metrics.snapshot()["commands"].values())
+
+    timing = metrics.start("profile devices")
+    handled, result = registry.dispatch(timing.command)
+    metrics.finish(timing, result)
+
+    assert handled
+    assert sum(metrics.snapshot()["commands"].values()) == before + 1
+    output = capsys.readouterr().out
+    assert output.startswith("ran devices\n")
+    assert "function calls" in output
@@ -0,0 +1,81 @@
+"""Tests for when the package index is refreshed."""
+import pytest
+
+from package_index import SEPARATOR, PackageIndex, changes_packages
+
+
+LISTING = (f"package:/data/app/a/base.apk=com.example.a versionCode:3 uid:10100\n"
+           f"package:/system/app/B.apk=com.example.b versionCode:1 uid:10101\n"
+           f"{SEPARATOR}\npackage:com.example.b\n")
+
+
+class Sessions:  # pylint: disable=too-few-public-methods
+    """Answers the bulk package query like a device would, counting the queries."""
+
+    def __init__(self):
+        self.queries = 0
+
+    def output(self, command, serial):  # pylint: disable=unused-argument
+        """Return (exit code, output) of a command."""
+        self.queries += 1
+        return 0, LISTING
+
+
+@pytest.fixture(name="index")
+def fixture_index(tmp_path):
+    """An index of one device, kept in a temporary folder."""
+    index = PackageIndex(str(tmp_path / "package_cache.json"))
+    index.refresh(Sessions(), "dev1")
+    return index
+
+
+@pytest.mark.parametrize("args, expected", [
+    ("install app.apk", (True, None)),
+    ("-s dev1 install-multiple a.apk b.apk", (True, "dev1")),
+    ("uninstall com.example.a", (True, None)),
+    ("-s dev1 shell pm uninstall com.example.a", (True, "dev1")),
+    ("shell pm disable-user com.example.a", (True, None)),
+    ("shell cmd package install-existing com.example.a", (True, None)),
+    ("shell pm list packages", (False, None)),
+    ("shell ls /sdcard", (False, None)),
+    ("-s dev1 logcat", (False, "dev1")),
+    ("", (False, None)),
+])
+def test_changes_packages(args, expected):
+    """Installs, uninstalls and pm state changes are recognized, listings are not."""
+    assert changes_packages(args) == expected
+
+
+def test_index_is_fresh_after_refresh(index):
+    """A refreshed index is served without asking the device again."""
+    assert index.is_fresh("dev1")
+    assert index.names("dev1") == ["com.example.a", "com.example.b"]
+    assert index.names("dev1", enabled=False) == ["com.example.b"]
+
+
+def test_package_commands_make_the_index_stale(index):
+    """Only commands that change packages mark the index stale."""
+    assert not index.note_command("-s dev1 shell pm list packages")
+    assert index.is_fresh("dev1")
+    assert index.note_command("-s dev1 uninstall com.example.a")
+    assert not index.is_fresh("dev1")
+
+
+def test_command_without_serial_makes_every_index_stale(index):
+    """Without -s the device is unknown, so every device's index is marked stale."""
+    index.refresh(Sessions(), "dev2")
+    index.note_command("install app.apk")
+    assert not index.is_fresh("dev1")
+    assert not index.is_fresh("dev2")
+
+
+@pytest.mark.parametrize("event, state, fresh", [
+    ("added", "device", False),
+    ("changed", "device", False),
+    ("changed", "offline", True),
+    ("removed", "device", True),
+])
+def test_reconnected_device_makes_its_index_stale(index, event, state, fresh):
+    """A device coming (back) online may have new packages."""
+    index.device_event(event, "dev1", state)
+    assert index.is_fresh("dev1") is fresh
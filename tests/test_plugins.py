@@ -0,0 +1,50 @@
+"""Tests for registering plugin commands next to the built-in ones."""
+import json
+
+from commands import CommandRegistry
+from plugins import PluginManager
+
+
+MOD_SOURCE = '''
+def register(shell):
+    shell.command("config", lambda args: print("mod config"))
+    shell.command("hello", lambda args: print("hello", args))
+'''
+
+
+def make_plugin(directory, commands):
+    """Write a plugin declaring commands into directory/mods/clash."""
+    folder = directory / "mods" / "clash"
+    folder.mkdir(parents=True)
+    (folder / "mod.json").write_text(json.dumps({"commands": commands}), encoding="utf-8")
+    (folder / "mod.py").write_text(MOD_SOURCE, encoding="utf-8")
+    return str(directory / "mods")
+
+
+def test_plugin_commands_do_not_replace_built_ins(tmp_path, capsys):
+    """A plugin command named like a built-in is skipped with a warning."""
+    registry = CommandRegistry()
+    registry.register("config", lambda parsed: print("built-in config"),
+                      help_text="Open the configuration window", custom=False)
+    manager = PluginManager({})
+    manager.discover(make_plugin(tmp_path, {"config": "Mod config", "hello": "Say hello"}))
+
+    assert manager.register_commands(registry) == ["config"]
+    assert "Warning: Mod clash declares the command 'config'" in capsys.readouterr().out
+
+    assert registry.dispatch("config") == (True, None)
+    assert capsys.readouterr().out == "built-in config\n"
+    assert registry.commands["config"].custom is False
+    assert registry.help_lines() == ["  config - Open the configuration window",
+                                     "  hello - Say hello (mod)"]
+
+
+def test_plugin_commands_are_dispatched_to_the_plugin(tmp_path, capsys):
+    """A plugin command without a clash loads the plugin and runs it."""
+    registry = CommandRegistry()
+    manager = PluginManager({})
+    manager.discover(make_plugin(tmp_path, {"hello": "Say hello"}))
+
+    assert not manager.register_commands(registry)
+    assert registry.dispatch("hello world") == (True, True)
+    assert capsys.readouterr().out == "hello world\n"
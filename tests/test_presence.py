@@ -0,0 +1,130 @@
+"""Tests for the Rich Presence mod, run against a stand-in for Discord's IPC socket."""
+import json
+import os
+import socket
+import struct
+import sys
+from threading import Lock, Thread
+from time import monotonic, sleep
+
+import pytest
+
+pytest.importorskip("pypresence")
+if not hasattr(socket, "AF_UNIX"):
+    pytest.skip("Discord uses a named pipe on Windows", allow_module_level=True)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "mods", "rich_presence"))
+import presence  # noqa: E402  pylint: disable=wrong-import-position,import-error
+
+
+class FakeDiscord:
+    """Answers the IPC handshake and activity commands, recording what was sent."""
+
+    def __init__(self, directory):
+        self.handshakes = 0
+        self.activities = []  # The state text of each SET_ACTIVITY, None for a clear
+        self._clients = []
+        self._lock = Lock()
+        self._listener = socket.socket(socket.AF_UNIX)
+        self._listener.bind(os.path.join(directory, "discord-ipc-0"))
+        self._listener.listen()
+        Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._clients.append(client)
+            Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client):
+        reader = client.makefile("rb")
+        try:
+            while True:
+                header = reader.read(8)
+                if len(header) < 8:
+                    return
+                op, length = struct.unpack("<II", header)
+                payload = json.loads(reader.read(length))
+                if op == 0:
+                    with self._lock:
+                        self.handshakes += 1
+                    reply = {"cmd": "DISPATCH", "evt": "READY", "data": {}}
+                elif op == 1 and payload.get("cmd") == "SET_ACTIVITY":
+                    activity = payload["args"].get("activity")
+                    with self._lock:
+                        self.activities.append(activity and activity.get("state"))
+                    reply = {"cmd": "SET_ACTIVITY", "evt": None, "nonce": payload.get("nonce"),
+                             "data": {}}
+                else:
+                    return
+                data = json.dumps(reply).encode("utf-8")
+                client.sendall(struct.pack("<II", 1, len(data)) + data)
+        except (OSError, ValueError):
+            pass
+
+    def drop(self):
+        """Close every connection, like Discord restarting."""
+        with self._lock:
+            clients, self._clients = self._clients, []
+        for client in clients:
+            client.shutdown(socket.SHUT_RDWR)
+            client.close()
+
+    def close(self):
+        """Stop listening."""
+        self._listener.close()
+        self.drop()
+
+
+def wait_until(condition, timeout=10.0):
+    """Wait for condition() to hold."""
+    deadline = monotonic() + timeout
+    while not condition():
+        assert monotonic() < deadline, "timed out"
+        sleep(0.02)
+
+
+@pytest.fixture(name="discord")
+def fixture_discord(monkeypatch, tmp_path):
+    """A fake Discord that pypresence finds through XDG_RUNTIME_DIR."""
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    monkeypatch.setattr(presence, "DEBOUNCE", 0.2)
+    server = FakeDiscord(str(tmp_path))
+    yield server
+    server.close()
+
+
+def test_presence_keeps_one_connection_and_sends_only_changes(discord):
+    """Updates share one connection, unchanged presence sends nothing, a dropped pipe
+    is reconnected."""
+    state = presence.ShellState(True, "1")
+    updater = Thread(target=presence.run_updater, args=(state,), daemon=True)
+    updater.start()
+    try:
+        wait_until(lambda: discord.activities)
+        for devices in "23456":
+            state.set(devices=devices)
+            wait_until(lambda devices=devices: f"to {devices} device" in discord.activities[-1])
+        assert discord.handshakes == 1
+
+        sent = len(discord.activities)
+        state.set(devices="6")
+        state.set(enabled=False)
+        wait_until(lambda: len(discord.activities) > sent)
+        state.set(devices="7")  # Hidden while disabled, so nothing changes in Discord
+        sleep(presence.DEBOUNCE * 3)
+        assert discord.activities[sent:] == [None]
+
+        discord.drop()
+        state.set(enabled=True)
+        wait_until(lambda: "to 7 device" in (discord.activities[-1] or ""))
+        assert discord.handshakes == 2
+    finally:
+        state.set(exiting=True)
+        updater.join(5)
+    assert not updater.is_alive()
@@ -0,0 +1,175 @@
+"""Tests for deciding which files a pull or push copies."""
+import os
+import posixpath
+import stat
+
+import pytest
+
+import sync_transfer
+from commands import CommandRegistry, split_args
+from sync_transfer import (MAX_LINKS, SIZE_LIMIT, LinkError, Manifest, SyncConnection,
+                           parse_transfer_args, plan_pull, plan_push, walk_remote)
+
+MTIME = 1700000000
+
+
+class FakeSync(SyncConnection):
+    """Stands in for a device's sync service, serving a fake file tree with symlinks."""
+
+    files = {}  # Device path: (size, mtime, data)
+    links = {}  # Device path of a symlink: its target
+
+    def __init__(self, client=None, serial=None):  # pylint: disable=super-init-not-called
+        pass
+
+    def _real(self, path):
+        """Follow the symlinks in a path."""
+        path = path.rstrip("/") or "/"
+        for _ in range(20):
+            link = next((link for link in self.links
+                         if path == link or path.startswith(link + "/")), None)
+            if link is None:
+                break
+            path = self.links[link] + path[len(link):]
+        return path
+
+    def _is_dir(self, path):
+        return any(name.startswith(path + "/") for name in [*self.files, *self.links])
+
+    def stat(self, path):
+        """Return (mode, size, mtime) of the path itself, like lstat; sizes wrap at 4 GiB."""
+        path = posixpath.join(self._real(posixpath.dirname(path)), posixpath.basename(path))
+        if path in self.links:
+            return stat.S_IFLNK | 0o777, len(self.links[path]), MTIME
+        if path in self.files:
+            size, mtime, _ = self.files[path]
+            return stat.S_IFREG | 0o644, size % SIZE_LIMIT, mtime
+        if self._is_dir(path):
+            return stat.S_IFDIR | 0o755, 4096, MTIME
+        return 0, 0, 0
+
+    def _list(self, path):
+        """Return the LIST entries of a folder, "." and ".." included, none for a file."""
+        path = self._real(path)
+        if not self._is_dir(path):
+            return []
+        names = {name[len(path) + 1:].split("/")[0] for name in [*self.files, *self.links]
+                 if name.startswith(path + "/")}
+        return [(".", stat.S_IFDIR, 0, MTIME), ("..", stat.S_IFDIR, 0, MTIME)] + [
+            (name, *self.stat(f"{path}/{name}")) for name in sorted(names)]
+
+    def pull(self, remote, local, mtime, progress):
+        """Write the device file locally, following symlinks like RECV does."""
+        data = self.files[self._real(remote)][2]
+        with open(local, "wb") as f:
+            f.write(data)
+        os.utime(local, (mtime, mtime))
+        progress.add(len(data))
+
+    def close(self):
+        """Nothing to close."""
+
+
+@pytest.fixture(name="device")
+def fixture_device(monkeypatch, tmp_path):
+    """
+    A fake device with a folder of two files under /sdcard, which is a symlink
+    like on real devices; manifests go to tmp_path.
+    """
+    monkeypatch.setattr(FakeSync, "files", {
+        "/storage/emulated/0/d/a.txt": (5, MTIME, b"hello"),
+        "/storage/emulated/0/d/b.txt": (3, MTIME, b"bye"),
+        "/storage/emulated/0/DCIM/c.jpg": (4, MTIME, b"jpeg")})
+    monkeypatch.setattr(FakeSync, "links", {"/sdcard": "/storage/emulated/0"})
+    monkeypatch.setattr(sync_transfer, "SyncConnection", FakeSync)
+    monkeypatch.chdir(tmp_path)
+    return FakeSync()
+
+
+def write(path, data, mtime=MTIME):
+    """Create a local file with an mtime."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, (mtime, mtime))
+
+
+def test_windows_paths_are_kept():
+    """Backslashes of Windows paths survive the argument parsing."""
+    options, paths = parse_transfer_args(split_args(r'--jobs 2 /sdcard/d "C:\My Files\d"'))
+    assert options["jobs"] == 2
+    assert paths == ["/sdcard/d", r"C:\My Files\d"]
+
+
+def test_pull_skips_matching_files(device, tmp_path):
+    """A local file of the same size and mtime is current."""
+    write(str(tmp_path / "out" / "d" / "a.txt"), b"hello")
+    tasks, current, present = plan_pull(device, "/sdcard/d", str(tmp_path / "out"))
+    assert len(tasks) == 2
+    assert current == present == {str(tmp_path / "out" / "d" / "a.txt")}
+
+
+def test_files_of_4_gib_are_always_copied(device, tmp_path):
+    """Sizes wrap at 4 GiB, so a big file matching the wrapped size is not trusted."""
+    big = str(tmp_path / "big.bin")
+    with open(big, "wb") as f:
+        f.truncate(SIZE_LIMIT + 3)  # Sparse, takes no space
+    os.utime(big, (MTIME, MTIME))
+    FakeSync.files["/storage/emulated/0/big.bin"] = (3, MTIME, b"")  # What a 4 GiB + 3 file reports
+    tasks, current, present = plan_push(device, [big], "/sdcard/big.bin")
+    assert [task[2] for task in tasks] == [SIZE_LIMIT + 3]
+    assert not current
+    assert present == {"/sdcard/big.bin"}
+
+
+@pytest.mark.usefixtures("device")
+def test_manifest_does_not_skip_deleted_files(tmp_path, capsys):
+    """A file an interrupted pull finished is pulled again once it was deleted locally."""
+    local = str(tmp_path / "out")
+    os.makedirs(local)
+    key = "|".join(["pull", "dev", "/sdcard/d", os.path.abspath(local)])
+    manifest = Manifest(key)
+    for name, (size, mtime, _) in FakeSync.files.items():
+        manifest.record(os.path.join(local, "d", name.rsplit("/", 1)[1]), size, mtime)
+    manifest.save()
+    write(os.path.join(local, "d", "b.txt"), b"bye", MTIME + 60)  # Changed since, but listed
+
+    options = {"jobs": 1, "force": False}
+    assert sync_transfer.transfer(None, "dev", "pull", ["/sdcard/d", local], options)
+    assert "1 file(s) pulled, 1 skipped" in capsys.readouterr().out
+    with open(os.path.join(local, "d", "a.txt"), "rb") as f:
+        assert f.read() == b"hello"
+
+
+def test_symlinked_folders_are_followed(device, tmp_path):
+    """A symlinked root and symlinked subfolders are pulled as folders."""
+    FakeSync.links["/storage/emulated/0/d/camera"] = "/storage/emulated/0/DCIM"
+    tasks, _, _ = plan_pull(device, "/sdcard/d", str(tmp_path))
+    assert sorted(task[0] for task in tasks) == [
+        "/sdcard/d/a.txt", "/sdcard/d/b.txt", "/sdcard/d/camera/c.jpg"]
+
+
+def test_symlink_loops_end(device):
+    """A symlink to a folder containing it is followed at most MAX_LINKS times."""
+    FakeSync.links["/storage/emulated/0/d/loop"] = "/storage/emulated/0/d"
+    assert len(walk_remote(device, "/sdcard/d")) == 2 * (MAX_LINKS + 1)
+
+
+def test_symlinked_file_is_left_to_adb(device, tmp_path):
+    """A symlink to a file has the link's size and mtime, so adb pulls it instead."""
+    FakeSync.links["/storage/emulated/0/latest.txt"] = "/storage/emulated/0/d/a.txt"
+    with pytest.raises(LinkError):
+        plan_pull(device, "/sdcard/latest.txt", str(tmp_path))
+
+
+@pytest.mark.usefixtures("device")
+def test_pull_of_symlinked_file_runs_adb():
+    """pull hands a symlinked file to the adb executable instead of failing."""
+    FakeSync.links["/storage/emulated/0/latest.txt"] = "/storage/emulated/0/d/a.txt"
+    commands = []
+    registry = CommandRegistry()
+    sync_transfer.register_transfer_commands(registry, {
+        "client": None, "run_on_selected": lambda run: run("dev", ""),
+        "run_adb_on": lambda args, prefix: commands.append(args) or True})
+    assert registry.dispatch(r"pull /sdcard/latest.txt C:\out") == (True, True)
+    assert commands == [r'-s dev pull "/sdcard/latest.txt" "C:\out"']